@@ -0,0 +1,47 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Benchmark of `WeighingCalculator.calc` with many compositions.
+
+Usage:
+    python benchmarks/bench_calc.py
+'''
+
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from calculator import WeighingCalculator
+
+
+MATERIALS = ['Li2O', 'SiO2', 'MoO3']
+N_ROWS = (100, 1000, 10000, 100000)
+
+
+def bench_calc_ratio(n_rows:int, repeat:int = 3) -> float:
+    """return the best elapsed time (sec) of `calc(ratio=...)` with `n_rows` compositions."""
+    rng = np.random.default_rng(0)
+    ratio = rng.integers(1, 20, size = (n_rows, len(MATERIALS))).astype(float)
+    excess = {material: 0.05 for material in MATERIALS}
+    wc = WeighingCalculator(MATERIALS)
+    best = float('inf')
+    for _ in range(repeat):
+        t = perf_counter()
+        wc.calc(ratio = ratio, mg = 2000, excess = excess, progress_bar = False)
+        best = min(best, perf_counter() - t)
+    return best
+
+
+def main():
+    sys.stdout.write('{0:>10} {1:>12} {2:>14}\n'.format('rows', 'time (s)', 'rows / s'))
+    for n_rows in N_ROWS:
+        elapsed = bench_calc_ratio(n_rows)
+        sys.stdout.write('{0:>10} {1:>12.4f} {2:>14.0f}\n'.format(n_rows, elapsed, n_rows / elapsed))
+
+
+if __name__ == '__main__':
+    main()
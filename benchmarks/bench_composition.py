@@ -0,0 +1,70 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Benchmark of the sparse element-count matrix (`composition.CompositionMatrix`).
+
+* memory of the element counts of many formulas: dense rows over all elements vs CSR
+* time of solving the ratio of many products: `get_ratio` per chunk vs the vectorized solver
+  (the formulas are parsed beforehand, so only the solving is timed)
+
+Usage:
+    python benchmarks/bench_composition.py
+'''
+
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from calculator import WeighingCalculator, _get_ratio_chunk
+from composition import CompositionMatrix
+
+
+# 原料の多い系
+MATERIALS = ['Li2CO3', 'Na2CO3', 'K2CO3', 'MgO', 'CaCO3', 'SrCO3', 'BaCO3', 'La2O3', 'Y2O3', 'TiO2', 'ZrO2', 'Nb2O5', 'Ta2O5', 'Al2O3', 'SiO2', 'P2O5']
+N_PRODUCTS = (100, 1000, 10000)
+
+
+def _products(n_products:int) -> list:
+    """random mixtures of the materials written as formulas (all of them can be solved exactly)"""
+    rng = np.random.default_rng(0)
+    wc = WeighingCalculator(MATERIALS)
+    counts = wc._get_formula_counts(MATERIALS).to_dense()
+    elements = wc.atomic_weights.elements
+    products = []
+    for _ in range(n_products):
+        ratio = np.zeros(len(MATERIALS))
+        used = rng.choice(len(MATERIALS), size = 4, replace = False)
+        ratio[used] = rng.integers(1, 10, size = 4)
+        product_counts = ratio @ counts
+        products.append(''.join('{0}{1:g}'.format(elements[i], product_counts[i]) for i in np.nonzero(product_counts)[0]))
+    return products
+
+
+def main():
+    wc = WeighingCalculator(MATERIALS)
+    sys.stdout.write('{0:>8} {1:>12} {2:>12} {3:>14} {4:>14} {5:>8}\n'.format('products', 'dense (B)', 'CSR (B)', 'get_ratio (s)', 'vectorized (s)', 'speedup'))
+    for n_products in N_PRODUCTS:
+        products = _products(n_products)
+        counts = wc._get_formula_counts(products)    # ここで解析してキャッシュする．
+        dense = counts.to_dense()
+        assert np.array_equal(CompositionMatrix.from_dense(dense).to_dense(), dense)
+
+        t = perf_counter()
+        ar_ratio_old = _get_ratio_chunk(MATERIALS, products, True)
+        t_old = perf_counter() - t
+        t = perf_counter()
+        ar_ratio_new = wc._solve_ratio(products).to_numpy()
+        t_new = perf_counter() - t
+        assert np.allclose(ar_ratio_old, ar_ratio_new, equal_nan = True), 'The ratios differ.'
+
+        sys.stdout.write('{0:>8} {1:>12} {2:>12} {3:>14.4f} {4:>14.4f} {5:>7.1f}x\n'.format(
+            n_products, dense.nbytes, counts.nbytes, t_old, t_new, t_old / t_new
+        ))
+
+
+if __name__ == '__main__':
+    main()
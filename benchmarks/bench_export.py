@@ -0,0 +1,55 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Benchmark of the Excel export with many products.
+
+Usage:
+    python benchmarks/bench_export.py
+'''
+
+import os
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from calculator import WeighingCalculator
+from export import write_workbook
+
+
+MATERIALS = ['Li2O', 'SiO2', 'MoO3']
+N_PRODUCTS = (10, 100, 1000, 5000)
+
+
+def bench_export(n_products:int):
+    """return (elapsed time (sec), peak traced memory (MiB)) of `write_workbook` with `n_products` products."""
+    rng = np.random.default_rng(0)
+    wc = WeighingCalculator(MATERIALS)
+    wc.calc(ratio = rng.integers(1, 20, size = (n_products, len(MATERIALS))), excess = {'Li2O': 0.05}, progress_bar = False)
+    with tempfile.TemporaryDirectory() as dirname:
+        path = os.path.join(dirname, 'weighing.xlsx')
+        t = perf_counter()
+        write_workbook(path, wc)
+        elapsed = perf_counter() - t
+
+        # tracemallocは遅くなるので時間とは別に測る．
+        tracemalloc.start()
+        write_workbook(path, wc)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return elapsed, peak / 2 ** 20
+
+
+def main():
+    sys.stdout.write('{0:>10} {1:>12} {2:>14}\n'.format('products', 'time (s)', 'peak (MiB)'))
+    for n_products in N_PRODUCTS:
+        elapsed, peak = bench_export(n_products)
+        sys.stdout.write('{0:>10} {1:>12.4f} {2:>14.2f}\n'.format(n_products, elapsed, peak))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Parity check and benchmark of the formula parser (`formula.FormulaParser`) against `element_recognition`.
+
+* parity: element counts of various formulas (simple, decimals, fractions, nested parentheses and
+  inputs left to the fallback) must equal those of element_recognition, and those of hydrates
+  must equal HYDRATES (exit status 1 otherwise; the same cases are asserted in tests/test_formula.py)
+* time per formula: one formula per call (as `_get_formula_weight`) and a batch of formulas
+
+Usage:
+    python benchmarks/bench_formula.py
+'''
+
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+from element_recognition import element_recognition
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from calculator import get_atomic_weights
+from formula import FormulaError, FormulaParser
+
+
+PARITY = [
+    'Li2O', 'SiO2', 'MoO3', 'La2O3', 'TiO2', 'Li2CO3', 'H2O', 'O2', 'C', 'Og',
+    'Li0.33La0.55TiO3', 'Li.5La.5TiO3', 'Li2.O', 'Li1/3La5/9TiO3', 'LiNi1/3Co1/3Mn1/3O2',
+    'Ca(OH)2', 'Mg3(PO4)2', 'Al2(SO4)3', 'Ca5(PO4)3(OH)', '(NH4)2SO4', 'Fe(NO3)3', 'K2(Fe(CN)6)0.5',
+    'Li 2 O', 'Li2O0', 'LiLiO',
+    # 以下はelement_recognitionに任せるもの
+    '2H2O', 'Xx2O', 'li2O',
+]
+# element_recognitionでは読めないもの (期待される元素の数)
+HYDRATES = {
+    'CuSO4·5H2O': {'Cu': 1, 'S': 1, 'O': 9, 'H': 10},
+    'Al2(SO4)3*18H2O': {'Al': 2, 'S': 3, 'O': 30, 'H': 36},
+    'MgSO4•7H2O': {'Mg': 1, 'S': 1, 'O': 11, 'H': 14},
+    'K4[Fe(CN)6]·3H2O': {'K': 4, 'Fe': 1, 'C': 6, 'N': 6, 'H': 6, 'O': 3},
+}
+N_BATCH = 10000
+
+
+def _time(func, repeat:int = 5) -> float:
+    best = None
+    for _ in range(repeat):
+        t = perf_counter()
+        func()
+        elapsed = perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def check_parity(parser:FormulaParser) -> int:
+    """number of formulas whose counts differ from element_recognition (or from HYDRATES)"""
+    expected = element_recognition(PARITY, elements = parser.elements).values
+    actual = parser.parse_many(PARITY).to_dense()
+    n_failed = 0
+    for formula, a, b in zip(PARITY, actual, expected):
+        try:
+            parser.parse(formula)
+            path = 'parser'
+        except FormulaError:
+            path = 'fallback'
+        ok = np.allclose(a, b, rtol = 1e-12, atol = 0)
+        n_failed += not ok
+        sys.stdout.write('{0:<24} {1:<9} {2}\n'.format(formula, path, 'ok' if ok else 'DIFFERENT'))
+    for formula, expected_counts in HYDRATES.items():
+        counts = parser.parse_many([formula])
+        actual_counts = dict(zip([parser.elements[i] for i in counts.indices], counts.data))
+        ok = actual_counts == expected_counts
+        n_failed += not ok
+        sys.stdout.write('{0:<24} {1:<9} {2}\n'.format(formula, 'parser', 'ok' if ok else 'DIFFERENT {}'.format(actual_counts)))
+    return n_failed
+
+
+def main():
+    parser = FormulaParser(get_atomic_weights().elements)
+    n_failed = check_parity(parser)
+
+    rng = np.random.default_rng(0)
+    batch = ['Li{0:.3g}La{1:.3g}Ti(O{2:.3g})2'.format(*x) for x in rng.uniform(0.1, 3, size = (N_BATCH, 3))]
+    single = 'Li0.33La0.55TiO3'
+    t_single_library = _time(lambda: element_recognition([single], elements = parser.elements))
+    t_single_parser = _time(lambda: parser.parse_many([single]))
+    t_batch_library = _time(lambda: element_recognition(batch, elements = parser.elements), repeat = 1) / N_BATCH
+    t_batch_parser = _time(lambda: parser.parse_many(batch), repeat = 3) / N_BATCH
+
+    sys.stdout.write('\n{0:<26} {1:>16} {2:>14} {3:>8}\n'.format('per formula', 'element_recog.', 'parser', 'speedup'))
+    for name, t_library, t_parser in (('single call', t_single_library, t_single_parser), ('batch of {}'.format(N_BATCH), t_batch_library, t_batch_parser)):
+        sys.stdout.write('{0:<26} {1:>13.1f} us {2:>11.1f} us {3:>7.1f}x\n'.format(name, t_library * 1e6, t_parser * 1e6, t_library / t_parser))
+    if n_failed:
+        sys.stdout.write('\n{} formulas differ from the expected counts.\n'.format(n_failed))
+    return 1 if n_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Benchmark of the exact rational mode (`calc(rational = True)`) against the float engine.
+
+* time of `calc` with integer ratios (int64 fast path) and with ratios like 1/3 (Python int path)
+* error of the total weight from the theoretical amount (mg)
+
+Usage:
+    python benchmarks/bench_rational.py
+'''
+
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+from calculator import WeighingCalculator
+
+
+MATERIALS = ['Li2O', 'La2O3', 'TiO2']
+N_ROWS = (100, 10000, 100000)
+MG = 2000
+
+
+def _ratios(n_rows:int) -> dict:
+    rng = np.random.default_rng(0)
+    integers = rng.integers(1, 20, size = (n_rows, len(MATERIALS)))
+    return {
+        'integer': integers.astype(float),
+        'thirds': integers / 3,    # 10進数で書けない比率
+    }
+
+
+def bench(ratio:np.ndarray, rational:bool, repeat:int = 3) -> tuple:
+    """return (best time (sec), max |total weight - mg| (mg))"""
+    wc = WeighingCalculator(MATERIALS)
+    best = None
+    for _ in range(repeat):
+        t = perf_counter()
+        wc.calc(ratio = ratio, mg = MG, progress_bar = False, rational = rational)
+        elapsed = perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    error = np.abs(wc.df_material_weight.to_numpy().sum(axis = 1) - MG).max()
+    return best, error
+
+
+def main():
+    sys.stdout.write('{0:>8} {1:>8} {2:>12} {3:>12} {4:>8} {5:>14} {6:>14}\n'.format('rows', 'ratio', 'float (s)', 'rational (s)', 'ratio', 'float err (mg)', 'rational err'))
+    for n_rows in N_ROWS:
+        for name, ratio in _ratios(n_rows).items():
+            t_float, e_float = bench(ratio, False)
+            t_rational, e_rational = bench(ratio, True)
+            sys.stdout.write('{0:>8} {1:>8} {2:>12.4f} {3:>12.4f} {4:>7.2f}x {5:>14.3g} {6:>14.3g}\n'.format(
+                n_rows, name, t_float, t_rational, t_rational / t_float, e_float, e_rational
+            ))
+
+
+if __name__ == '__main__':
+    main()
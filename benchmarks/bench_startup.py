@@ -0,0 +1,86 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Benchmark of the application startup.
+
+* `-X importtime` breakdown of `import main` (the heaviest top-level modules).
+* time to the first window (needs a display).
+
+Usage:
+    python benchmarks/bench_startup.py
+'''
+
+import os
+import subprocess
+import sys
+from time import perf_counter
+
+
+path_root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+# 起動時に読み込まれてはいけないモジュール (初めての計算や保存のときに読み込む．)
+LAZY_MODULES = ('pandas', 'numpy', 'openpyxl', 'element_recognition', 'calculator')
+
+# start menuと同じ大きさのwindowを作って閉じるまで．
+SCRIPT_FIRST_WINDOW = '''
+import main
+app = main.gui()
+menu = main.Menu(layout = [[main.sg.Text(app.lang_dict[app.lang]['start_menu'])]])
+menu.make_window()
+menu.window.close()
+'''
+
+
+def import_time(n_top:int = 10) -> list:
+    """return [(cumulative time (us), module), ...] of `main` and the modules directly imported by it."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd = path_root, capture_output = True, text = True, check = True)
+    records = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2  # 入れ子の深さ (2 spacesずつ)
+        if depth <= 1:
+            records.append((int(cumulative), name.strip()))
+    return sorted(records, reverse = True)[:n_top]
+
+
+def loaded_lazy_modules() -> list:
+    """modules in LAZY_MODULES which are imported by `import main`."""
+    code = 'import sys, main; print(" ".join(m for m in {!r} if m in sys.modules))'.format(LAZY_MODULES)
+    result = subprocess.run([sys.executable, '-c', code], cwd = path_root, capture_output = True, text = True, check = True)
+    return result.stdout.split()
+
+
+def time_to_first_window(repeat:int = 3) -> float:
+    """return the best elapsed time (sec) from the process start to the first window, or None without a display."""
+    best = None
+    for _ in range(repeat):
+        t = perf_counter()
+        result = subprocess.run([sys.executable, '-c', SCRIPT_FIRST_WINDOW], cwd = path_root, capture_output = True, text = True)
+        elapsed = perf_counter() - t
+        if result.returncode != 0:
+            return None
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    sys.stdout.write('import time of `import main` (cumulative)\n')
+    for cumulative, name in import_time():
+        sys.stdout.write('{0:>10.1f} ms  {1}\n'.format(cumulative / 1000, name))
+
+    lazy = loaded_lazy_modules()
+    sys.stdout.write('\nmodules which should be imported lazily but are loaded at startup: {}\n'.format(', '.join(lazy) if lazy else 'none'))
+
+    elapsed = time_to_first_window()
+    if elapsed is None:
+        sys.stdout.write('time to first window: skipped (no display)\n')
+    else:
+        sys.stdout.write('time to first window: {:.3f} s\n'.format(elapsed))
+    return 1 if lazy else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Load generator of `server.py`.
+
+Each client keeps one connection alive and sends batched /calc requests one after another.
+p50/p99 latency and requests (records) per second are reported.
+
+Usage:
+    python benchmarks/load_server.py --spawn                    # start server.py on localhost and load it
+    python benchmarks/load_server.py --port 8080 -c 8 -b 100    # load a running server
+'''
+
+from time import perf_counter
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+
+path_root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+MATERIALS = ['Li2O', 'La2O3', 'TiO2']
+
+
+def make_body(batch:int, seed:int = 0) -> bytes:
+    rng = np.random.default_rng(seed)
+    ratio = rng.integers(1, 20, size = (batch, len(MATERIALS)))
+    records = [dict(zip(MATERIALS, row.tolist())) for row in ratio]
+    return json.dumps({'materials': MATERIALS, 'records': records, 'excess': {'Li2O': 5}}).encode('utf_8')
+
+
+async def _request(reader, writer, host:str, method:str, path:str, body:bytes = b'') -> tuple:
+    writer.write('{0} {1} HTTP/1.1\r\nHost: {2}\r\nContent-Type: application/json\r\nContent-Length: {3}\r\n\r\n'.format(method, path, host, len(body)).encode('latin_1') + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin_1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def _client(host:str, port:int, body:bytes, deadline:float, latencies:list, errors:list):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while perf_counter() < deadline:
+            t = perf_counter()
+            status, _ = await _request(reader, writer, host, 'POST', '/calc', body)
+            latencies.append(perf_counter() - t)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def run_load(host:str, port:int, concurrency:int = 4, batch:int = 10, duration:float = 5.) -> dict:
+    """load the server with `concurrency` keep-alive connections for `duration` seconds."""
+    body = make_body(batch)
+    # 1回目 (式量の計算) は除く．
+    reader, writer = await asyncio.open_connection(host, port)
+    await _request(reader, writer, host, 'POST', '/calc', body)
+    writer.close()
+
+    latencies = []
+    errors = []
+    t = perf_counter()
+    await asyncio.gather(*[_client(host, port, body, t + duration, latencies, errors) for _ in range(concurrency)])
+    elapsed = perf_counter() - t
+    ar = np.array(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'req/s': len(latencies) / elapsed,
+        'records/s': len(latencies) * batch / elapsed,
+        'p50 (ms)': np.percentile(ar, 50) * 1000,
+        'p99 (ms)': np.percentile(ar, 99) * 1000,
+    }
+
+
+async def _wait_ready(host:str, port:int, timeout:float = 30.):
+    deadline = perf_counter() + timeout
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            if perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+            continue
+        await _request(reader, writer, host, 'GET', '/health')
+        writer.close()
+        return
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Load generator of server.py.')
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8080)
+    parser.add_argument('--spawn', action = 'store_true', help = 'start server.py at --host:--port during the benchmark.')
+    parser.add_argument('-c', '--concurrency', type = int, nargs = '+', default = [1, 4, 16], help = 'number of connections. (default: 1 4 16)')
+    parser.add_argument('-b', '--batch', type = int, nargs = '+', default = [1, 100], help = 'records per request. (default: 1 100)')
+    parser.add_argument('-d', '--duration', type = float, default = 5., help = 'seconds per setting. (default: 5)')
+    args = parser.parse_args(argv)
+
+    process = None
+    if args.spawn:
+        process = subprocess.Popen([sys.executable, os.path.join(path_root, 'server.py'), '--host', args.host, '--port', str(args.port), '--materials'] + MATERIALS, cwd = path_root, stderr = subprocess.DEVNULL)
+    try:
+        asyncio.run(_wait_ready(args.host, args.port))
+        sys.stdout.write('{0:>6} {1:>6} {2:>9} {3:>7} {4:>10} {5:>12} {6:>10} {7:>10}\n'.format('conns', 'batch', 'requests', 'errors', 'req/s', 'records/s', 'p50 (ms)', 'p99 (ms)'))
+        for batch in args.batch:
+            for concurrency in args.concurrency:
+                r = asyncio.run(run_load(args.host, args.port, concurrency, batch, args.duration))
+                sys.stdout.write('{0:>6} {1:>6} {2:>9} {3:>7} {4:>10.1f} {5:>12.1f} {6:>10.2f} {7:>10.2f}\n'.format(
+                    concurrency, batch, r['requests'], r['errors'], r['req/s'], r['records/s'], r['p50 (ms)'], r['p99 (ms)']
+                ))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
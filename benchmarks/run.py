@@ -0,0 +1,94 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Run the benchmarks in `benchmarks/suite.py` and compare them with the stored baseline.
+
+Usage:
+    python benchmarks/run.py                 # compare with benchmarks/baseline.json
+    python benchmarks/run.py --save          # store the results as the new baseline
+    python benchmarks/run.py -k calc_ratio   # only benchmarks whose name contains "calc_ratio"
+
+The exit status is 1 when any benchmark is slower than `threshold` x baseline.
+'''
+
+from timeit import Timer
+import argparse
+import json
+import os
+import platform
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from suite import BENCHMARKS
+
+
+path_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def measure(func, repeat:int = 5, min_time:float = 0.2) -> float:
+    """return the best time per call (sec)."""
+    timer = Timer(func)
+    number, elapsed = timer.autorange()
+    if elapsed < min_time:     # 短すぎるとぶれるので少し長めに回す．
+        number = max(number, int(number * min_time / max(elapsed, 1e-9)))
+    return min(timer.repeat(repeat = repeat, number = number)) / number
+
+
+def _format_time(t:float) -> str:
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if t >= scale:
+            return '{0:.3g} {1}'.format(t / scale, unit)
+    return '{:.3g} ns'.format(t / 1e-9)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Run benchmarks of weighing_calculator.')
+    parser.add_argument('-k', '--filter', default = '', help = 'run only benchmarks whose name contains this string.')
+    parser.add_argument('--save', action = 'store_true', help = 'save the results as the baseline.')
+    parser.add_argument('--threshold', type = float, default = 1.5, help = 'ratio to the baseline regarded as a regression. (default: 1.5)')
+    parser.add_argument('--baseline', default = path_baseline, help = 'path of the baseline json.')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, mode = 'r', encoding = 'utf_8') as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    regressions = []
+    sys.stdout.write('{0:<32} {1:>12} {2:>12} {3:>8}\n'.format('benchmark', 'time', 'baseline', 'ratio'))
+    for name, func, param in BENCHMARKS:
+        if args.filter not in name:
+            continue
+        try:
+            t = measure(func(param))
+        except ImportError as e:    # 入っていないパッケージが必要なもの
+            sys.stdout.write('{0:<32} skipped ({1})\n'.format(name, e))
+            continue
+        results[name] = t
+        if name in baseline:
+            ratio = t / baseline[name]
+            mark = ' !' if ratio > args.threshold else ''
+            if mark:
+                regressions.append(name)
+            sys.stdout.write('{0:<32} {1:>12} {2:>12} {3:>7.2f}x{4}\n'.format(name, _format_time(t), _format_time(baseline[name]), ratio, mark))
+        else:
+            sys.stdout.write('{0:<32} {1:>12} {2:>12} {3:>8}\n'.format(name, _format_time(t), '-', '-'))
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, mode = 'w', encoding = 'utf_8') as f:
+            json.dump({
+                'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'processor': platform.processor()},
+                'results': baseline,
+            }, f, indent = 4)
+        sys.stdout.write('\nbaseline saved: {}\n'.format(args.baseline))
+    elif regressions:
+        sys.stdout.write('\nregressions (> {0}x baseline): {1}\n'.format(args.threshold, ', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
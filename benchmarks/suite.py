@@ -0,0 +1,233 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Benchmarks of the hot paths, run by `benchmarks/run.py`.
+
+Each benchmark is a function decorated with `@benchmark(name, params)`.
+It does its setup and returns the callable to be timed (the setup is not timed).
+'''
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir)))
+import calculator
+from calculator import WeighingCalculator
+from export import write_workbook
+
+
+MATERIALS = ['Li2O', 'La2O3', 'TiO2']
+
+# 登録されたbenchmark (name, function, param)
+BENCHMARKS = []
+
+
+def benchmark(name:str, params:tuple = (None,)):
+    def _register(func):
+        for param in params:
+            BENCHMARKS.append((name if param is None else '{0}[{1}]'.format(name, param), func, param))
+        return func
+    return _register
+
+
+def _products(n_products:int) -> list:
+    """Li(3x)La(2/3-x)TiO3 series"""
+    return ['Li{0:.4g}La{1:.4g}TiO3'.format(3 * x, 2 / 3 - x) for x in np.linspace(0.01, 0.16, n_products)]
+
+
+def _ratio(n_rows:int) -> np.ndarray:
+    return np.random.default_rng(0).integers(1, 20, size = (n_rows, len(MATERIALS))).astype(float)
+
+
+@benchmark('init')
+def bench_init(_):
+    return lambda: WeighingCalculator(MATERIALS)
+
+
+@benchmark('init_cold')
+def bench_init_cold(_):
+    # 式量のキャッシュが効かない場合
+    def _run():
+        calculator.formula_cache.clear()
+        WeighingCalculator(MATERIALS)
+    return _run
+
+
+@benchmark('get_formula_weight_cold')
+def bench_get_formula_weight_cold(_):
+    wc = WeighingCalculator(MATERIALS)
+
+    def _run():
+        calculator.formula_cache.clear()
+        wc._get_formula_weight('Li0.33La0.55TiO3')
+    return _run
+
+
+@benchmark('get_formula_weight_warm')
+def bench_get_formula_weight_warm(_):
+    wc = WeighingCalculator(MATERIALS)
+    return lambda: wc._get_formula_weight('Li0.33La0.55TiO3')
+
+
+@benchmark('calc_ratio', params = (1, 100, 10000))
+def bench_calc_ratio(n_rows):
+    wc = WeighingCalculator(MATERIALS)
+    ratio = _ratio(n_rows)
+    return lambda: wc.calc(ratio = ratio, excess = {'Li2O': 0.05}, progress_bar = False)
+
+
+@benchmark('calc_ratio_rational', params = (1, 100, 10000))
+def bench_calc_ratio_rational(n_rows):
+    wc = WeighingCalculator(MATERIALS)
+    ratio = _ratio(n_rows)
+    return lambda: wc.calc(ratio = ratio, excess = {'Li2O': 0.05}, progress_bar = False, rational = True)
+
+
+@benchmark('calc_products', params = (1, 10, 100))
+def bench_calc_products(n_products):
+    wc = WeighingCalculator(MATERIALS)
+    products = _products(n_products)
+    return lambda: wc.calc(products = products, excess = {'Li2O': 0.05}, exact = False, progress_bar = False)
+
+
+@benchmark('calc_products_exact', params = (10, 1000))
+def bench_calc_products_exact(n_products):
+    # 組成の解析はキャッシュされるので，比率を解く部分の時間
+    wc = WeighingCalculator(MATERIALS)
+    products = ['Li{0}La{1}Ti{2}O{3}'.format(2 * a, 2 * b, c, a + 3 * b + 2 * c) for a, b, c in _ratio(n_products).astype(int)]
+    return lambda: wc.calc(products = products, excess = {'Li2O': 0.05}, progress_bar = False)
+
+
+@benchmark('update_mg', params = (1, 10000))
+def bench_update_mg(n_rows):
+    wc = WeighingCalculator(MATERIALS)
+    wc.calc(ratio = _ratio(n_rows), progress_bar = False)
+    return lambda: wc.update_mg(1500)
+
+
+@benchmark('make_output')
+def bench_make_output(_):
+    # gui._make_outputと同じ処理 (原料ごとにキャッシュされたOutputLayoutから表を作る．)
+    from export import get_output_layout
+    wc = WeighingCalculator(MATERIALS)
+    wc.calc(ratio = [1, 1, 1], excess = {'Li2O': 0.05}, progress_bar = False)
+
+    def _run():
+        layout = get_output_layout(tuple(wc.materials))
+        return layout.formula_table(wc), layout.display_table(wc)
+    return _run
+
+
+@benchmark('result_table', params = (100, 100000))
+def bench_result_table(n_rows):
+    # 結果の表を作り，並べ替えて1ページ目を表示するまで
+    from export import ResultTable
+    wc = WeighingCalculator(MATERIALS)
+    wc.calc(ratio = _ratio(n_rows), excess = {'Li2O': 0.05}, progress_bar = False)
+
+    def _run():
+        table = ResultTable(wc)
+        table.filter('La')
+        table.sort('total (mg)', ascending = False)
+        table.page(0, 25, 0, 8)
+    return _run
+
+
+@benchmark('campaign_plan', params = (1000, 10000))
+def bench_campaign_plan(n_jobs):
+    from campaign import Campaign
+    campaign = Campaign(MATERIALS)
+    rng = np.random.default_rng(0)
+    jobs = [
+        ('Li{0}La{1}Ti{2}O{3}'.format(2 * a, 2 * b, c, a + 3 * b + 2 * c), mg, {'Li2O': 0.05})
+        for (a, b, c), mg in zip(_ratio(n_jobs).astype(int), rng.integers(500, 3000, size = n_jobs))
+    ]
+    return lambda: campaign.plan(jobs)
+
+
+@benchmark('write_workbook', params = (1, 100))
+def bench_write_workbook(n_rows):
+    wc = WeighingCalculator(MATERIALS)
+    wc.calc(ratio = _ratio(n_rows), excess = {'Li2O': 0.05}, progress_bar = False)
+    path = os.path.join(tempfile.mkdtemp(), 'weighing.xlsx')
+    return lambda: write_workbook(path, wc)
+
+
+@benchmark('sweep', params = (10000, 1000000))
+def bench_sweep(n_points):
+    # 名前を作らない場合 (make_compositionsの時間を除いた計算部分)
+    wc = WeighingCalculator(MATERIALS)
+    n = round(n_points ** (1 / len(MATERIALS)))
+    grid = {material: np.linspace(0, 1, n) for material in MATERIALS}
+    return lambda: sum(len(df) for df in wc.sweep(grid, excess = {'Li2O': 0.05}, names = False))
+
+
+@benchmark('sweep_to', params = (1000000, ))
+def bench_sweep_to(n_points):
+    # 列ごとのファイルに書き出す場合 (sweepとの差が書き込みの時間)
+    wc = WeighingCalculator(MATERIALS)
+    n = round(n_points ** (1 / len(MATERIALS)))
+    grid = {material: np.linspace(0, 1, n) for material in MATERIALS}
+    path = os.path.join(tempfile.mkdtemp(), 'sweep')
+    return lambda: wc.sweep_to(path, grid, excess = {'Li2O': 0.05}, names = False)
+
+
+@benchmark('allocate', params = (100, 1000))
+def bench_allocate(n_rows):
+    import scipy    # noqa: F401 (ないときはskip)
+    wc = WeighingCalculator(MATERIALS)
+    wc.calc(ratio = _ratio(n_rows), excess = {'Li2O': 0.05}, progress_bar = False)
+    stock = {'Li2O': 1000, 'La2O3': 5000, 'TiO2': 2000}
+    return lambda: wc.allocate(stock, max_mg = 100)
+
+
+@benchmark('store_search', params = (100000, ))
+def bench_store_search(n_rows):
+    from store import ResultStore
+    wc = WeighingCalculator(MATERIALS)
+    store = ResultStore(os.path.join(tempfile.mkdtemp(), 'results.sqlite3'))
+    store.calc(wc, ratio = _ratio(n_rows), progress_bar = False)
+    product = wc.products[n_rows // 2]
+    return lambda: store.search(product = product)
+
+
+@benchmark('store_calc_hit', params = (1, 10000))
+def bench_store_calc_hit(n_rows):
+    # 同じ計算を保存してある結果から返す場合
+    from store import ResultStore
+    wc = WeighingCalculator(MATERIALS)
+    store = ResultStore(os.path.join(tempfile.mkdtemp(), 'results.sqlite3'))
+    ratio = _ratio(n_rows)
+    store.calc(wc, ratio = ratio, progress_bar = False)
+    return lambda: store.calc(wc, ratio = ratio, progress_bar = False)
+
+
+@benchmark('result_cache_hit', params = (1, 10000))
+def bench_result_cache_hit(n_rows):
+    # GUIで同じ入力をもう一度計算したとき (キーを作って結果の表を取り出すまで)
+    from result_cache import ResultCache, result_key
+    from export import ResultTable
+    wc = WeighingCalculator(MATERIALS)
+    ratio = _ratio(n_rows).tolist()
+    wc.calc(ratio = ratio, excess = {'Li2O': 0.05}, progress_bar = False)
+    cache = ResultCache()
+    cache.set(result_key(MATERIALS, ratio = ratio, excess = {'Li2O': 0.05}, exact = True), (wc, ResultTable(wc)))
+    return lambda: cache.get(result_key(MATERIALS, ratio = ratio, excess = {'Li2O': 0.05}, exact = True))
+
+
+@benchmark('import_workbooks', params = (100, ))
+def bench_import_workbooks(n_files):
+    # 保存されたExcelファイルを読み込んで計算し直す (files/s = n_files / time)
+    from importer import WorkbookImporter
+    directory = tempfile.mkdtemp()
+    wc = WeighingCalculator(MATERIALS)
+    ratio = _ratio(n_files * 3)
+    for i in range(n_files):
+        wc.calc(ratio = ratio[3 * i:3 * i + 3], excess = {'Li2O': 0.05}, progress_bar = False)
+        write_workbook(os.path.join(directory, '{}.xlsx'.format(i)), wc)
+    paths = [os.path.join(directory, '{}.xlsx'.format(i)) for i in range(n_files)]
+    return lambda: sum(1 for _ in WorkbookImporter().run(paths))
@@ -0,0 +1,899 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+'''
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha1
+from math import ceil
+from threading import Lock
+from element_recognition import get_ratio, make_compositions
+import pandas as pd
+import numpy as np
+import os
+import csv
+import sys
+
+from columnar import ColumnarResult, ColumnarWriter
+from composition import CompositionMatrix
+from formula import get_parser
+import instrument
+from rational import as_integers, formula_weights as exact_formula_weights, weigh as exact_weigh
+
+# 設定
+path_root = os.path.abspath(os.path.dirname(__file__))
+path_atomic_weights = os.path.join(path_root, 'atomic_weights.csv')
+
+
+class FormulaCache:
+    def __init__(self, maxsize:int = 65536):
+        """process-wide LRU cache from chemical formula to (sparse element counts, formula weight)
+
+        The element counts are (element indices, counts) of the nonzero elements only,
+        so a cached formula takes some tens of bytes instead of a dense row over all elements.
+
+        Parameters
+        ----------
+        maxsize : int, optional
+            maximum number of cached formulas, by default 65536
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+        # 登録時の原子量表．これが変わったらキャッシュを破棄する．
+        self._elements = None
+        self._atomic_weights = None
+
+    def bind(self, elements:list, atomic_weights:np.ndarray):
+        """bind the atomic-weight table; the cache is cleared when it has changed."""
+        with self._lock:
+            if elements is self._elements and atomic_weights is self._atomic_weights:   # 同じ表ならば比較すらしない．
+                return
+            if self._elements is None or tuple(self._elements) != tuple(elements) or not np.array_equal(self._atomic_weights, atomic_weights):
+                self._data.clear()
+            self._elements = elements
+            self._atomic_weights = atomic_weights
+
+    def get(self, formula:str):
+        """return ((element indices, counts), formula weight) or None"""
+        with self._lock:
+            if formula in self._data:
+                self._data.move_to_end(formula)
+                self.hits += 1
+                return self._data[formula]
+            self.misses += 1
+            return None
+
+    def set(self, formula:str, counts:tuple, formula_weight:float):
+        with self._lock:
+            self._data[formula] = (counts, formula_weight)
+            self._data.move_to_end(formula)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last = False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self) -> dict:
+        """hit/miss statistics like `functools.lru_cache`"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'maxsize': self.maxsize, 'currsize': len(self._data)}
+
+
+# インスタンス間で共有する式量のキャッシュ
+formula_cache = FormulaCache()
+
+
+class CalculationCancelled(Exception):
+    """raised from a progress callback to stop the calculation."""
+
+
+class Progress:
+    # 進捗を報告するときの分割数の目安
+    n_steps = 20
+
+    def __init__(self, progress_bar, total:int = 0):
+        """progress of a calculation reported to `progress_bar`.
+
+        Parameters
+        ----------
+        progress_bar : bool or callable
+            callable(done:int, total:int) is called at each step; it can raise CalculationCancelled to stop.
+            True shows a text progress bar on stderr (only when it is a terminal). False does nothing.
+        total : int, optional
+            number of steps known in advance, by default 0
+        """
+        if callable(progress_bar):
+            self.callback = progress_bar
+        elif progress_bar and sys.stderr.isatty():
+            self.callback = self._print
+        else:
+            self.callback = None
+        self.done = 0
+        self.total = total
+
+    @property
+    def enabled(self) -> bool:
+        return self.callback is not None
+
+    def add(self, n:int):
+        self.total += n
+
+    def step(self, n:int = 1):
+        self.done += n
+        if self.callback is not None:
+            self.callback(self.done, self.total)
+
+    @staticmethod
+    def _print(done:int, total:int, width:int = 30):
+        n = width * done // max(total, 1)
+        sys.stderr.write('\r[{0}{1}] {2}/{3}'.format('#' * n, ' ' * (width - n), done, total))
+        if done >= total:
+            sys.stderr.write('\n')
+        sys.stderr.flush()
+
+
+class AtomicWeights:
+    def __init__(self, elements, weights, mtime_ns:int):
+        """atomic-weight table as a compact array
+
+        Parameters
+        ----------
+        elements : Sequence[str]
+            element symbols, e.g.) ('H', 'He', ...)
+        weights : np.ndarray
+            atomic weights in the same order as `elements`
+        mtime_ns : int
+            modification time of the source csv file
+        """
+        self.elements = tuple(elements)
+        self.weights = np.array(weights, dtype = float)
+        self.weights.flags.writeable = False    # 共有するので書き換えられないようにする．
+        self.index = {element: i for i, element in enumerate(self.elements)}
+        self.mtime_ns = mtime_ns
+        # 表の内容のハッシュ (保存した結果のキーに使う．)
+        self.digest = sha1('|'.join(self.elements).encode('utf_8') + np.ascontiguousarray(self.weights, dtype = '<f8').tobytes()).hexdigest()
+
+
+# 読み込み済みの原子量表 (key: csvのパス)
+_registry_atomic_weights = {}
+_lock_atomic_weights = Lock()
+
+
+def get_atomic_weights(path:str = path_atomic_weights) -> AtomicWeights:
+    """load the atomic-weight table only once and share it.
+
+    The table is read from the binary sidecar (`atomic_weights.npz`) when it is up to date,
+    and is rebuilt from the csv file whenever the csv's mtime changes.
+
+    Parameters
+    ----------
+    path : str, optional
+        path of the csv file, by default path_atomic_weights
+
+    Returns
+    -------
+    AtomicWeights
+    """
+    mtime_ns = os.stat(path).st_mtime_ns
+    with _lock_atomic_weights:
+        atomic_weights = _registry_atomic_weights.get(path)
+        if atomic_weights is None or atomic_weights.mtime_ns != mtime_ns:
+            atomic_weights = _load_atomic_weights(path, mtime_ns)
+            _registry_atomic_weights[path] = atomic_weights
+    return atomic_weights
+
+
+def _load_atomic_weights(path:str, mtime_ns:int) -> AtomicWeights:
+    path_sidecar = os.path.splitext(path)[0] + '.npz'
+    if os.path.isfile(path_sidecar):
+        try:
+            with np.load(path_sidecar, allow_pickle = False) as npz:
+                if int(npz['mtime_ns']) == mtime_ns:
+                    return AtomicWeights(npz['elements'].tolist(), npz['weights'], mtime_ns)
+        except (OSError, KeyError, ValueError):  # 壊れていたらcsvから作り直す．
+            pass
+
+    elements = []
+    weights = []
+    with open(path, mode = 'r', encoding = 'utf_8_sig') as f:
+        reader = csv.reader(line for line in f if not line.startswith('#'))
+        next(reader)    # header
+        for row in reader:
+            if len(row) < 2:
+                continue
+            elements.append(row[0])
+            weights.append(float(row[1]))
+    atomic_weights = AtomicWeights(elements, weights, mtime_ns)
+
+    try:    # .appの中など書き込めない場所では保存しない．
+        with open(path_sidecar, mode = 'wb') as f:
+            np.savez(f, elements = np.array(elements), weights = atomic_weights.weights, mtime_ns = np.int64(mtime_ns))
+    except OSError:
+        pass
+    return atomic_weights
+
+
+class WeighingCalculator:
+    def __init__(self, materials):
+        '''
+        Parameters
+        ----------
+        materials : list
+            [description]
+        '''
+        self.materials = materials
+        self.atomic_weights = get_atomic_weights()
+        formula_cache.bind(self.atomic_weights.elements, self.atomic_weights.weights)
+        self.dict_materials = dict(zip(materials, self._get_formula_weights(materials)))
+
+    @instrument.timed('calc')
+    def calc(self, products = [], ratio = [], mg = 2000, excess = {}, exact = True, progress_bar = True, retry_inexact = False, n_jobs = 1, rational = False):
+        '''
+        calculate weighing
+
+        Parameters
+        ----------
+        products : list, optional
+            [description], by default []
+        ratio : list, optional
+            比率．生成物の式量は (表示用に丸めた組成名ではなく) 原料の式量の和とする, by default []
+        mg : int, optional
+            完成量, by default 2000
+        excess : dict, optional
+            過剰量 e.g. {'Li2O': 0.05}, by default {}
+        exact : bool, optional
+            完全一致していないとダメかどうか, by default True
+        progress_bar : bool or callable, optional
+            進捗バーを表示するかどうか．callable(done, total)を渡すとそれに進捗を報告する．
+            その中でCalculationCancelledを投げると計算を中止できる, by default True
+        retry_inexact : bool, optional
+            exact = Trueで一致しなかった生成物だけをexact = Falseで計算し直すかどうか．
+            計算し直した生成物は`self.inexact_products`に入る, by default False
+        n_jobs : int, optional
+            生成物の比率をいくつのプロセスで並列に計算するか．-1のときはCPUの数, by default 1
+        rational : bool, optional
+            重量を有理数で正確に計算し，最後に一度だけ丸めるかどうか．ratioには'1/3'やFractionも使える, by default False
+
+        Raises
+        ------
+        ValueError
+        '''
+
+        self.mg = mg
+        self.inexact_products = []
+        self._exact, self._retry_inexact = exact, retry_inexact
+        progress = Progress(progress_bar, total = 2)    # 比率の計算 + 式量 + 重量
+        from_ratio = not len(products)
+        ratio_exact = None
+
+        if len(products) * len(ratio):  # 両方に入力があったら．
+            raise ValueError('You can only enter either "products" or "ratio".')
+        elif len(products):
+            self.df_ratio = self._solve_ratio(products, exact = exact, n_jobs = n_jobs, progress = progress)
+            if exact and retry_inexact:
+                mask_failed = self.df_ratio.isnull().all(axis = 1).to_numpy()
+                if mask_failed.any():   # 一致しなかったものだけ計算し直す．
+                    df_ratio_inexact = self._solve_ratio(self.df_ratio.index[mask_failed].tolist(), exact = False, n_jobs = n_jobs, progress = progress)
+                    self.df_ratio.iloc[np.where(mask_failed)[0]] = df_ratio_inexact.to_numpy()
+                    self.inexact_products = df_ratio_inexact.index[df_ratio_inexact.notnull().any(axis = 1)].tolist()
+        elif len(ratio):
+            if isinstance(ratio, (pd.Series, np.ndarray, list)):
+                ratio = np.array(ratio).reshape(-1, len(self.materials))
+            if rational:    # 入力された通りの値をとっておき，以降はfloatで扱う．
+                ratio_exact = as_integers(ratio.loc[:, self.materials] if isinstance(ratio, pd.DataFrame) else ratio)
+                ratio = np.asarray(ratio_exact[0], dtype = float) / np.asarray(ratio_exact[1], dtype = float).reshape(-1, 1)
+                ratio[ratio_exact[2]] = np.nan
+            # 進捗を報告するときは少しずつ組成名を作る．
+            chunksize = ceil(len(ratio) / Progress.n_steps) if progress.enabled else len(ratio)
+            progress.add(ceil(len(ratio) / chunksize))
+            products = []
+            instrument.count('rows', len(ratio))
+            with instrument.timer('make_compositions'):
+                for i in range(0, len(ratio), chunksize):
+                    products.extend(make_compositions(self.materials, ratio = ratio[i:i + chunksize]).index.to_numpy().tolist())
+                    progress.step()
+            if isinstance(ratio, pd.DataFrame):
+                ratio = ratio.loc[:, self.materials].to_numpy()
+            self.df_ratio = pd.DataFrame(ratio, columns = self.materials, index = products)
+        else:
+            raise ValueError('You have to enter either "products" or "ratio".')
+
+        # 比率が計算できなかった組成をためておくリスト
+        # comp_null = []
+
+        self._set_ratio(self.df_ratio, excess, progress = progress, rational = rational, from_ratio = from_ratio, ratio_exact = ratio_exact)
+
+    @instrument.timed('set_ratio')
+    def _set_ratio(self, df_ratio:pd.DataFrame, excess:dict, progress:Progress = None, rational:bool = False, from_ratio:bool = False, ratio_exact:tuple = None, weights:tuple = None):
+        """calculate the weights from an already solved ratio (the latter half of `calc`). `self.mg` must be set.
+        `weights` ((moles, weights, weights with excess) of all products e.g. from the result store) are used as they are if given."""
+        if progress is None:
+            progress = Progress(False)
+        self.df_ratio = df_ratio.astype(float)   # update_ratioで小数を入れられるように (整数の比率も受け付ける．)
+        self.rational = rational
+        self._from_ratio = from_ratio
+        products = self.df_ratio.index.to_numpy().tolist()  # self.df_ratioではproductsの空白を削除した組成名を得られるため，上書き．
+        self.products = products
+        self.excess = excess
+
+        # 原料・生成物の式量をベクトルとして用意しておく．(update_*で使い回す．)
+        self._ar_ratio = np.array(self.df_ratio.to_numpy(dtype = float))   # get_ratioで計算できなかった組成はNone (-> np.nan)
+        self._ar_formula_weight_materials = np.array([self.dict_materials[material] for material in self.materials], dtype = float)
+        if from_ratio:  # 比率から計算したときは原料の式量の和 (表示用に丸めた組成名の式量ではない．)
+            self._ar_formula_weight_products = self._formula_weights_from_ratio(self._ar_ratio)
+        else:           # 組成数が多いときのために一括で計算
+            self._ar_formula_weight_products = self._get_formula_weights(products)
+        self.dict_products = dict(zip(products, self._ar_formula_weight_products.tolist()))
+        progress.step()
+
+        # 比率がすべて計算できなかった組成は除く．(anyのほうが良い気もする．)
+        self._mask_valid = ~np.isnan(self._ar_ratio).all(axis = 1)
+        if not self._mask_valid.any():
+            raise ValueError('There is no composition whose ratio could be calculated.')
+        if self.rational:
+            self._set_exact(ratio_exact)
+
+        if weights is None:
+            self._calc_weights()
+        else:
+            self._set_weights(*weights)
+        progress.step()
+
+    def _formula_weights_from_ratio(self, ar_ratio:np.ndarray) -> np.ndarray:
+        """formula weights of products as the sum of those of the materials in the ratio (NaN if the ratio is all NaN)."""
+        ar_formula_weight = np.nan_to_num(ar_ratio) @ self._ar_formula_weight_materials
+        ar_formula_weight[np.isnan(ar_ratio).all(axis = 1)] = np.nan
+        return ar_formula_weight
+
+    def _set_exact(self, ratio_exact:tuple = None):
+        """prepare the exact ratio and formula weights for `rational` mode."""
+        self._ratio_exact = as_integers(self._ar_ratio) if ratio_exact is None else ratio_exact
+        self._formula_weight_materials_exact = self._get_formula_weights_exact(self.materials)
+        # 比率から計算したときは原料の式量の和 (丸めた組成名の式量ではない．)
+        self._formula_weight_products_exact = (None, None) if self._from_ratio else self._get_formula_weights_exact(self.products)
+
+    def _get_formula_weights_exact(self, formulas:list) -> tuple:
+        counts = self._get_formula_counts(formulas)
+        used = counts.used_columns()    # 含まれている元素だけ
+        return exact_formula_weights(counts.to_dense(used), self.atomic_weights.weights[used])
+
+    @instrument.timed('update_mg')
+    def update_mg(self, mg):
+        """change only the theoretical amount without solving the ratio again.
+
+        Parameters
+        ----------
+        mg : int or float
+            完成量
+        """
+        self.mg = mg
+        self._calc_weights()
+
+    @instrument.timed('update_excess')
+    def update_excess(self, excess:dict):
+        """change only the excess; the weights without excess are kept as they are.
+
+        Parameters
+        ----------
+        excess : dict
+            過剰量 e.g. {'Li2O': 0.05}. Materials not in `excess` keep their current value.
+        """
+        self.excess = {**self.excess, **excess}
+        self._calc_weights_excess()
+
+    @instrument.timed('update_ratio')
+    def update_ratio(self, material:str, value:float, i:int = 0):
+        """change a single entry of the ratio and recalculate only that composition.
+
+        Parameters
+        ----------
+        material : str
+            material whose ratio is changed
+        value : float
+            new ratio
+        i : int, optional
+            position of the composition in `self.products`, by default 0
+        """
+        was_valid = self._mask_valid[i]
+        self._ar_ratio[i, self.materials.index(material)] = value
+        self._mask_valid[i] = not np.isnan(self._ar_ratio[i]).all()
+
+        # 比率が変わると組成名と式量も変わる．(まだ計算できていない比率が残っているときはそのまま．)
+        if not np.isnan(self._ar_ratio[i]).any():
+            product = make_compositions(self.materials, ratio = self._ar_ratio[i]).index[0]
+            if self._from_ratio:
+                formula_weight = self._formula_weights_from_ratio(self._ar_ratio[i:i + 1])[0]
+            else:
+                formula_weight = self._get_formula_weight(product)
+            self._ar_formula_weight_products[i] = self.dict_products[product] = formula_weight
+            self.products[i] = product
+        self.df_ratio.iloc[i] = self._ar_ratio[i]
+        self.df_ratio.index = self.products
+
+        if was_valid != self._mask_valid[i] or self.rational:  # 計算できる組成の数が変わったときは全部作り直す．
+            if not self._mask_valid.any():
+                raise ValueError('There is no composition whose ratio could be calculated.')
+            if self.rational:
+                self._set_exact()
+            self._calc_weights()
+            return
+
+        mole = self.mg / self._ar_formula_weight_products[i]
+        self.moles[i] = mole
+        if self._mask_valid[i]:
+            k = np.count_nonzero(self._mask_valid[:i])    # df_material_weightの中での位置
+            ar_material_weight = self._ar_ratio[i] * mole * self._ar_formula_weight_materials
+            index_valid = self.df_ratio.index[self._mask_valid]
+            self.df_material_weight.iloc[k] = ar_material_weight
+            self.df_material_weight_excess.iloc[k] = ar_material_weight * self._excess_factor()
+            self.df_material_weight.index = index_valid
+            self.df_material_weight_excess.index = index_valid
+
+    def sweep(self, grid:dict, ratio = None, mg = 2000, excess = {}, chunksize:int = 10000, names:bool = True, progress_bar = False):
+        '''
+        calculate weighing over a grid of compositions chunk by chunk.
+
+        The grid is the Cartesian product of the values of `grid`, but it is never materialized;
+        each chunk is made from its flat indices, so grids with millions of points run in bounded memory.
+        This instance itself (df_ratio etc.) is not changed.
+
+        e.g.) Li(2-2x)Mo(x)O(1+2x) for x in 0, 0.001, ..., 0.5
+            wc = WeighingCalculator(['Li2O', 'MoO3'])
+            for df in wc.sweep({'x': np.linspace(0, 0.5, 501)}, ratio = lambda x: {'Li2O': 1 - x, 'MoO3': x}):
+                ...
+
+        Parameters
+        ----------
+        grid : dict
+            key: material (or parameter of `ratio`), value: 1-D array-like (range, np.linspace etc.) or scalar
+        ratio : callable, optional
+            ratio(**params) -> {material: array or scalar}. It receives 1-D arrays of a chunk and must be vectorized.
+            Materials which are not returned are 0. If None, the keys of `grid` are materials, by default None
+        mg : int, optional
+            完成量, by default 2000
+        excess : dict, optional
+            過剰量 e.g. {'Li2O': 0.05}, by default {}
+        chunksize : int, optional
+            number of compositions in one chunk, by default 10000
+        names : bool, optional
+            whether to make the product names (index) with `make_compositions`, which takes most of the time.
+            If False, the index is the flat position in the grid, by default True
+        progress_bar : bool or callable, optional
+            same as `calc`; one step per chunk, by default False
+
+        Yields
+        ------
+        pd.DataFrame
+            columns: keys of `grid`, 'mole (mmol)', '<material>_weight', '<material>_weight_no_excess', 'total_weight'.
+            The formula weight of a product is that of its unrounded ratio (the name is rounded for display).
+            The weights of compositions whose ratio is all 0 are NaN.
+
+        Raises
+        ------
+        ValueError
+        '''
+        keys = list(grid)
+        if ratio is None and set(keys) - set(self.materials):
+            raise ValueError('Unknown materials in grid: {}'.format(', '.join(sorted(set(keys) - set(self.materials)))))
+        axes = [np.atleast_1d(np.asarray(grid[key], dtype = float)) for key in keys]
+        if any(axis.ndim != 1 for axis in axes):
+            raise ValueError('Each value of grid must be 1-D or a scalar.')
+        shape = tuple(len(axis) for axis in axes)
+        n_points = int(np.prod(shape, dtype = np.int64))
+
+        ar_formula_weight_materials = np.array([self.dict_materials[material] for material in self.materials], dtype = float)
+        excess_factor = 1 + np.array([excess.get(material, 0.) for material in self.materials], dtype = float)
+        columns = self._sweep_columns(keys)
+        progress = Progress(progress_bar, total = ceil(n_points / chunksize))
+
+        for start in range(0, n_points, chunksize):
+            idx = np.arange(start, min(start + chunksize, n_points))
+            params = {key: axis[i] for key, axis, i in zip(keys, axes, np.unravel_index(idx, shape))}
+            ar_ratio = np.zeros((len(idx), len(self.materials)))
+            for material, values in (params if ratio is None else ratio(**params)).items():
+                ar_ratio[:, self.materials.index(material)] = values
+
+            # 生成物の式量は原料の式量の比率による和
+            ar_formula_weight_products = ar_ratio @ ar_formula_weight_materials
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                ar_moles = np.where(ar_formula_weight_products > 0, mg / ar_formula_weight_products, np.nan)
+            ar_weight = ar_ratio * ar_moles[:, np.newaxis] * ar_formula_weight_materials
+            ar_weight_excess = ar_weight * excess_factor
+
+            index = make_compositions(self.materials, ratio = ar_ratio).index if names else idx
+            yield pd.DataFrame(
+                np.column_stack([*params.values(), ar_moles, ar_weight_excess, ar_weight, ar_weight_excess.sum(axis = 1)]),
+                columns = columns, index = index
+            )
+            progress.step()
+
+    def sweep_to(self, path:str, grid:dict, ratio = None, mg = 2000, excess = {}, chunksize:int = 10000, names:bool = True, progress_bar = False) -> ColumnarResult:
+        '''
+        write `sweep` to a memory-mapped columnar result (see columnar.py) and return it opened.
+
+        Only one chunk is in memory at a time, so the result can be larger than memory.
+        It can be reopened later with `columnar.ColumnarResult(path)`.
+
+        Parameters
+        ----------
+        path : str
+            directory of the result (overwritten if it exists)
+        grid, ratio, mg, excess, chunksize, names, progress_bar :
+            same as `sweep`. The product names are stored when `names` is True.
+
+        Returns
+        -------
+        ColumnarResult
+            columns: those of `sweep`; metadata: materials, mg, excess and grid.
+        '''
+        metadata = {
+            'materials': list(self.materials),
+            'mg': float(mg),
+            'excess': {material: float(value) for material, value in excess.items()},
+            'grid': {key: np.atleast_1d(np.asarray(values, dtype = float)).tolist() for key, values in grid.items()},
+        }
+        with ColumnarWriter(path, self._sweep_columns(list(grid)), products = names, metadata = metadata) as writer:
+            for df in self.sweep(grid, ratio = ratio, mg = mg, excess = excess, chunksize = chunksize, names = names, progress_bar = progress_bar):
+                writer.append_frame(df)
+        return ColumnarResult(path)
+
+    def _sweep_columns(self, keys:list) -> list:
+        return keys + ['mole (mmol)'] \
+            + ['{}_weight'.format(material) for material in self.materials] \
+            + ['{}_weight_no_excess'.format(material) for material in self.materials] \
+            + ['total_weight']
+
+    def max_mg(self, stock:dict) -> pd.DataFrame:
+        '''
+        maximum achievable amount of each product (independently of each other) from the material stock.
+        `calc` must be called beforehand; its ratio and excess are used.
+
+        Parameters
+        ----------
+        stock : dict
+            available mass (mg) of materials e.g. {'Li2O': 500}. Materials not in `stock` are unlimited.
+
+        Returns
+        -------
+        pd.DataFrame
+            index: products, columns: ['mg'] + materials (weights with excess).
+            NaN for products whose ratio could not be calculated, inf when no limited material is used.
+        '''
+        ar_usage, mask = self._usage_per_mg()
+        ar_stock = self._stock_vector(stock)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            ar_mg = np.where(ar_usage > 0, ar_stock / ar_usage, np.inf).min(axis = 1)
+        ar_mg[~mask] = np.nan
+        return self._allocation_frame(ar_mg, ar_usage)
+
+    @instrument.timed('allocate')
+    def allocate(self, stock:dict, priority = None, min_mg = None, max_mg = None) -> pd.DataFrame:
+        '''
+        split the material stock among all products by linear programming (scipy is required).
+
+        maximize    sum(priority * mg)
+        subject to  sum over products of (weight of each material per mg of product) * mg <= stock
+                    min_mg <= mg <= max_mg
+
+        `calc` must be called beforehand; its ratio and excess are used.
+        Hundreds of products are solved at once with the HiGHS solver of `scipy.optimize.linprog`.
+
+        Parameters
+        ----------
+        stock : dict
+            available mass (mg) of materials e.g. {'Li2O': 500}. Materials not in `stock` are unlimited.
+        priority : float, array-like or dict, optional
+            weight of each product (dict: product -> weight, missing ones are 0) in the objective, by default None (all 1)
+        min_mg, max_mg : float, array-like or dict, optional
+            lower / upper bound (mg) of each product, by default None (0 / no upper bound)
+
+        Returns
+        -------
+        pd.DataFrame
+            index: products, columns: ['mg'] + materials (weights with excess).
+            NaN for products whose ratio could not be calculated.
+
+        Raises
+        ------
+        ValueError
+            when the problem is infeasible (e.g. min_mg can not be satisfied) or unbounded.
+        '''
+        try:
+            from scipy.optimize import linprog
+        except ImportError:
+            raise ImportError('scipy is required to allocate the stock among products.')
+
+        ar_usage, mask = self._usage_per_mg()
+        ar_stock = self._stock_vector(stock)
+        ar_priority = self._per_product(priority, 1., missing = 0.)[mask]
+        ar_min = self._per_product(min_mg, 0.)[mask]
+        ar_max = self._per_product(max_mg, np.inf)[mask]
+
+        limited = np.isfinite(ar_stock)    # 制限のある原料だけを制約にする．
+        result = linprog(
+            -ar_priority,
+            A_ub = ar_usage[mask][:, limited].T, b_ub = ar_stock[limited],
+            bounds = np.column_stack([ar_min, np.where(np.isinf(ar_max), None, ar_max)]),
+            method = 'highs',
+        )
+        if not result.success:
+            raise ValueError('The stock could not be allocated: {}'.format(result.message))
+
+        ar_mg = np.full(len(mask), np.nan)
+        ar_mg[mask] = result.x
+        return self._allocation_frame(ar_mg, ar_usage)
+
+    def _usage_per_mg(self) -> tuple:
+        """(weight (mg) of each material with excess per 1 mg of each product, mask of products which can be used)"""
+        mask = ~np.isnan(self._ar_ratio).any(axis = 1)
+        ar_usage = self._ar_ratio * self._ar_formula_weight_materials / self._ar_formula_weight_products[:, np.newaxis] * self._excess_factor()
+        ar_usage[~mask] = 0
+        return ar_usage, mask
+
+    def _stock_vector(self, stock:dict) -> np.ndarray:
+        unknown = set(stock) - set(self.materials)
+        if unknown:
+            raise ValueError('Unknown materials in stock: {}'.format(', '.join(sorted(unknown))))
+        return np.array([stock.get(material, np.inf) for material in self.materials], dtype = float)
+
+    def _per_product(self, value, default:float, missing:float = None) -> np.ndarray:
+        """value of each product from None (`default`), a dict (`missing` for products not in it) or an array-like."""
+        if value is None:
+            return np.full(len(self.products), default)
+        elif isinstance(value, dict):
+            return np.array([value.get(product, default if missing is None else missing) for product in self.products], dtype = float)
+        return np.broadcast_to(np.asarray(value, dtype = float), (len(self.products), )).copy()
+
+    def _allocation_frame(self, ar_mg:np.ndarray, ar_usage:np.ndarray) -> pd.DataFrame:
+        with np.errstate(invalid = 'ignore'):
+            ar_weight = np.where(ar_usage > 0, ar_usage * ar_mg[:, np.newaxis], 0.)  # 使わない原料は0 (inf * 0を避ける．)
+        ar_weight[np.isnan(ar_mg)] = np.nan
+        return pd.DataFrame(np.column_stack([ar_mg, ar_weight]), columns = ['mg'] + list(self.materials), index = self.df_ratio.index)
+
+    def _excess_factor(self) -> np.ndarray:
+        return 1 + np.array([self.excess.get(material, 0.) for material in self.materials], dtype = float)
+
+    @instrument.timed('calc_weights')
+    def _calc_weights(self):
+        if self.rational:
+            ar_moles, ar_material_weight, ar_material_weight_excess = exact_weigh(
+                *self._ratio_exact, *self._formula_weight_materials_exact, self.mg, self._excess_factor(), *self._formula_weight_products_exact
+            )
+            self._set_weights(ar_moles, ar_material_weight, ar_material_weight_excess)
+            return
+
+        # moleをとっておくリスト
+        ar_moles = self.mg / self._ar_formula_weight_products
+        self.moles = ar_moles.tolist()
+
+        # 全組成を行列演算でまとめて計算する．
+        # (n_products, n_materials) = (n_products, n_materials) * (n_products, 1) * (n_materials,)
+        ar_material_weight = self._ar_ratio[self._mask_valid] * ar_moles[self._mask_valid, np.newaxis] * self._ar_formula_weight_materials
+        self.df_material_weight = pd.DataFrame(ar_material_weight, columns = self.materials, index = self.df_ratio.index[self._mask_valid])
+        self._calc_weights_excess()
+
+    def _set_weights(self, ar_moles:np.ndarray, ar_material_weight:np.ndarray, ar_material_weight_excess:np.ndarray):
+        self.moles = np.asarray(ar_moles, dtype = float).tolist()
+        index_valid = self.df_ratio.index[self._mask_valid]
+        self.df_material_weight = pd.DataFrame(ar_material_weight[self._mask_valid], columns = self.materials, index = index_valid)
+        self.df_material_weight_excess = pd.DataFrame(ar_material_weight_excess[self._mask_valid], columns = self.materials, index = index_valid)
+
+    def _calc_weights_excess(self):
+        if self.rational:   # 丸める前の値から計算し直す．
+            self._calc_weights()
+            return
+        self.df_material_weight_excess = pd.DataFrame(self.df_material_weight.to_numpy() * self._excess_factor(), columns = self.materials, index = self.df_material_weight.index)
+
+    @instrument.timed('solve_ratio')
+    def _solve_ratio(self, products:list, exact:bool = True, n_jobs:int = 1, progress:Progress = None) -> pd.DataFrame:
+        """solve the molar ratio of materials for each product.
+
+        exact = True: all products are solved at once by least squares on the sparse element counts
+        (only the elements contained are used), and those which do not match exactly are NaN.
+        The formulas are parsed in chunks (on a process pool when `n_jobs` != 1).
+
+        exact = False: `get_ratio` is used for chunks of products (on a process pool when `n_jobs` != 1).
+
+        The order of the products is kept.
+
+        Returns
+        -------
+        pd.DataFrame
+            columns = self.materials, index = products (spaces removed).
+            The ratio of products which could not be solved is NaN.
+
+        Raises
+        ------
+        ValueError
+            exact = True and the materials are linearly dependent (the ratio is not unique).
+        """
+        products = [product.replace(' ', '') for product in products]
+        if progress is None:
+            progress = Progress(False)
+        n_jobs = _n_jobs(n_jobs, len(products))
+        instrument.count('products_exact' if exact else 'products_inexact', len(products))
+
+        if exact:
+            ar_ratio = self._solve_ratio_exact(self._get_formula_counts(products, n_jobs = n_jobs, progress = progress))
+            return pd.DataFrame(ar_ratio, columns = self.materials, index = products)
+
+        chunks = _split(products, n_jobs, progress)
+        progress.add(len(chunks))
+        ratios = []
+        for ar_ratio in _map(_get_ratio_chunk, n_jobs, [self.materials] * len(chunks), chunks, [exact] * len(chunks)):
+            ratios.append(ar_ratio)
+            progress.step()
+        return pd.DataFrame(np.concatenate(ratios, axis = 0), columns = self.materials, index = products)
+
+    def _solve_ratio_exact(self, counts_products:CompositionMatrix) -> np.ndarray:
+        """ratio (len(products), len(materials)) which reproduces the element counts of each product exactly, NaN if none."""
+        counts_materials = self._get_formula_counts(self.materials)
+        ar_ratio = np.full((len(counts_products), len(self.materials)), np.nan)
+        # 原料と生成物のどれかに含まれている元素だけで連立方程式を作る．
+        columns = np.union1d(counts_materials.used_columns(), counts_products.used_columns())
+        A = counts_materials.to_dense(columns).T    # (元素, 原料)
+        if np.linalg.matrix_rank(A) < len(self.materials):  # 比率が一つに決まらない．(get_ratioと同じくエラーにする．)
+            raise ValueError('The ratio can not be determined because the materials are linearly dependent: {}.'.format(', '.join(self._dependent_materials(A))))
+        for start in range(0, len(counts_products), SOLVE_CHUNKSIZE):
+            B = counts_products[start:start + SOLVE_CHUNKSIZE].to_dense(columns)   # (生成物, 元素)
+            X = np.linalg.lstsq(A, B.T, rcond = None)[0].T
+            X[np.abs(X) < ZERO_TOLERANCE] = 0.    # 使わない原料の丸め誤差 (1e-16程度) を0にする．
+            # get_ratio (exact = True) と同じ検算
+            mask_exact = np.isclose(X @ A.T, B).all(axis = 1) & (B != 0).any(axis = 1)   # 元素を含まない組成 (e.g. '5') は解なし
+            ar_ratio[start:start + len(B)][mask_exact] = X[mask_exact]
+        return ar_ratio
+
+    def _dependent_materials(self, A:np.ndarray) -> list:
+        """materials which appear in a linear dependency of the columns of A (元素, 原料)"""
+        _, singular_values, vh = np.linalg.svd(A)
+        rank = np.count_nonzero(singular_values > singular_values.max(initial = 0) * max(A.shape) * np.finfo(float).eps)
+        null_space = vh[rank:]  # (次元, 原料)
+        return [material for material, v in zip(self.materials, np.abs(null_space).max(axis = 0)) if v > ZERO_TOLERANCE]
+
+    def _get_formula_weight(self, formula:str) -> float:
+        """get formula weight
+
+        Parameters
+        ----------
+        formula : str
+            chemical formula, e.g.) 'Li2O'
+
+        Returns
+        -------
+        float
+            formula weight
+        """
+        return self._get_formula_weights([formula])[0]
+
+    def _get_formula_counts(self, formulas:list, n_jobs:int = 1, progress:Progress = None) -> CompositionMatrix:
+        """sparse element counts of formulas (rows: formulas, columns: self.atomic_weights.elements)
+
+        Formulas already parsed (by any instance) are taken from `formula_cache`.
+        """
+        dict_counts = {}
+        missing_formulas = []
+        for formula in dict.fromkeys(formulas):
+            cached = formula_cache.get(formula)
+            if cached is None:
+                missing_formulas.append(formula)
+            else:
+                dict_counts[formula] = cached[0]
+        if missing_formulas:
+            counts, _ = self._parse_formulas(missing_formulas, n_jobs = n_jobs, progress = progress)
+            for i, formula in enumerate(missing_formulas):
+                dict_counts[formula] = counts.row(i)
+        return CompositionMatrix.from_rows([dict_counts[formula] for formula in formulas], len(self.atomic_weights.elements))
+
+    def _get_formula_weights(self, formulas:list) -> np.ndarray:
+        """get formula weights of many formulas at once
+
+        Formulas already parsed (by any instance) are taken from `formula_cache`.
+
+        Parameters
+        ----------
+        formulas : list
+            chemical formulas, e.g.) ['Li2O', 'SiO2']
+
+        Returns
+        -------
+        np.ndarray
+            formula weights, shape = (len(formulas), )
+        """
+        dict_formula_weights = {}
+        missing_formulas = []
+        for formula in dict.fromkeys(formulas):  # 重複している組成は一度だけ計算する．
+            cached = formula_cache.get(formula)
+            if cached is None:
+                missing_formulas.append(formula)
+            else:
+                dict_formula_weights[formula] = cached[1]
+        if missing_formulas:
+            _, ar_formula_weights = self._parse_formulas(missing_formulas)
+            dict_formula_weights.update(zip(missing_formulas, ar_formula_weights))
+        return np.array([dict_formula_weights[formula] for formula in formulas], dtype = float)
+
+    @instrument.timed('parse_formulas')
+    def _parse_formulas(self, formulas:list, n_jobs:int = 1, progress:Progress = None) -> tuple:
+        """parse formulas in chunks, store them in `formula_cache` and return (CompositionMatrix, formula weights)."""
+        if progress is None:
+            progress = Progress(False)
+        instrument.count('formulas_parsed', len(formulas))
+        chunks = _split(formulas, n_jobs, progress, max_chunksize = SOLVE_CHUNKSIZE)
+        progress.add(len(chunks))
+        matrices = []
+        for counts in _map(_parse_formulas, n_jobs, chunks, [self.atomic_weights.elements] * len(chunks)):
+            matrices.append(counts)
+            progress.step()
+        counts = CompositionMatrix.concatenate(matrices, len(self.atomic_weights.elements))
+        ar_formula_weights = counts.dot(self.atomic_weights.weights)
+        for i, (formula, formula_weight) in enumerate(zip(formulas, ar_formula_weights)):
+            formula_cache.set(formula, counts.row(i), formula_weight)
+        return counts, ar_formula_weights
+
+
+# 一度に密行列にする生成物の数 (メモリを抑えるため)
+SOLVE_CHUNKSIZE = 4096
+# これより小さい比率は0とみなす．
+ZERO_TOLERANCE = 1e-10
+
+
+def _n_jobs(n_jobs:int, n:int) -> int:
+    if n_jobs is not None and n_jobs < 0:
+        n_jobs = os.cpu_count()
+    return max(min(n_jobs or 1, n), 1)
+
+
+def _split(items:list, n_jobs:int, progress:Progress, max_chunksize:int = None) -> list:
+    """chunks of `items` to be processed one by one (n_jobs = 1) or on a process pool."""
+    if n_jobs <= 1:
+        # 進捗を報告するときだけ分割する．
+        chunksize = ceil(len(items) / Progress.n_steps) if progress.enabled else len(items)
+    else:
+        chunksize = ceil(len(items) / (n_jobs * 4))    # 負荷が偏らないように少し細かく分ける．
+    if max_chunksize is not None:
+        chunksize = min(chunksize, max_chunksize)
+    chunksize = max(chunksize, 1)
+    return [items[i:i + chunksize] for i in range(0, len(items), chunksize)]
+
+
+def _map(func, n_jobs:int, *iterables):
+    """map in order, on a process pool when n_jobs > 1."""
+    if n_jobs <= 1:
+        yield from map(func, *iterables)
+        return
+    executor = ProcessPoolExecutor(max_workers = n_jobs)
+    try:
+        yield from executor.map(func, *iterables)
+    finally:    # 中止されたときはまだ始まっていないchunkを取り消す．
+        executor.shutdown(wait = True, cancel_futures = True)
+
+
+def _parse_formulas(formulas:list, elements:tuple) -> CompositionMatrix:
+    """parse a chunk of formulas (called in worker processes)."""
+    return get_parser(elements).parse_many(formulas)
+
+
+def _get_ratio_chunk(materials:list, products:list, exact:bool) -> np.ndarray:
+    """get_ratio for a chunk of products (called in worker processes).
+
+    When the chunk can not be solved as a whole, each product is solved one by one
+    so that one bad product does not spoil the others.
+
+    Returns
+    -------
+    np.ndarray
+        shape = (len(products), len(materials)). NaN if it could not be solved.
+    """
+    try:
+        return get_ratio(materials = materials, products = products, exact = exact).to_numpy(dtype = float)
+    except ValueError:  # np.linalg.LinAlgErrorも含む．
+        if len(products) == 1:
+            return np.full((1, len(materials)), np.nan)
+    return np.concatenate([_get_ratio_chunk(materials, [product], exact) for product in products], axis = 0)
@@ -0,0 +1,245 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Campaign planner: many synthesis jobs (product, mg, excess) sharing the same starting materials.
+
+The ratio of each distinct product is solved once, the weights of all jobs are calculated in one
+vectorized pass, and the total demand of each material is aggregated. The plan is exported as one
+workbook (a "demand" sheet with live SUM formulas and a "jobs" sheet).
+
+Usage:
+    python campaign.py --materials Li2O La2O3 TiO2 -i jobs.csv -o plan.xlsx
+    (columns of jobs.csv: product, optional mg and <material>_excess (mol%), same as cli.py)
+'''
+
+from contextlib import redirect_stdout
+from math import ceil
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+
+from calculator import WeighingCalculator, Progress
+from cli import KEY_PRODUCT, KEY_MG, SUFFIX_EXCESS, read_records, _guess_format, _is_empty, _parse_excess, _parse_value
+import instrument
+
+
+SHEET_DEMAND = 'demand'
+SHEET_JOBS = 'jobs'
+
+
+class Campaign:
+    def __init__(self, materials:list):
+        """plan of many jobs with the same starting materials.
+
+        Parameters
+        ----------
+        materials : list
+            starting materials
+        """
+        self.materials = list(materials)
+        self.wc = WeighingCalculator(materials = self.materials)
+
+    @instrument.timed('campaign.plan')
+    def plan(self, jobs, mg = 2000, excess = {}, exact = True, retry_inexact = False, n_jobs = 1, progress_bar = False) -> pd.DataFrame:
+        '''
+        calculate the weights of all jobs.
+
+        Parameters
+        ----------
+        jobs : iterable
+            (product, mg, excess) tuples or dicts with the keys 'product', 'mg' and 'excess'.
+            mg and excess ({material: ratio} e.g. {'Li2O': 0.05}) can be omitted or None.
+        mg : float, optional
+            default theoretical amount, by default 2000
+        excess : dict, optional
+            default excess e.g. {'Li2O': 0.05}; merged with that of each job, by default {}
+        exact, retry_inexact, n_jobs, progress_bar :
+            same as `WeighingCalculator.calc`. Products solved again inexactly are listed in `self.inexact_products`.
+
+        Returns
+        -------
+        pd.DataFrame
+            `self.df_jobs`: one row per job, columns: product, mg, mole (mmol), {material}_weight (with excess),
+            {material}_weight_no_excess, total_weight. NaN for jobs whose ratio could not be calculated.
+
+        Raises
+        ------
+        ValueError
+            when the ratio of no product could be calculated.
+        '''
+        products = []
+        ar_mg = []
+        rows_excess = []
+        for job in jobs:
+            if isinstance(job, dict):
+                product, mg_job, excess_job = job[KEY_PRODUCT], job.get(KEY_MG), job.get('excess')
+            else:
+                product, mg_job, excess_job = (tuple(job) + (None, None))[:3]
+            products.append(product.replace(' ', ''))
+            ar_mg.append(mg if mg_job is None else mg_job)
+            rows_excess.append({**excess, **(excess_job or {})})
+        ar_mg = np.array(ar_mg, dtype = float)
+        ar_excess = np.array([[row.get(material, 0.) for material in self.materials] for row in rows_excess], dtype = float).reshape(-1, len(self.materials))
+
+        # 同じ生成物の比率は一度だけ解く．重量はmgに比例するので1 mgあたりで計算しておく．
+        unique_products, idx = np.unique(np.array(products, dtype = str), return_inverse = True)
+        with redirect_stdout(sys.stderr):   # get_ratioは解けなかったときに標準出力へ書き込む．
+            self.wc.calc(products = unique_products.tolist(), mg = 1, excess = {}, exact = exact, retry_inexact = retry_inexact, n_jobs = n_jobs, progress_bar = progress_bar)
+        ar_weight_per_mg = np.full((len(unique_products), len(self.materials)), np.nan)
+        ar_weight_per_mg[self.wc._mask_valid] = self.wc.df_material_weight.to_numpy()
+        ar_mole_per_mg = np.where(self.wc._mask_valid, np.asarray(self.wc.moles, dtype = float), np.nan)
+
+        self.inexact_products = list(self.wc.inexact_products)
+        self._ar_weight_no_excess = ar_weight_per_mg[idx] * ar_mg[:, np.newaxis]
+        self._ar_weight = self._ar_weight_no_excess * (1 + ar_excess)
+        self.failed_jobs = np.flatnonzero(np.isnan(self._ar_weight).all(axis = 1)).tolist()
+        self.df_jobs = pd.DataFrame(
+            np.column_stack([ar_mg, ar_mole_per_mg[idx] * ar_mg, self._ar_weight, self._ar_weight_no_excess, self._ar_weight.sum(axis = 1)]),
+            columns = [KEY_MG, 'mole (mmol)']
+                + ['{}_weight'.format(material) for material in self.materials]
+                + ['{}_weight_no_excess'.format(material) for material in self.materials]
+                + ['total_weight'],
+        )
+        self.df_jobs.insert(0, KEY_PRODUCT, products)
+        instrument.count('jobs', len(products))
+        return self.df_jobs
+
+    def demand(self, stock:dict = None) -> pd.DataFrame:
+        '''
+        total demand of each material over all jobs (jobs which could not be calculated are ignored).
+
+        Parameters
+        ----------
+        stock : dict, optional
+            available mass (mg) e.g. {'Li2O': 5000}, by default None
+
+        Returns
+        -------
+        pd.DataFrame
+            index: materials, columns: weight (mg) (with excess), weight_no_excess (mg), jobs (number of jobs using it)
+            and, if `stock` is given, stock (mg) and shortage (mg).
+        '''
+        df_demand = pd.DataFrame({
+            'weight (mg)': np.nansum(self._ar_weight, axis = 0),
+            'weight_no_excess (mg)': np.nansum(self._ar_weight_no_excess, axis = 0),
+            'jobs': (self._ar_weight > 0).sum(axis = 0),
+        }, index = self.materials)
+        if stock is not None:
+            ar_stock = np.array([stock.get(material, np.nan) for material in self.materials], dtype = float)
+            df_demand['stock (mg)'] = ar_stock
+            df_demand['shortage (mg)'] = np.maximum(df_demand['weight (mg)'].to_numpy() - ar_stock, 0.)
+        return df_demand
+
+    @instrument.timed('campaign.write_workbook')
+    def write_workbook(self, path:str, stock:dict = None, progress_bar = False):
+        '''
+        write the plan to one Excel file: the "demand" sheet sums the columns of the "jobs" sheet with formulas,
+        so a job changed in Excel is reflected in the demand.
+
+        Parameters
+        ----------
+        path : str
+            path of the .xlsx file
+        stock : dict, optional
+            available mass (mg) of materials, by default None
+        progress_bar : bool or callable, optional
+            same as `WeighingCalculator.calc`, by default False
+        '''
+        n_materials = len(self.materials)
+        n_jobs = len(self.df_jobs)
+        progress = Progress(progress_bar, total = n_jobs)
+        wb = Workbook(write_only = True)
+
+        # 集計 (jobsシートの列の合計)
+        ws = wb.create_sheet(title = SHEET_DEMAND)
+        header = ['material', 'weight (mg)', 'weight_no_excess (mg)', 'jobs']
+        if stock is not None:
+            header += ['stock (mg)', 'shortage (mg)']
+        ws.append(header)
+        for j, material in enumerate(self.materials):
+            row = 2 + j
+            cells = []
+            for k in (j, j + n_materials):     # jobsシートの重量 (過剰量あり, なし) の列
+                letter = get_column_letter(4 + k)
+                cells.append("=SUM('{0}'!{1}2:{1}{2})".format(SHEET_JOBS, letter, n_jobs + 1))
+            cells.append("=COUNTIF('{0}'!{1}2:{1}{2},\">0\")".format(SHEET_JOBS, get_column_letter(4 + j), n_jobs + 1))
+            if stock is not None:
+                cells += [stock.get(material), '=IF(ISNUMBER(E{0}),MAX(B{0}-E{0},0),"")'.format(row)]
+            ws.append([material] + cells)
+
+        ws = wb.create_sheet(title = SHEET_JOBS)
+        ws.append(self.df_jobs.columns.tolist())
+        chunksize = max(ceil(n_jobs / Progress.n_steps), 1)
+        for start in range(0, n_jobs, chunksize):
+            chunk = self.df_jobs.iloc[start:start + chunksize]
+            for product, values in zip(chunk[KEY_PRODUCT].tolist(), chunk.iloc[:, 1:].to_numpy(dtype = float).tolist()):
+                ws.append([product] + [None if np.isnan(x) else x for x in values])
+            progress.step(len(chunk))
+        wb.save(path)
+
+
+def read_jobs(records, materials:list) -> list:
+    """jobs from records of `cli.read_records` (product, mg, <material>_excess (mol%))."""
+    jobs = []
+    for record in records:
+        excess = {
+            material: _parse_value(record[material + SUFFIX_EXCESS]) / 100
+            for material in materials if not _is_empty(record.get(material + SUFFIX_EXCESS))
+        }
+        jobs.append((record[KEY_PRODUCT], None if _is_empty(record.get(KEY_MG)) else _parse_value(record[KEY_MG]), excess))
+    return jobs
+
+
+def _parse_stock(items:list) -> dict:
+    stock = {}
+    for item in items:
+        material, _, value = item.partition('=')
+        if not _:
+            raise ValueError('--stock must be given as MATERIAL=MG: {}'.format(item))
+        stock[material] = _parse_value(value)
+    return stock
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Plan many syntheses and aggregate the demand of materials.')
+    parser.add_argument('-m', '--materials', nargs = '+', required = True, help = 'starting materials.')
+    parser.add_argument('-i', '--input', default = '-', help = 'jobs (csv or jsonl) with "product" and optional "mg" and "<material>_excess" (mol%%). "-" means stdin. (default: -)')
+    parser.add_argument('-o', '--output', required = True, help = 'output workbook (.xlsx).')
+    parser.add_argument('--mg', type = _parse_value, default = 2000, help = 'theoretical amount (mg) when the job has no "mg". (default: 2000)')
+    parser.add_argument('--excess', nargs = '*', default = [], metavar = 'MATERIAL=MOL%', help = 'excess amount when the job has no "<material>_excess".')
+    parser.add_argument('--stock', nargs = '*', default = [], metavar = 'MATERIAL=MG', help = 'available mass of materials; the shortage is shown in the demand sheet.')
+    parser.add_argument('--inexact', action = 'store_true', help = 'accept products which do not match the materials exactly.')
+    parser.add_argument('-j', '--n-jobs', type = int, default = 1, help = 'number of processes to parse the products. -1 means all CPUs. (default: 1)')
+    args = parser.parse_args(argv)
+
+    try:
+        excess = _parse_excess(args.excess)
+        stock = _parse_stock(args.stock) if args.stock else None
+    except ValueError as e:
+        parser.error(str(e))
+
+    input_format = 'csv' if args.input == '-' else _guess_format(args.input)
+    f_in = sys.stdin if args.input == '-' else open(args.input, mode = 'r', encoding = 'utf_8', newline = '')
+    try:
+        jobs = read_jobs(read_records(f_in, input_format), args.materials)
+    finally:
+        if f_in is not sys.stdin:
+            f_in.close()
+
+    campaign = Campaign(args.materials)
+    campaign.plan(jobs, mg = args.mg, excess = excess, exact = not args.inexact, n_jobs = args.n_jobs, progress_bar = True)
+    campaign.write_workbook(args.output, stock = stock, progress_bar = True)
+    sys.stdout.write(campaign.demand(stock).to_string() + '\n')
+    sys.stderr.write('{0} jobs planned, {1} could not be calculated.\n'.format(len(jobs), len(campaign.failed_jobs)))
+    if campaign.inexact_products:
+        sys.stderr.write('calculated inexactly: {}\n'.format(', '.join(campaign.inexact_products)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
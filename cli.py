@@ -0,0 +1,314 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Headless batch mode of Weighing Calculator.
+
+Each input record is either a ratio (one column per material) or a product (`product` column).
+`mg` and `<material>_excess` (mol%) columns are optional and override the command-line defaults.
+Records are processed chunk by chunk, so files of any length are handled in constant memory.
+
+Usage:
+    python cli.py --materials Li2O SiO2 MoO3 --excess Li2O=5 < compositions.csv > weights.csv
+    python cli.py -i recipes.jsonl -o weights.parquet
+'''
+
+from contextlib import redirect_stdout
+from itertools import islice
+import argparse
+import csv
+import json
+import os
+import sys
+
+import numpy as np
+
+from calculator import WeighingCalculator
+
+
+FORMATS = ('csv', 'jsonl', 'parquet')
+KEY_PRODUCT = 'product'
+KEY_MG = 'mg'
+SUFFIX_EXCESS = '_excess'
+# 一つの記録だけを計算できなくするエラー (element_recognitionはIndexErrorなども投げる．)
+RECORD_ERRORS = (ValueError, KeyError, IndexError, ZeroDivisionError)
+
+
+def _parse_value(x) -> float:
+    """parse a ratio or an amount. e.g.) 1, '1.0', '1/3'"""
+    if isinstance(x, (int, float)):
+        return float(x)
+    x = str(x).strip()
+    if x.count('/') > 1:
+        raise ValueError('The value you entered is not good: {}'.format(x))
+    elif '/' in x:
+        numerator, denominator = x.split('/')
+        return float(numerator) / float(denominator)
+    return float(x)
+
+
+def _parse_or_nan(x, default:float, scale:float = 1.) -> float:
+    """`_parse_value(x) * scale`, `default` if empty and NaN if malformed (the record is not calculated)."""
+    if _is_empty(x):
+        return default
+    try:
+        return _parse_value(x) * scale
+    except (ValueError, ZeroDivisionError):
+        return np.nan
+
+
+def _is_empty(x) -> bool:
+    return x is None or (isinstance(x, str) and x.strip() == '')
+
+
+def _guess_format(path:str, default:str = 'csv') -> str:
+    ext = os.path.splitext(path)[-1].lstrip('.').lower()
+    if ext == 'json':
+        return 'jsonl'
+    return ext if ext in FORMATS else default
+
+
+def read_records(f, fmt:str):
+    """yield each record of the input file as a dict.
+
+    Parameters
+    ----------
+    f : file object
+        opened in text mode
+    fmt : str
+        'csv' or 'jsonl'
+    """
+    if fmt == 'csv':
+        yield from csv.DictReader(f)
+    elif fmt == 'jsonl':
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        raise ValueError('Unsupported input format: {}'.format(fmt))
+
+
+def infer_materials(record:dict) -> list:
+    """materials are the columns of the record except the reserved ones."""
+    return [k for k in record if k not in (KEY_PRODUCT, KEY_MG) and not k.endswith(SUFFIX_EXCESS)]
+
+
+def output_columns(materials:list) -> list:
+    return [KEY_PRODUCT, KEY_MG, 'mole (mmol)'] \
+        + ['{}_weight'.format(material) for material in materials] \
+        + ['{}_weight_no_excess'.format(material) for material in materials] \
+        + ['total_weight']
+
+
+def calc_records(wc:WeighingCalculator, records:list, mg:float = 2000, excess:dict = {}, exact:bool = True, n_jobs:int = 1, rational:bool = False) -> list:
+    """calculate weighing of a chunk of records.
+
+    Weights are linear in mg and excess, thus the ratio is solved once per chunk with mg = 1
+    and scaled by the amount and excess of each record.
+
+    Parameters
+    ----------
+    wc : WeighingCalculator
+    records : list
+        list of dict
+    mg : float, optional
+        default amount, by default 2000
+    excess : dict, optional
+        default excess ratio e.g. {'Li2O': 0.05}, by default {}
+    exact : bool, optional
+        exact matching of products, by default True
+    n_jobs : int, optional
+        number of processes to solve the ratio of products, by default 1
+    rational : bool, optional
+        exact rational arithmetic (see `WeighingCalculator.calc`), by default False
+
+    Returns
+    -------
+    list
+        list of dict whose keys are `output_columns(wc.materials)`.
+        The weights of records which could not be calculated (including malformed or missing values) are None.
+    """
+    n_materials = len(wc.materials)
+    ar_mg = np.array([_parse_or_nan(record.get(KEY_MG), mg) for record in records], dtype = float)
+    ar_excess = np.array([
+        [_parse_or_nan(record.get(material + SUFFIX_EXCESS), excess.get(material, 0.), scale = 1 / 100) for material in wc.materials]
+        for record in records
+    ], dtype = float).reshape(-1, n_materials)
+
+    # 1 mgあたりの重量とモル数
+    ar_weight = np.full((len(records), n_materials), np.nan)
+    ar_mole = np.full(len(records), np.nan)
+    products = [None] * len(records)
+
+    def _calc(idx, **kwargs):
+        # get_ratioは解けなかったときに標準出力へ書き込むので，出力を汚さないようにstderrへ流す．
+        with redirect_stdout(sys.stderr):
+            wc.calc(mg = 1, progress_bar = False, rational = rational, **kwargs)
+        mask_valid = ~np.isnan(wc.df_ratio.to_numpy(dtype = float)).all(axis = 1)
+        ar_weight[idx[mask_valid]] = wc.df_material_weight.to_numpy()
+        ar_mole[idx[mask_valid]] = np.asarray(wc.moles, dtype = float)[mask_valid]
+        for i, product in zip(idx, wc.products):
+            products[i] = product
+
+    def _calc_each(idx, kwargs_of):
+        """calculate the records of `idx` at once, or one by one when one of them is bad (its row is left empty)."""
+        try:
+            _calc(idx, **kwargs_of(idx))
+        except RECORD_ERRORS:
+            if len(idx) > 1:
+                for i in idx:
+                    _calc_each(np.array([i]), kwargs_of)
+
+    def _ratio(i:int) -> list:
+        values = [_parse_value(records[i][material]) for material in wc.materials]
+        if not any(values):
+            raise ValueError('All ratios are 0.')
+        return [str(records[i][material]) for material in wc.materials] if rational else values
+
+    def _is_valid_ratio(i:int) -> bool:
+        try:
+            _ratio(i)
+        except RECORD_ERRORS:
+            return False
+        return True
+
+    idx_product = np.array([i for i, record in enumerate(records) if not _is_empty(record.get(KEY_PRODUCT))], dtype = int)
+    for i in idx_product:
+        products[i] = str(records[i][KEY_PRODUCT])
+    # 不正な比率 (数でない，ない，すべて0) の記録は計算しない．
+    idx_ratio = np.array([i for i in np.setdiff1d(np.arange(len(records)), idx_product) if _is_valid_ratio(i)], dtype = int)
+    if len(idx_product):
+        _calc_each(idx_product, lambda idx: {'products': [products[i] for i in idx], 'exact': exact, 'n_jobs': n_jobs})
+    if len(idx_ratio):
+        _calc_each(idx_ratio, lambda idx: {'ratio': [_ratio(i) for i in idx]})
+
+    ar_weight_no_excess = ar_weight * ar_mg[:, np.newaxis]
+    ar_weight_excess = ar_weight_no_excess * (1 + ar_excess)
+    ar_mole = ar_mole * ar_mg
+
+    columns = output_columns(wc.materials)
+    rows = []
+    for i in range(len(records)):
+        values = [ar_mole[i]] + ar_weight_excess[i].tolist() + ar_weight_no_excess[i].tolist() + [ar_weight_excess[i].sum()]
+        rows.append(dict(zip(columns, [products[i]] + [None if np.isnan(v) else float(v) for v in [ar_mg[i]] + values])))
+    return rows
+
+
+class _CsvWriter:
+    def __init__(self, f, columns:list):
+        self.f = f
+        self.writer = csv.DictWriter(f, fieldnames = columns)
+        self.writer.writeheader()
+
+    def write(self, rows:list):
+        self.writer.writerows(rows)
+        self.f.flush()
+
+    def close(self):
+        pass
+
+
+class _JsonlWriter:
+    def __init__(self, f, columns:list):
+        self.f = f
+
+    def write(self, rows:list):
+        self.f.writelines(json.dumps(row, ensure_ascii = False) + '\n' for row in rows)
+        self.f.flush()
+
+    def close(self):
+        pass
+
+
+class _ParquetWriter:
+    def __init__(self, path:str, columns:list):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('pyarrow is required to write parquet files.')
+        self.pa = pa
+        self.schema = pa.schema([(column, pa.string() if column == KEY_PRODUCT else pa.float64()) for column in columns])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, rows:list):
+        self.writer.write_table(self.pa.Table.from_pylist(rows, schema = self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def _parse_excess(items:list) -> dict:
+    excess = {}
+    for item in items:
+        material, _, value = item.partition('=')
+        if not _:
+            raise ValueError('--excess must be given as MATERIAL=MOL%: {}'.format(item))
+        excess[material] = _parse_value(value) / 100
+    return excess
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Calculate weighing without GUI.')
+    parser.add_argument('-i', '--input', default = '-', help = 'input file (csv or jsonl). "-" means stdin. (default: -)')
+    parser.add_argument('-o', '--output', default = '-', help = 'output file (csv, jsonl or parquet). "-" means stdout. (default: -)')
+    parser.add_argument('--input-format', choices = FORMATS[:2], help = 'guessed from the extension if omitted.')
+    parser.add_argument('--output-format', choices = FORMATS, help = 'guessed from the extension if omitted.')
+    parser.add_argument('-m', '--materials', nargs = '+', help = 'starting materials. If omitted, the columns of the first record are used.')
+    parser.add_argument('--mg', type = _parse_value, default = 2000, help = 'theoretical amount (mg) when the record has no "mg". (default: 2000)')
+    parser.add_argument('--excess', nargs = '*', default = [], metavar = 'MATERIAL=MOL%', help = 'excess amount when the record has no "<material>_excess".')
+    parser.add_argument('--inexact', action = 'store_true', help = 'accept products which do not match the materials exactly.')
+    parser.add_argument('--rational', action = 'store_true', help = 'calculate the weights with exact rational arithmetic and round only at output.')
+    parser.add_argument('-j', '--n-jobs', type = int, default = 1, help = 'number of processes to solve the ratio of products. -1 means all CPUs. (default: 1)')
+    parser.add_argument('--chunksize', type = int, default = 10000, help = 'number of records calculated at once. (default: 10000)')
+    args = parser.parse_args(argv)
+
+    input_format = args.input_format or ('csv' if args.input == '-' else _guess_format(args.input))
+    output_format = args.output_format or ('csv' if args.output == '-' else _guess_format(args.output))
+    if output_format == 'parquet' and args.output == '-':
+        parser.error('parquet cannot be written to stdout.')
+    try:
+        excess = _parse_excess(args.excess)
+    except ValueError as e:
+        parser.error(str(e))
+
+    f_in = sys.stdin if args.input == '-' else open(args.input, mode = 'r', encoding = 'utf_8', newline = '')
+    f_out = None
+    writer = None
+    n_records = 0
+    n_failed = 0
+    try:
+        records = read_records(f_in, input_format)
+        chunk = list(islice(records, args.chunksize))
+        if not chunk:
+            return 0
+        materials = args.materials or infer_materials(chunk[0])
+        wc = WeighingCalculator(materials = materials)
+        columns = output_columns(materials)
+
+        if output_format == 'parquet':
+            writer = _ParquetWriter(args.output, columns)
+        else:
+            f_out = sys.stdout if args.output == '-' else open(args.output, mode = 'w', encoding = 'utf_8', newline = '')
+            writer = (_CsvWriter if output_format == 'csv' else _JsonlWriter)(f_out, columns)
+
+        while chunk:
+            rows = calc_records(wc, chunk, mg = args.mg, excess = excess, exact = not args.inexact, n_jobs = args.n_jobs, rational = args.rational)
+            writer.write(rows)
+            n_records += len(rows)
+            n_failed += sum(row['total_weight'] is None for row in rows)
+            chunk = list(islice(records, args.chunksize))
+    finally:
+        if writer is not None:
+            writer.close()
+        if f_out not in (None, sys.stdout):
+            f_out.close()
+        if f_in is not sys.stdin:
+            f_in.close()
+
+    sys.stderr.write('{0} records processed, {1} could not be calculated.\n'.format(n_records, n_failed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Memory-mapped columnar files of results (e.g. sweeps of millions of compositions).
+
+A result is a directory:
+
+* c<i>.f8             values of the i-th column (little-endian float64, one file per column)
+* products.utf8       product names (UTF-8, concatenated), optional
+* products.end.i8     end offset of each name in products.utf8 (int64)
+* meta.json           columns, number of rows and metadata; written last (atomically),
+                      so a directory without it is an unfinished write.
+
+Columns are appended chunk by chunk, so results larger than memory can be written, and they are
+reopened with `np.memmap` without reading the data; a column or a range of rows is a zero-copy view.
+'''
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from storage import write_json_atomic
+
+
+FORMAT_VERSION = 1
+DTYPE = '<f8'
+FNAME_META = 'meta.json'
+FNAME_PRODUCTS = 'products.utf8'
+FNAME_PRODUCTS_END = 'products.end.i8'
+
+
+def _fname_column(i:int) -> str:
+    return 'c{}.f8'.format(i)
+
+
+class ColumnarWriter:
+    def __init__(self, path:str, columns:list, products:bool = True, metadata:dict = None):
+        """writer of a columnar result directory.
+
+        Parameters
+        ----------
+        path : str
+            directory (created if it does not exist; an existing result is overwritten)
+        columns : list
+            names of the numerical columns
+        products : bool, optional
+            whether product names are written with the rows, by default True
+        metadata : dict, optional
+            json-serializable information stored in meta.json (materials, mg, ...), by default None
+        """
+        self.path = path
+        self.columns = list(columns)
+        self.metadata = dict(metadata or {})
+        self.n_rows = 0
+        os.makedirs(path, exist_ok = True)
+        if os.path.exists(os.path.join(path, FNAME_META)):  # 書きかけのものと区別するため先に消す．
+            os.remove(os.path.join(path, FNAME_META))
+        self._files = [open(os.path.join(path, _fname_column(i)), mode = 'wb') for i in range(len(self.columns))]
+        if products:
+            self._f_products = open(os.path.join(path, FNAME_PRODUCTS), mode = 'wb')
+            self._f_products_end = open(os.path.join(path, FNAME_PRODUCTS_END), mode = 'wb')
+            self._products_end = 0
+        else:
+            self._f_products = self._f_products_end = None
+
+    def append(self, values:np.ndarray, products:list = None):
+        """append rows.
+
+        Parameters
+        ----------
+        values : np.ndarray
+            (n_rows, len(columns))
+        products : list, optional
+            n_rows names (required when the writer has products), by default None
+        """
+        values = np.asarray(values, dtype = DTYPE).reshape(-1, len(self.columns))
+        for i, f in enumerate(self._files):
+            f.write(np.ascontiguousarray(values[:, i]).tobytes())
+        if self._f_products is not None:
+            if products is None or len(products) != len(values):
+                raise ValueError('A name is required for each row.')
+            encoded = [str(product).encode('utf_8') for product in products]
+            ends = self._products_end + np.cumsum([len(b) for b in encoded], dtype = np.int64)
+            self._f_products.write(b''.join(encoded))
+            self._f_products_end.write(ends.astype('<i8').tobytes())
+            if len(ends):
+                self._products_end = int(ends[-1])
+        self.n_rows += len(values)
+
+    def append_frame(self, df:pd.DataFrame):
+        """append a DataFrame whose columns are `self.columns` (its index is the product names)."""
+        self.append(df.loc[:, self.columns].to_numpy(dtype = float), None if self._f_products is None else df.index.astype(str).tolist())
+
+    def close(self):
+        for f in self._files + [self._f_products, self._f_products_end]:
+            if f is not None:
+                f.close()
+        write_json_atomic(os.path.join(self.path, FNAME_META), {
+            'version': FORMAT_VERSION,
+            'n_rows': self.n_rows,
+            'columns': self.columns,
+            'products': self._f_products is not None,
+            'metadata': self.metadata,
+        }, indent = 4)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:   # 中止されたときはmeta.jsonを書かない (未完成のまま)．
+            for f in self._files + [self._f_products, self._f_products_end]:
+                if f is not None:
+                    f.close()
+
+
+class ColumnarResult:
+    def __init__(self, path:str):
+        """read a columnar result directory with memory maps (nothing is read until it is accessed).
+
+        Parameters
+        ----------
+        path : str
+            directory written by ColumnarWriter
+
+        Raises
+        ------
+        FileNotFoundError
+            when meta.json does not exist (not a result or an unfinished write)
+        """
+        self.path = path
+        with open(os.path.join(path, FNAME_META), mode = 'r', encoding = 'utf_8') as f:
+            meta = json.load(f)
+        self.n_rows = meta['n_rows']
+        self.columns = meta['columns']
+        self.metadata = meta['metadata']
+        self.has_products = meta['products']
+        self._columns = {}
+        self._products = self._products_end = None
+
+    def __len__(self) -> int:
+        return self.n_rows
+
+    def _memmap(self, fname:str, dtype:str) -> np.ndarray:
+        if self.n_rows == 0:    # 空のファイルはmemmapできない．
+            return np.empty(0, dtype = dtype)
+        return np.memmap(os.path.join(self.path, fname), dtype = dtype, mode = 'r', shape = (self.n_rows, ))
+
+    def column(self, name:str) -> np.ndarray:
+        """read-only memory map of a column (zero copy)"""
+        if name not in self._columns:
+            self._columns[name] = self._memmap(_fname_column(self.columns.index(name)), DTYPE)
+        return self._columns[name]
+
+    __getitem__ = column
+
+    def products(self, rows:slice = slice(None)) -> list:
+        """product names of a range of rows"""
+        if not self.has_products:
+            return list(range(self.n_rows)[rows])
+        start, stop, step = rows.indices(self.n_rows)
+        if step != 1:
+            raise ValueError('Only slices with step 1 are supported.')
+        if stop <= start:
+            return []
+        if self._products_end is None:
+            self._products_end = self._memmap(FNAME_PRODUCTS_END, '<i8')
+            self._products = np.memmap(os.path.join(self.path, FNAME_PRODUCTS), dtype = 'u1', mode = 'r') if self._products_end[-1] else np.empty(0, dtype = 'u1')
+        ends = np.asarray(self._products_end[start:stop])
+        first = int(self._products_end[start - 1]) if start else 0
+        blob = self._products[first:int(ends[-1])].tobytes()
+        bounds = np.concatenate([[0], ends - first]).tolist()
+        return [blob[a:b].decode('utf_8') for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def frame(self, rows:slice = slice(None), columns:list = None) -> pd.DataFrame:
+        """DataFrame of a range of rows (only this range is read)"""
+        columns = self.columns if columns is None else columns
+        return pd.DataFrame({column: np.asarray(self.column(column)[rows]) for column in columns}, index = self.products(rows), columns = columns)
+
+    def iter_frames(self, chunksize:int = 10000, columns:list = None):
+        """yield DataFrames of `chunksize` rows (e.g. for export)"""
+        for start in range(0, self.n_rows, chunksize):
+            yield self.frame(slice(start, start + chunksize), columns)
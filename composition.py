@@ -0,0 +1,109 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Sparse (CSR) matrix of element counts.
+
+A formula contains only a few of the ~120 elements, so the counts are kept as
+(element indices, counts) pairs instead of dense rows over all elements.
+'''
+
+import numpy as np
+
+
+# 元素の番号 (元素数 < 32768)
+INDEX_DTYPE = np.int16
+
+
+class CompositionMatrix:
+    def __init__(self, indptr:np.ndarray, indices:np.ndarray, data:np.ndarray, n_elements:int):
+        """element counts in CSR format (rows: formulas, columns: elements).
+
+        Parameters
+        ----------
+        indptr : np.ndarray
+            (n_rows + 1, ) start of each row in `indices` and `data`
+        indices : np.ndarray
+            element index of each nonzero count
+        data : np.ndarray
+            nonzero counts
+        n_elements : int
+            number of columns
+        """
+        self.indptr = np.asarray(indptr, dtype = np.int64)
+        self.indices = np.asarray(indices, dtype = INDEX_DTYPE)
+        self.data = np.asarray(data, dtype = float)
+        self.n_elements = n_elements
+
+    @classmethod
+    def from_dense(cls, ar_counts:np.ndarray) -> 'CompositionMatrix':
+        ar_counts = np.asarray(ar_counts, dtype = float).reshape(-1, ar_counts.shape[-1])
+        rows, indices = np.nonzero(ar_counts)
+        indptr = np.zeros(len(ar_counts) + 1, dtype = np.int64)
+        np.cumsum(np.bincount(rows, minlength = len(ar_counts)), out = indptr[1:])
+        return cls(indptr, indices, ar_counts[rows, indices], ar_counts.shape[1])
+
+    @classmethod
+    def from_rows(cls, rows:list, n_elements:int) -> 'CompositionMatrix':
+        """from a list of (indices, data) of each row"""
+        indptr = np.zeros(len(rows) + 1, dtype = np.int64)
+        np.cumsum([len(indices) for indices, _ in rows], out = indptr[1:])
+        if rows:
+            indices = np.concatenate([indices for indices, _ in rows])
+            data = np.concatenate([data for _, data in rows])
+        else:
+            indices, data = [], []
+        return cls(indptr, indices, data, n_elements)
+
+    @classmethod
+    def concatenate(cls, matrices:list, n_elements:int) -> 'CompositionMatrix':
+        """stack the rows of matrices"""
+        if not matrices:
+            return cls.from_rows([], n_elements)
+        offsets = np.cumsum([0] + [len(matrix.data) for matrix in matrices[:-1]])
+        indptr = np.concatenate([[0]] + [matrix.indptr[1:] + offset for matrix, offset in zip(matrices, offsets)])
+        return cls(indptr, np.concatenate([matrix.indices for matrix in matrices]), np.concatenate([matrix.data for matrix in matrices]), n_elements)
+
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    def __getitem__(self, rows:slice) -> 'CompositionMatrix':
+        """rows in a slice (step 1), sharing memory"""
+        start, stop, step = rows.indices(len(self))
+        if step != 1:
+            raise ValueError('Only slices with step 1 are supported.')
+        stop = max(start, stop)
+        indptr = self.indptr[start:stop + 1]
+        return CompositionMatrix(indptr - indptr[0], self.indices[indptr[0]:indptr[-1]], self.data[indptr[0]:indptr[-1]], self.n_elements)
+
+    @property
+    def nbytes(self) -> int:
+        return self.indptr.nbytes + self.indices.nbytes + self.data.nbytes
+
+    def row(self, i:int) -> tuple:
+        """(indices, data) of the i-th row (copies, so that they do not keep the whole matrix alive)"""
+        start, stop = self.indptr[i], self.indptr[i + 1]
+        return self.indices[start:stop].copy(), self.data[start:stop].copy()
+
+    def _row_ids(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self)), np.diff(self.indptr))
+
+    def dot(self, weights:np.ndarray) -> np.ndarray:
+        """matrix-vector product, e.g.) formula weights from atomic weights"""
+        return np.bincount(self._row_ids(), weights = self.data * np.asarray(weights, dtype = float)[self.indices], minlength = len(self))
+
+    def used_columns(self) -> np.ndarray:
+        """sorted indices of the elements contained in any row"""
+        return np.unique(self.indices)
+
+    def to_dense(self, columns:np.ndarray = None) -> np.ndarray:
+        """dense (n_rows, len(columns)) array of the selected element columns (all if None)"""
+        if columns is None:
+            columns = np.arange(self.n_elements)
+        position = np.full(self.n_elements, -1, dtype = np.int64)
+        position[columns] = np.arange(len(columns))
+        ar = np.zeros((len(self), len(columns)))
+        row_ids = self._row_ids()
+        mask = position[self.indices] >= 0
+        ar[row_ids[mask], position[self.indices[mask]]] = self.data[mask]
+        return ar
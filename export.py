@@ -0,0 +1,264 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Excel export of the weighing results.
+
+Each product is written as one block of rows with live Excel formulas (mole, excess, weight, SUM),
+so the amount and the excess can be changed within Excel.
+The workbook is written in the write-only (streaming) mode of openpyxl to keep memory bounded.
+'''
+
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+
+from calculator import Progress
+import instrument
+
+
+IND_MOLAR_WEIGHT = 'M.W.'
+IND_MOLAR_RATIO = 'molar ratio'
+IND_MOLE = 'mole (mmol)'
+IND_EXCESS_RATIO = 'excess ratio (mol%)'
+IND_MOLE_WITH_EXCESS = 'mole w/ excess'
+IND_WEIGHT_WITHOUT_EXCESS = 'no excess weight (mg)'
+IND_WEIGHT = 'weight (mg)'
+IND_MEASURED_VALUE = 'measured value (mg)'
+INDEX = (IND_MOLAR_WEIGHT, IND_MOLAR_RATIO, IND_MOLE, IND_EXCESS_RATIO, IND_MOLE_WITH_EXCESS, IND_WEIGHT_WITHOUT_EXCESS, IND_WEIGHT, IND_MEASURED_VALUE)
+
+
+class OutputLayout:
+    def __init__(self, materials:tuple):
+        """layout of one block (one product) of the output table.
+
+        Column letters and formula templates are computed only once per materials,
+        and each block only fills its row numbers in.
+
+        Parameters
+        ----------
+        materials : tuple
+            starting materials
+        """
+        self.materials = tuple(materials)
+        n_materials = len(self.materials)
+        # A列はindex
+        self.letters = [get_column_letter(i + 2) for i in range(n_materials)]
+        self.letter_product = get_column_letter(n_materials + 2)
+        self.n_rows = len(INDEX) + 2   # header + INDEX + 空行
+
+        # 行番号だけを後から埋める数式のテンプレート．{0}はINDEXの各行のExcel上の行番号のリスト．
+        p = self.letter_product
+        self._templates = {
+            IND_MOLE: ['={0}{{0[1]}}/${1}${{0[1]}}*${1}${{0[2]}}'.format(c, p) for c in self.letters] + ['={0}{{0[5]}}/{0}{{0[0]}}'.format(p)],
+            IND_MOLE_WITH_EXCESS: ['={0}{{0[2]}}*(1+{0}{{0[3]}}/100)'.format(c) for c in self.letters],
+            IND_WEIGHT_WITHOUT_EXCESS: ['={0}{{0[0]}}*{0}{{0[2]}}'.format(c) for c in self.letters],
+            IND_WEIGHT: ['={0}{{0[0]}}*{0}{{0[4]}}'.format(c) for c in self.letters] + ['=SUM({0}{{0[6]}}:{1}{{0[6]}})'.format(self.letters[0], self.letters[-1])],
+        }
+
+    def formulas(self, header_row:int = 1) -> dict:
+        """formulas of the block whose header is at `header_row` (Excel row number, 1-index).
+
+        Returns
+        -------
+        dict
+            key: item of INDEX, value: list of formulas
+        """
+        rows = range(header_row + 1, header_row + 1 + len(INDEX))
+        return {ind: [template.format(rows) for template in templates] for ind, templates in self._templates.items()}
+
+    def values(self, wc, i:int = 0) -> np.ndarray:
+        """numerical values of the block of `wc.products[i]` as a (len(INDEX), n_materials + 1) array (NaN = empty)."""
+        ar_ratio = np.asarray(wc.df_ratio.iloc[i], dtype = float)
+        mole = wc.moles[i]
+        ar_formula_weight = np.array([wc.dict_materials[material] for material in self.materials] + [wc._ar_formula_weight_products[i]], dtype = float)
+        ar_excess = np.array([wc.excess[material] * 100 if material in wc.excess else np.nan for material in self.materials], dtype = float)
+
+        ar_values = np.full((len(INDEX), len(self.materials) + 1), np.nan)
+        ar_values[0] = ar_formula_weight
+        ar_values[1, :-1] = ar_ratio
+        ar_values[1, -1] = 1
+        ar_values[2] = ar_values[1] * mole
+        ar_values[3, :-1] = ar_excess
+        ar_values[4, :-1] = ar_values[2, :-1] * (1 + np.nan_to_num(ar_excess) / 100)
+        ar_values[5, :-1] = ar_ratio * mole * ar_formula_weight[:-1]   # calcと同じ計算順
+        ar_values[5, -1] = wc.mg
+        ar_values[6, :-1] = ar_values[5, :-1] * (1 + np.nan_to_num(ar_excess) / 100)
+        ar_values[6, -1] = ar_values[6, :-1].sum()
+        return ar_values
+
+    def block_rows(self, wc, i:int = 0, header_row:int = 1) -> list:
+        """rows (lists of cell values) written to Excel for `wc.products[i]`."""
+        product = wc.products[i]
+        ar_values = self.values(wc, i)
+        formulas = self.formulas(header_row)
+        n_materials = len(self.materials)
+        return [
+            [''] + list(self.materials) + [product],
+            [IND_MOLAR_WEIGHT] + ar_values[0].tolist(),
+            [IND_MOLAR_RATIO] + [None if np.isnan(x) else x for x in ar_values[1, :-1]] + [1],
+            [IND_MOLE] + formulas[IND_MOLE],
+            [IND_EXCESS_RATIO] + [None if np.isnan(x) else x for x in ar_values[3, :-1]] + [None],
+            [IND_MOLE_WITH_EXCESS] + formulas[IND_MOLE_WITH_EXCESS] + [None],
+            [IND_WEIGHT_WITHOUT_EXCESS] + formulas[IND_WEIGHT_WITHOUT_EXCESS] + [wc.mg],
+            [IND_WEIGHT] + formulas[IND_WEIGHT],
+            [IND_MEASURED_VALUE] + [None] * (n_materials + 1),
+            [],
+        ]
+
+    def formula_table(self, wc, i:int = 0) -> pd.DataFrame:
+        """table with Excel formulas of `wc.products[i]` (index: INDEX, columns: materials + [product])."""
+        rows = self.block_rows(wc, i)[1:-1]    # headerと空行を除く．
+        return pd.DataFrame([[np.nan if x is None else x for x in row[1:]] for row in rows], index = list(INDEX), columns = list(self.materials) + [wc.products[i]], dtype = object)
+
+    def display_table(self, wc, i:int = 0) -> pd.DataFrame:
+        """table of formatted strings ('{:.2f}', empty if NaN) of `wc.products[i]`."""
+        ar_values = self.values(wc, i)
+        ar_str = np.where(np.isnan(ar_values), '', np.char.mod('%.2f', ar_values))
+        return pd.DataFrame(ar_str, index = list(INDEX), columns = list(self.materials) + [wc.products[i]])
+
+
+class ResultTable:
+    # 数値以外の列
+    COLUMN_PRODUCT = 'product'
+
+    def __init__(self, wc):
+        """one row per calculated product of `wc` for the result viewer.
+
+        Only the numbers are kept; cells are formatted when a page is requested.
+        Sorting and filtering work on the numbers and only change `self.order`
+        (the indices of the visible rows), so they are fast even for many products.
+
+        Parameters
+        ----------
+        wc : WeighingCalculator
+            calculated one.
+        """
+        mask_valid = wc._mask_valid
+        self.products = np.array(wc.products, dtype = str)[mask_valid]
+        self.columns = [IND_MOLE] + ['{} (mg)'.format(material) for material in wc.materials] + ['total (mg)']
+        ar_weight = wc.df_material_weight_excess.to_numpy(dtype = float)
+        self.values = np.column_stack([np.asarray(wc.moles, dtype = float)[mask_valid], ar_weight, ar_weight.sum(axis = 1)])
+        self._mask = np.ones(len(self.products), dtype = bool)
+        self.sort_column = None     # Noneのときは計算した順
+        self.ascending = True
+        self.order = np.arange(len(self.products))
+
+    def __len__(self) -> int:
+        """number of visible rows"""
+        return len(self.order)
+
+    @property
+    def n_columns(self) -> int:
+        """number of numerical columns"""
+        return len(self.columns)
+
+    def filter(self, text:str = '', ranges:dict = None):
+        """show only products containing `text` and whose values are in `ranges` {column: (min, max)} (None = unbounded)."""
+        mask = np.ones(len(self.products), dtype = bool)
+        text = text.replace(' ', '')
+        if text:
+            mask &= np.char.find(self.products, text) >= 0
+        for column, (lower, upper) in (ranges or {}).items():
+            values = self.values[:, self.columns.index(column)]
+            if lower is not None:
+                mask &= values >= lower
+            if upper is not None:
+                mask &= values <= upper
+        self._mask = mask
+        self._update_order()
+
+    def sort(self, column:str = None, ascending:bool = True):
+        """sort by `column` (COLUMN_PRODUCT, one of `self.columns` or None for the calculated order). NaN comes last."""
+        self.sort_column = column
+        self.ascending = ascending
+        self._update_order()
+
+    def _update_order(self):
+        idx = np.flatnonzero(self._mask)
+        if self.sort_column == self.COLUMN_PRODUCT:
+            idx = idx[np.argsort(self.products[idx], kind = 'stable')]
+            if not self.ascending:
+                idx = idx[::-1]
+        elif self.sort_column is not None:
+            keys = self.values[idx, self.columns.index(self.sort_column)]
+            idx = idx[np.argsort(keys if self.ascending else -keys, kind = 'stable')]    # NaNはどちらでも最後
+        elif not self.ascending:
+            idx = idx[::-1]
+        self.order = idx
+
+    def headings(self, col_start:int = 0, n_cols:int = None) -> list:
+        """headings of the product column and the numerical columns in the window"""
+        return [self.COLUMN_PRODUCT] + self.columns[col_start:None if n_cols is None else col_start + n_cols]
+
+    def page(self, start:int = 0, n_rows:int = 50, col_start:int = 0, n_cols:int = None) -> list:
+        """formatted rows ('{:.2f}', empty if NaN) of visible rows [start, start + n_rows) and the columns in the window"""
+        rows = self.order[start:start + n_rows]
+        ar_values = self.values[rows, col_start:None if n_cols is None else col_start + n_cols]
+        ar_str = np.where(np.isnan(ar_values), '', np.char.mod('%.2f', ar_values))
+        return [[product] + row for product, row in zip(self.products[rows].tolist(), ar_str.tolist())]
+
+
+@lru_cache(maxsize = 32)
+def get_output_layout(materials:tuple) -> OutputLayout:
+    """OutputLayout cached per materials."""
+    return OutputLayout(materials)
+
+
+def iter_block_rows(wc, first_row:int = 1, progress_bar = False):
+    """yield the rows (lists of cell values) of all products of `wc`.
+
+    A block consists of a header row, one row for each item of INDEX and a blank row.
+
+    Parameters
+    ----------
+    wc : WeighingCalculator
+        calculated one.
+    first_row : int, optional
+        Excel row number (1-index) where the first block starts, by default 1
+    progress_bar : bool or callable, optional
+        same as `WeighingCalculator.calc`; one step per product, by default False
+    """
+    layout = get_output_layout(tuple(wc.materials))
+    ar_ratio = wc.df_ratio.to_numpy(dtype = float)
+    idx_valid = np.where(~np.isnan(ar_ratio).all(axis = 1))[0]     # calcで計算できた生成物だけ書き出す．
+    progress = Progress(progress_bar, total = len(idx_valid))
+
+    header_row = first_row
+    for i in idx_valid:
+        yield from layout.block_rows(wc, i, header_row)
+        header_row += layout.n_rows
+        progress.step()
+
+
+@instrument.timed('write_workbook')
+def write_workbook(path:str, wc, sheet_title:str = 'weighing', progress_bar = False):
+    """write all products of `wc` to an Excel file with the streaming writer.
+
+    Parameters
+    ----------
+    path : str
+        path of the .xlsx file
+    wc : WeighingCalculator
+        calculated one.
+    sheet_title : str, optional
+        title of the worksheet, by default 'weighing'
+    progress_bar : bool or callable, optional
+        same as `WeighingCalculator.calc`, by default False
+    """
+    wb = Workbook(write_only = True)
+    ws = wb.create_sheet(title = sheet_title)
+    instrument.count('products', len(wc.products))
+    try:
+        with instrument.timer('append_rows'):
+            for row in iter_block_rows(wc, progress_bar = progress_bar):
+                ws.append(row)
+    except BaseException:   # 中止されたときは書きかけの一時ファイルを閉じて消す．
+        ws.close()
+        ws._writer.cleanup()
+        raise
+    with instrument.timer('save'):
+        wb.save(path)
@@ -0,0 +1,194 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Parser of chemical formulas which returns plain dicts and sparse arrays.
+
+Supported: element symbols, counts (integers, decimals and fractions such as 1/3),
+nested parentheses / brackets and hydrates such as "CuSO4·5H2O" (also "•" or "*").
+Formulas written as plain element-count pairs (e.g. "Li0.33La0.55TiO3") take a faster path.
+
+Anything else (unknown symbols, polyatomic "elements" in a custom table, stray characters) raises
+FormulaError, and `FormulaParser.parse_many` hands such formulas to `element_recognition` one by one,
+so the results are the same as before for every input the library accepted.
+Formulas which are malformed for certain (unbalanced brackets) raise MalformedFormulaError instead.
+'''
+
+from functools import lru_cache
+import re
+
+import numpy as np
+
+from composition import CompositionMatrix
+
+
+# 元素記号と組成数だけの組成 (かっこや水和物を含まないもの)
+_SIMPLE = re.compile(r'(?:[A-Z][a-z]*(?:\d+(?:\.\d*)?(?:/\d+(?:\.\d*)?)?|\.\d+)?)+')
+_SIMPLE_TOKEN = re.compile(r'([A-Z][a-z]*)([\d./]*)')
+_TOKEN = re.compile(r'''
+    (?P<element>[A-Z][a-z]*)
+    |(?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:/(?:\d+(?:\.\d*)?|\.\d+))?)
+    |(?P<open>[(\[])
+    |(?P<close>[)\]])
+    |(?P<hydrate>[·•*])
+''', re.VERBOSE)
+_PAIRS = {')': '(', ']': '['}
+
+
+class FormulaError(ValueError):
+    """the formula can not be parsed by this parser."""
+
+
+class MalformedFormulaError(FormulaError):
+    """the formula is invalid (e.g. unbalanced brackets); it is not handed to element_recognition."""
+
+
+def _value(x:str) -> float:
+    """count written as a decimal or a fraction (same as element_recognition)"""
+    if '/' in x:
+        numerator, denominator = x.split('/')
+        return float(numerator) / float(denominator)
+    return float(x)
+
+
+def _tokens(formula:str) -> list:
+    tokens = []
+    position = 0
+    for match in _TOKEN.finditer(formula):
+        if match.start() != position:
+            raise FormulaError('Unexpected character in {0!r} at {1}.'.format(formula, position))
+        tokens.append((match.lastgroup, match.group()))
+        position = match.end()
+    if position != len(formula):
+        raise FormulaError('Unexpected character in {0!r} at {1}.'.format(formula, position))
+    return tokens
+
+
+def parse_formula(formula:str) -> list:
+    '''
+    parse a chemical formula into (element, count) pairs in the order they appear.
+
+    e.g.) 'Ca(OH)2' -> [('Ca', 1.0), ('O', 2.0), ('H', 2.0)]
+
+    Raises
+    ------
+    MalformedFormulaError
+        when the formula is invalid (unbalanced brackets).
+    FormulaError
+        when the formula has a syntax this parser does not support.
+    '''
+    formula = formula.replace(' ', '')
+    if not formula:
+        raise FormulaError('Empty formula.')
+    if _SIMPLE.fullmatch(formula):
+        return [(symbol, _value(count) if count else 1.0) for symbol, count in _SIMPLE_TOKEN.findall(formula)]
+
+    tokens = _tokens(formula)
+    result = []
+    # かっこごとの (開きかっこ, そのかっこ内の結果の開始位置)
+    stack = []
+    coefficient_start = None    # 水和物の係数が掛かる範囲の開始位置
+    coefficient = 1.0
+    i = 0
+    while i < len(tokens):
+        kind, text = tokens[i]
+        following = tokens[i + 1][1] if i + 1 < len(tokens) and tokens[i + 1][0] == 'number' else None
+        if kind == 'element':
+            result.append((text, 1.0 if following is None else _value(following)))
+        elif kind == 'open':
+            stack.append((text, len(result)))
+        elif kind == 'close':
+            if not stack or stack[-1][0] != _PAIRS[text]:
+                raise MalformedFormulaError('Unbalanced brackets in {!r}.'.format(formula))
+            _, start = stack.pop()
+            if following is not None:
+                value = _value(following)
+                result[start:] = [(symbol, count * value) for symbol, count in result[start:]]
+        elif kind == 'hydrate':
+            if stack:
+                raise MalformedFormulaError('Unbalanced brackets in {!r}.'.format(formula))
+            if coefficient_start is not None:
+                result[coefficient_start:] = [(symbol, count * coefficient) for symbol, count in result[coefficient_start:]]
+            coefficient_start = len(result)
+            coefficient = 1.0
+            if following is not None:   # ·5H2Oの5
+                coefficient = _value(following)
+                i += 1
+        else:   # 元素やかっこに続かない数
+            raise FormulaError('Unexpected number in {!r}.'.format(formula))
+        i += 2 if following is not None and kind in ('element', 'close') else 1
+    if stack:
+        raise MalformedFormulaError('Unbalanced brackets in {!r}.'.format(formula))
+    if coefficient_start is not None:
+        result[coefficient_start:] = [(symbol, count * coefficient) for symbol, count in result[coefficient_start:]]
+    return result
+
+
+class FormulaParser:
+    def __init__(self, elements:tuple):
+        """parser whose columns are `elements` (e.g. the elements of the atomic-weight table).
+
+        Parameters
+        ----------
+        elements : tuple
+            element symbols. Polyatomic symbols (e.g. 'NH4') are left to element_recognition.
+        """
+        self.elements = tuple(elements)
+        self.index = {element: i for i, element in enumerate(self.elements)}
+        # 多原子イオンを元素として扱う表ではelement_recognitionの分け方に従う．
+        self._polyatomic = any(len(re.findall('[A-Z]', element)) != 1 for element in self.elements)
+
+    def _counts(self, formula:str) -> dict:
+        """{element index: count} of nonzero counts"""
+        if self._polyatomic:
+            raise FormulaError('Polyatomic elements are not supported.')
+        counts = {}
+        for symbol, count in parse_formula(formula):
+            j = self.index.get(symbol)
+            if j is None:
+                raise FormulaError('Unknown element {0!r} in {1!r}.'.format(symbol, formula))
+            counts[j] = counts.get(j, 0.) + count
+        return {j: counts[j] for j in sorted(counts) if counts[j] != 0}
+
+    def parse(self, formula:str) -> tuple:
+        """(element indices (sorted), counts) of a formula. Raises FormulaError when it can not be parsed here."""
+        counts = self._counts(formula)
+        return np.array(list(counts), dtype = np.int16), np.array(list(counts.values()), dtype = float)
+
+    def parse_many(self, formulas:list) -> CompositionMatrix:
+        """CompositionMatrix of formulas; those which can not be parsed here are parsed by element_recognition.
+
+        Raises
+        ------
+        FormulaError
+            when a formula is malformed or element_recognition can not parse it either.
+        """
+        rows = [None] * len(formulas)
+        for i, formula in enumerate(formulas):
+            try:
+                rows[i] = self._counts(formula)
+            except MalformedFormulaError:
+                raise
+            except FormulaError:
+                rows[i] = self._fallback(formula)
+        # 配列は最後にまとめて作る．
+        indptr = np.zeros(len(rows) + 1, dtype = np.int64)
+        np.cumsum([len(counts) for counts in rows], out = indptr[1:])
+        indices = [j for counts in rows for j in counts]
+        data = [count for counts in rows for count in counts.values()]
+        return CompositionMatrix(indptr, indices, data, len(self.elements))
+
+    def _fallback(self, formula:str) -> dict:
+        """{element index: count} by element_recognition (one formula at a time so that a bad one does not fail the others)"""
+        from element_recognition import element_recognition
+        try:
+            counts = element_recognition([formula], elements = self.elements).values[0]
+        except Exception as e:  # element_recognitionはIndexErrorなども投げる．
+            raise FormulaError('Invalid formula {0!r}: {1}'.format(formula, e)) from e
+        return {j: counts[j] for j in np.flatnonzero(counts)}
+
+
+@lru_cache(maxsize = 8)
+def get_parser(elements:tuple) -> FormulaParser:
+    """FormulaParser cached per table of elements."""
+    return FormulaParser(elements)
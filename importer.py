@@ -0,0 +1,405 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Bulk importer of weighing sheets saved by "Save as" (`export.write_workbook` or the older single-table export).
+
+Each block of a sheet (a header row of materials and the product followed by the rows of `export.INDEX`)
+is read back as a recipe: materials, product, ratio, mg and excess, i.e. the inputs of `WeighingCalculator`.
+The recipes are recalculated in batches and compared with what is stored in the file, and every
+difference is streamed to a report:
+
+* M.W.           formula weights (e.g. the atomic-weight table has changed since)
+* product        the composition of the ratio is not that of the product name
+* mole / weight  values cached by Excel (only when the file has been saved by Excel; openpyxl does not calculate formulas)
+
+Workbooks are read with the read-only mode of openpyxl in a thread pool.
+
+Usage:
+    python importer.py weighings/ -o report.csv --recipes recipes.jsonl
+'''
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from openpyxl import load_workbook
+
+from calculator import WeighingCalculator, Progress
+from cli import KEY_MG, SUFFIX_EXCESS, calc_records
+from export import IND_MOLAR_WEIGHT, IND_MOLAR_RATIO, IND_MOLE, IND_EXCESS_RATIO, IND_WEIGHT_WITHOUT_EXCESS, IND_WEIGHT, INDEX
+from formula import FormulaError, parse_formula
+import instrument
+
+
+REPORT_COLUMNS = ('file', 'sheet', 'row', 'product', 'item', 'column', 'stored', 'calculated', 'relative_error', 'message')
+ITEM_ERROR = 'error'
+ITEM_PRODUCT = 'product'
+
+
+def _number(x) -> float:
+    """value of a cell (None for empty cells, formulas without cached values and text)"""
+    if isinstance(x, bool) or not isinstance(x, (int, float)):
+        return None
+    return float(x)
+
+
+def _trim(row:tuple) -> list:
+    row = list(row)
+    while row and row[-1] in (None, ''):
+        row.pop()
+    return row
+
+
+def _iter_blocks(rows):
+    """yield (Excel row number of the header, header, {item of INDEX: row}) of each block of a sheet."""
+    previous = None
+    block = None
+    for i, row in enumerate(rows, start = 1):
+        row = _trim(row)
+        label = row[0] if row else None
+        if label == IND_MOLAR_WEIGHT and previous is not None:  # M.W.の行の一つ上がheader
+            if block is not None:
+                yield block
+            block = (i - 1, previous, {})
+        if block is not None and label in INDEX:
+            block[2].setdefault(label, row)
+        previous = row
+    if block is not None:
+        yield block
+
+
+def _recipe(path:str, sheet:str, header_row:int, header:list, items:dict) -> dict:
+    materials = [str(material) for material in header[1:-1]]
+    if not materials or header[-1] in (None, ''):
+        raise ValueError('The header has no materials or no product.')
+
+    def _values(item):
+        row = items.get(item, [])
+        return [_number(x) for x in (row[1:] + [None] * (len(materials) + 1))[:len(materials) + 1]]
+
+    formula_weights = _values(IND_MOLAR_WEIGHT)
+    ar_excess = _values(IND_EXCESS_RATIO)
+    mg = _values(IND_WEIGHT_WITHOUT_EXCESS)[-1]
+    if mg is None:
+        raise ValueError('The theoretical amount (mg) is not a number.')
+    return {
+        'file': path,
+        'sheet': sheet,
+        'row': header_row,
+        'materials': materials,
+        'product': str(header[-1]),
+        'ratio': [0. if x is None else x for x in _values(IND_MOLAR_RATIO)[:-1]],
+        'mg': mg,
+        'excess': {material: x / 100 for material, x in zip(materials, ar_excess) if x is not None},
+        # 保存されている値 (数式の値はExcelで保存されたときだけ)
+        'stored': {
+            IND_MOLAR_WEIGHT: formula_weights,
+            IND_MOLE: _values(IND_MOLE)[-1],
+            IND_WEIGHT: _values(IND_WEIGHT),
+        },
+    }
+
+
+def read_workbook(path:str) -> list:
+    '''
+    recipes of all blocks of all sheets of a workbook.
+
+    Parameters
+    ----------
+    path : str
+        .xlsx file saved by "Save as"
+
+    Returns
+    -------
+    list
+        list of dict with the keys file, sheet, row (Excel row number of the header), materials, product,
+        ratio, mg, excess ({material: ratio} e.g. {'Li2O': 0.05}) and stored (values in the file).
+
+    Raises
+    ------
+    ValueError
+        when no block is found or a block is broken.
+    '''
+    # data_only=Trueで数式の代わりにExcelが最後に計算した値を読む．
+    wb = load_workbook(path, read_only = True, data_only = True)
+    try:
+        recipes = []
+        for ws in wb.worksheets:
+            for header_row, header, items in _iter_blocks(ws.iter_rows(values_only = True)):
+                try:
+                    recipes.append(_recipe(path, ws.title, header_row, header, items))
+                except ValueError as e:
+                    raise ValueError('{0}!{1}: {2}'.format(ws.title, header_row, e))
+    finally:
+        wb.close()
+    if not recipes:
+        raise ValueError('No weighing table was found.')
+    return recipes
+
+
+def to_record(recipe:dict) -> dict:
+    """input record of `cli.calc_records` (ratio, mg and excess in mol%) of a recipe"""
+    record = dict(zip(recipe['materials'], recipe['ratio']))
+    record[KEY_MG] = recipe['mg']
+    for material, x in recipe['excess'].items():
+        record[material + SUFFIX_EXCESS] = x * 100
+    return record
+
+
+def _composition(formula:str) -> dict:
+    """element counts normalized by their sum (the scale of a formula does not change the weights)"""
+    counts = {}
+    for symbol, count in parse_formula(formula):
+        counts[symbol] = counts.get(symbol, 0.) + count
+    total = sum(counts.values())
+    return {symbol: count / total for symbol, count in counts.items() if count != 0}
+
+
+def _same_composition(formula1:str, formula2:str, rtol:float) -> bool:
+    composition1, composition2 = _composition(formula1), _composition(formula2)
+    return composition1.keys() == composition2.keys() and all(np.isclose(composition1[k], composition2[k], rtol = rtol, atol = 0) for k in composition1)
+
+
+class WorkbookImporter:
+    def __init__(self, n_threads:int = 4, chunksize:int = 1000, rtol:float = 1e-6):
+        """reader and validator of many saved workbooks.
+
+        Parameters
+        ----------
+        n_threads : int, optional
+            number of threads reading workbooks, by default 4
+        chunksize : int, optional
+            number of recipes recalculated at once, by default 1000
+        rtol : float, optional
+            relative tolerance of the comparison, by default 1e-6
+        """
+        self.n_threads = max(n_threads, 1)
+        self.chunksize = chunksize
+        self.rtol = rtol
+        # 原料ごとのWeighingCalculator (式量のキャッシュを使い回す)
+        self._calculators = {}
+        self.n_files = 0
+        self.n_recipes = 0
+        self.n_discrepancies = 0
+        self.seconds = 0.
+
+    @property
+    def files_per_second(self) -> float:
+        return self.n_files / self.seconds if self.seconds else 0.
+
+    def read(self, paths:list):
+        """yield (path, recipes, error) in the order of `paths`; workbooks are read ahead by the thread pool."""
+        def _read(path):
+            try:
+                return path, read_workbook(path), None
+            except Exception as e:  # 壊れたファイルがあっても止めない．
+                return path, [], e
+
+        paths = iter(paths)
+        with ThreadPoolExecutor(max_workers = self.n_threads) as executor:
+            # 読み終わったものを溜め込みすぎないように，先読みはスレッド数の数倍まで．
+            futures = deque(executor.submit(_read, path) for path, _ in zip(paths, range(4 * self.n_threads)))
+            while futures:
+                result = futures.popleft().result()
+                for path in paths:
+                    futures.append(executor.submit(_read, path))
+                    break
+                yield result
+
+    def _calculator(self, materials:tuple) -> WeighingCalculator:
+        if materials not in self._calculators:
+            self._calculators[materials] = WeighingCalculator(materials = list(materials))
+        return self._calculators[materials]
+
+    def _difference(self, recipe:dict, item:str, column:str, stored:float, calculated:float) -> dict:
+        """discrepancy or None when they agree (or nothing is stored)"""
+        if stored is None or np.isclose(stored, calculated, rtol = self.rtol, atol = 0):
+            return None
+        return self._discrepancy(recipe, item, column, stored, calculated, relative_error = abs(calculated - stored) / abs(stored) if stored else None)
+
+    @staticmethod
+    def _discrepancy(recipe:dict, item:str, column:str = None, stored = None, calculated = None, relative_error:float = None, message:str = None) -> dict:
+        return dict(zip(REPORT_COLUMNS, (recipe['file'], recipe.get('sheet'), recipe.get('row'), recipe.get('product'), item, column, stored, calculated, relative_error, message)))
+
+    @instrument.timed('importer.validate')
+    def validate(self, recipes:list) -> list:
+        '''
+        recalculate recipes and compare them with the stored values.
+
+        Parameters
+        ----------
+        recipes : list
+            recipes of `read_workbook`
+
+        Returns
+        -------
+        list
+            discrepancies (dicts whose keys are REPORT_COLUMNS), in the order of the recipes.
+        '''
+        # 同じ原料のものはまとめて計算する．
+        groups = {}
+        for i, recipe in enumerate(recipes):
+            groups.setdefault(tuple(recipe['materials']), []).append(i)
+
+        discrepancies = [[] for _ in recipes]
+        for materials, idx in groups.items():
+            try:
+                wc = self._calculator(materials)
+                with redirect_stdout(sys.stderr):   # get_ratioは解けなかったときに標準出力へ書き込む．
+                    rows = calc_records(wc, [to_record(recipes[i]) for i in idx])
+            except Exception as e:  # 原料の組成が読めないなど．そのグループだけerrorにして止めない．
+                for i in idx:
+                    discrepancies[i].append(self._discrepancy(recipes[i], ITEM_ERROR, message = str(e)))
+                continue
+            ar_formula_weight_materials = [wc.dict_materials[material] for material in materials]
+            for i, row in zip(idx, rows):
+                try:
+                    discrepancies[i] = self._compare(recipes[i], row, wc, ar_formula_weight_materials)
+                except Exception as e:
+                    discrepancies[i] = [self._discrepancy(recipes[i], ITEM_ERROR, message = str(e))]
+        discrepancies = [d for ds in discrepancies for d in ds]
+        instrument.count('recipes', len(recipes))
+        instrument.count('discrepancies', len(discrepancies))
+        return discrepancies
+
+    def _compare(self, recipe:dict, row:dict, wc:WeighingCalculator, ar_formula_weight_materials:list) -> list:
+        if row['total_weight'] is None:
+            return [self._discrepancy(recipe, ITEM_ERROR, message = 'The ratio could not be calculated.')]
+        materials = recipe['materials']
+        stored = recipe['stored']
+        discrepancies = []
+        # 比率から計算したときの生成物の式量 (原料の式量の和．書き出すときと同じ．)
+        formula_weight_product = row[KEY_MG] / row['mole (mmol)'] if row['mole (mmol)'] else None
+        for column, x, y in zip(materials + [recipe['product']], stored[IND_MOLAR_WEIGHT], ar_formula_weight_materials + [formula_weight_product]):
+            if y is not None:
+                discrepancies.append(self._difference(recipe, IND_MOLAR_WEIGHT, column, x, y))
+        try:
+            if not _same_composition(recipe['product'], row['product'], self.rtol):
+                discrepancies.append(self._discrepancy(recipe, ITEM_PRODUCT, stored = recipe['product'], calculated = row['product'], message = 'The ratio does not give the product.'))
+        except FormulaError as e:
+            discrepancies.append(self._discrepancy(recipe, ITEM_PRODUCT, stored = recipe['product'], calculated = row['product'], message = str(e)))
+        discrepancies.append(self._difference(recipe, IND_MOLE, recipe['product'], stored[IND_MOLE], row['mole (mmol)']))
+        for column, x in zip(materials + [recipe['product']], stored[IND_WEIGHT]):
+            y = row['total_weight'] if column == recipe['product'] else row['{}_weight'.format(column)]
+            discrepancies.append(self._difference(recipe, IND_WEIGHT, column, x, y))
+        return [d for d in discrepancies if d is not None]
+
+    def run(self, paths:list, f_recipes = None, progress_bar = False):
+        '''
+        read, recalculate and compare all workbooks.
+
+        Parameters
+        ----------
+        paths : list
+            .xlsx files
+        f_recipes : file object, optional
+            text file to which the recipes are written as json lines, by default None
+        progress_bar : bool or callable, optional
+            same as `WeighingCalculator.calc`; one step per file, by default False
+
+        Yields
+        ------
+        dict
+            discrepancy (keys: REPORT_COLUMNS), as soon as the chunk of the recipe has been validated.
+            Files which could not be read are reported with item 'error'.
+        '''
+        paths = list(paths)
+        progress = Progress(progress_bar, total = len(paths))
+        chunk = []
+        reader = self.read(paths)
+        # generatorなので，yieldしている間 (呼び出し側の処理) が入らないように一つずつ計測する．
+        try:
+            while True:
+                with self._elapsed(), instrument.timer('importer.read'):
+                    result = next(reader, None)
+                if result is None:
+                    break
+                path, recipes, error = result
+                self.n_files += 1
+                progress.step()
+                if error is not None:
+                    self.n_discrepancies += 1
+                    yield self._discrepancy({'file': path}, ITEM_ERROR, message = str(error))
+                    continue
+                self.n_recipes += len(recipes)
+                if f_recipes is not None:
+                    f_recipes.writelines(json.dumps({k: v for k, v in recipe.items() if k != 'stored'}, ensure_ascii = False) + '\n' for recipe in recipes)
+                chunk += recipes
+                if len(chunk) >= self.chunksize:
+                    yield from self._validate_chunk(chunk)
+                    chunk = []
+            if chunk:
+                yield from self._validate_chunk(chunk)
+        finally:
+            reader.close()  # 途中でやめられたときも先読みのスレッドを止める．
+            instrument.count('files', len(paths))
+
+    def _validate_chunk(self, chunk:list):
+        with self._elapsed():
+            discrepancies = self.validate(chunk)
+        self.n_discrepancies += len(discrepancies)
+        yield from discrepancies
+
+    @contextmanager
+    def _elapsed(self):
+        """add the elapsed time to `self.seconds`"""
+        time_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds += time.perf_counter() - time_start
+
+
+def find_workbooks(paths:list) -> list:
+    """.xlsx files in `paths` (files or directories searched recursively), sorted; Excel lock files (~$*) are skipped."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, fnames in os.walk(path):
+                found += [os.path.join(root, fname) for fname in fnames if fname.endswith('.xlsx') and not fname.startswith('~$')]
+        else:
+            found.append(path)
+    return sorted(found)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Import saved weighing workbooks, recalculate them and report the discrepancies.')
+    parser.add_argument('paths', nargs = '+', help = '.xlsx files or directories (searched recursively).')
+    parser.add_argument('-o', '--output', default = '-', help = 'discrepancy report (csv). "-" means stdout. (default: -)')
+    parser.add_argument('--recipes', help = 'write the imported recipes (materials, product, ratio, mg, excess) to this file as json lines.')
+    parser.add_argument('-t', '--n-threads', type = int, default = 4, help = 'number of threads reading workbooks. (default: 4)')
+    parser.add_argument('--chunksize', type = int, default = 1000, help = 'number of recipes recalculated at once. (default: 1000)')
+    parser.add_argument('--rtol', type = float, default = 1e-6, help = 'relative tolerance of the comparison. (default: 1e-6)')
+    args = parser.parse_args(argv)
+
+    paths = find_workbooks(args.paths)
+    importer = WorkbookImporter(n_threads = args.n_threads, chunksize = args.chunksize, rtol = args.rtol)
+    f_out = sys.stdout if args.output == '-' else open(args.output, mode = 'w', encoding = 'utf_8', newline = '')
+    f_recipes = None if args.recipes is None else open(args.recipes, mode = 'w', encoding = 'utf_8')
+    try:
+        writer = csv.DictWriter(f_out, fieldnames = REPORT_COLUMNS)
+        writer.writeheader()
+        for discrepancy in importer.run(paths, f_recipes = f_recipes, progress_bar = True):
+            writer.writerow(discrepancy)
+            f_out.flush()   # 見つかったものから順に書き出す．
+    finally:
+        if f_out is not sys.stdout:
+            f_out.close()
+        if f_recipes is not None:
+            f_recipes.close()
+
+    sys.stderr.write('{0} files ({1} recipes) in {2:.2f} s ({3:.1f} files/s), {4} discrepancies.\n'.format(
+        importer.n_files, importer.n_recipes, importer.seconds, importer.files_per_second, importer.n_discrepancies))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
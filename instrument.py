@@ -0,0 +1,204 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Lightweight timers and counters of the hot paths, written as one JSON line per run.
+
+Enabled by the environment variable WEIGHING_CALCULATOR_PROFILE or `"profile"` in settings.json
+(the environment variable takes precedence):
+
+* "1" / true: append to profile.jsonl next to this file
+* a path: append to that file
+* "0" / false / unset: disabled. `timer` then returns a shared no-op context manager,
+  so the instrumented code only pays for one function call.
+
+The outermost `timer` (or `timed` function) of a thread is a run; the timers and counters inside it are summed and
+written when it ends, e.g.
+{"run": "calc", "started_at": "...", "seconds": 0.12, "timers": {"solve_ratio": {"calls": 1, "seconds": 0.1}}, "counters": {"products": 100}}
+
+`python instrument.py [path]` prints the mean / max time of each stage over the runs.
+'''
+
+from contextlib import nullcontext
+from datetime import datetime
+from functools import wraps
+from threading import Lock, local, current_thread
+from time import perf_counter
+import json
+import os
+import sys
+
+
+ENV_PROFILE = 'WEIGHING_CALCULATOR_PROFILE'
+path_root = os.path.abspath(os.path.dirname(__file__))
+path_profile_default = os.path.join(path_root, 'profile.jsonl')
+
+# 無効なときに返すcontext manager (毎回作らない．)
+_NULL = nullcontext()
+
+_path = None    # 書き込み先．Noneのときは無効．
+_lock = Lock()
+_local = local()
+
+
+def _parse(value):
+    """path of the report from the value of the environment variable or the setting, or None"""
+    if value is None or value is False:
+        return None
+    if value is True:
+        return path_profile_default
+    value = str(value).strip()
+    if value.lower() in ('', '0', 'false', 'off', 'no'):
+        return None
+    if value.lower() in ('1', 'true', 'on', 'yes'):
+        return path_profile_default
+    return os.path.abspath(os.path.expanduser(value))
+
+
+def configure(value = None):
+    """enable or disable the instrumentation.
+
+    Parameters
+    ----------
+    value : bool or str, optional
+        value of `"profile"` in settings.json. Ignored when the environment variable is set, by default None
+    """
+    global _path
+    env = os.environ.get(ENV_PROFILE)
+    _path = _parse(env if env is not None else value)
+
+
+def enabled() -> bool:
+    return _path is not None
+
+
+class _Run:
+    def __init__(self, name:str):
+        self.name = name
+        self.started_at = datetime.now().isoformat(timespec = 'milliseconds')
+        self.timers = {}    # name -> [calls, seconds]
+        self.counters = {}
+
+    def summary(self, seconds:float, error:str = None) -> dict:
+        summary = {
+            'run': self.name,
+            'started_at': self.started_at,
+            'seconds': seconds,
+            'pid': os.getpid(),
+            'thread': current_thread().name,
+            'timers': {name: {'calls': calls, 'seconds': t} for name, (calls, t) in self.timers.items()},
+            'counters': self.counters,
+        }
+        if error is not None:   # 中止されたときや例外のとき
+            summary['error'] = error
+        return summary
+
+
+class _Timer:
+    __slots__ = ('name', '_start', '_run')
+
+    def __init__(self, name:str):
+        self.name = name
+
+    def __enter__(self):
+        self._run = None
+        if getattr(_local, 'run', None) is None:    # 一番外側のtimerを一回の実行とする．
+            self._run = _local.run = _Run(self.name)
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = perf_counter() - self._start
+        if self._run is None:
+            record = _local.run.timers.setdefault(self.name, [0, 0.])
+            record[0] += 1
+            record[1] += seconds
+        else:
+            _local.run = None
+            _write(self._run.summary(seconds, None if exc_type is None else exc_type.__name__))
+
+
+def timer(name:str):
+    """context manager which times a stage (a no-op when disabled)"""
+    if _path is None:
+        return _NULL
+    return _Timer(name)
+
+
+def timed(name:str):
+    """decorator version of `timer`"""
+    def _decorator(func):
+        @wraps(func)
+        def _wrapper(*args, **kwargs):
+            if _path is None:
+                return func(*args, **kwargs)
+            with _Timer(name):
+                return func(*args, **kwargs)
+        return _wrapper
+    return _decorator
+
+
+def count(name:str, n:int = 1):
+    """add `n` to a counter of the current run (ignored outside a run or when disabled)"""
+    if _path is None:
+        return
+    run = getattr(_local, 'run', None)
+    if run is not None:
+        run.counters[name] = run.counters.get(name, 0) + n
+
+
+def _write(summary:dict):
+    line = json.dumps(summary, ensure_ascii = False) + '\n'
+    try:
+        with _lock, open(_path, mode = 'a', encoding = 'utf_8') as f:   # 一行ずつ追記するので複数起動しても混ざらない．
+            f.write(line)
+    except OSError:     # 計測のせいで計算を失敗させない．
+        pass
+
+
+def report(path:str = None) -> dict:
+    """aggregate the runs written to `path`.
+
+    Returns
+    -------
+    dict
+        {run name: {stage (the run itself is ''): {'runs', 'calls', 'total', 'max', 'mean'}}} in seconds
+    """
+    stats = {}
+
+    def _add(run, stage, calls, seconds):
+        s = stats.setdefault(run, {}).setdefault(stage, {'runs': 0, 'calls': 0, 'total': 0., 'max': 0.})
+        s['runs'] += 1
+        s['calls'] += calls
+        s['total'] += seconds
+        s['max'] = max(s['max'], seconds)
+
+    with open(path or path_profile_default, mode = 'r', encoding = 'utf_8') as f:
+        for line in f:
+            try:
+                summary = json.loads(line)
+            except ValueError:  # 書きかけの行
+                continue
+            _add(summary['run'], '', 1, summary['seconds'])
+            for stage, t in summary['timers'].items():
+                _add(summary['run'], stage, t['calls'], t['seconds'])
+    for stages in stats.values():
+        for s in stages.values():
+            s['mean'] = s['total'] / s['runs']
+    return stats
+
+
+def main():
+    stats = report(sys.argv[1] if len(sys.argv) > 1 else None)
+    sys.stdout.write('{0:<30} {1:>6} {2:>8} {3:>10} {4:>10} {5:>10}\n'.format('run / stage', 'runs', 'calls', 'mean (s)', 'max (s)', 'total (s)'))
+    for run, stages in stats.items():
+        for stage, s in stages.items():
+            name = run if stage == '' else '  ' + stage
+            sys.stdout.write('{0:<30} {1:>6} {2:>8} {3:>10.4f} {4:>10.4f} {5:>10.4f}\n'.format(name, s['runs'], s['calls'], s['mean'], s['max'], s['total']))
+
+
+configure()
+
+
+if __name__ == '__main__':
+    main()
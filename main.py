@@ -3,18 +3,22 @@ Copyright (c) 2021, yu9824
 This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
 '''
 
-from typing import Tuple
-from element_recognition import get_ratio, make_compositions, element_recognition
-from math import isclose
-import pandas as pd
-import numpy as np
+from typing import Tuple, TYPE_CHECKING
+from math import ceil
 import PySimpleGUI as sg
 import os
 import json
+import threading
 from glob import glob
-from openpyxl.utils import get_column_letter
-from openpyxl import load_workbook
-from openpyxl.styles import PatternFill
+
+from storage import JSONStore
+from result_cache import result_cache, result_key
+import instrument
+
+# 起動を速くするため，pandas, numpy, openpyxl (とそれらを使うcalculator) は初めて計算するときに読み込む．
+if TYPE_CHECKING:
+    import pandas as pd
+    from calculator import WeighingCalculator
 
 '''
 Mac OSX10.15においてmenubarがつかえないbugが起きるが，これはstandalone化すれば解決する．
@@ -32,110 +36,11 @@ APP_NAME = 'Weighing Calculator'
 # 設定
 path_root = os.path.abspath(os.path.dirname(__file__))
 path_settings = os.path.join(path_root, 'settings.json')
-path_atomic_weights = os.path.join(path_root, 'atomic_weights.csv')
-
-class WeighingCalculator:
-    def __init__(self, materials):
-        '''
-        Parameters
-        ----------
-        materials : list
-            [description]
-        '''
-        self.materials = materials
-        self.df_atomic_weights = pd.read_csv(path_atomic_weights, index_col = 0, comment='#')
-        self.dict_materials = {material: self._get_formula_weight(material) for material in materials}
-
-    def calc(self, products = [], ratio = [], mg = 2000, excess = {}, exact = True, progress_bar = True):
-        '''
-        calculate weighing
-
-        Parameters
-        ----------
-        products : list, optional
-            [description], by default []
-        ratio : list, optional
-            [description], by default []
-        mg : int, optional
-            完成量, by default 2000
-        excess : dict, optional
-            過剰量 e.g. {'Li2O': 0.05}, by default {}
-        exact : bool, optional
-            完全一致していないとダメかどうか, by default True
-        progress_bar : bool, optional
-            進捗バーを表示するかどうか, by default True
-
-        Raises
-        ------
-        ValueError
-        '''
-
-        self.mg = mg
-
-        if len(products) * len(ratio):  # 両方に入力があったら．
-            raise ValueError('You can only enter either "products" or "ratio".')
-        elif len(products):
-            self.df_ratio = get_ratio(materials=self.materials, products = products, exact = exact)
-        elif len(ratio):
-            products = make_compositions(self.materials, ratio = ratio).index.to_numpy().tolist()
-            if isinstance(ratio, pd.DataFrame):
-                ratio = ratio.loc[:, self.materials].to_numpy()
-            elif isinstance(ratio, (pd.Series, np.ndarray, list)):
-                ratio = np.array(ratio).reshape(-1, len(self.materials))
-            self.df_ratio = pd.DataFrame(ratio, columns = self.materials, index = products)
-        else:
-            raise ValueError('You have to enter either "products" or "ratio".')
+path_cache_materials = os.path.join(path_root, 'cache_materials.json')
 
-        # 比率が計算できなかった組成をためておくリスト
-        # comp_null = []
-        
-        products = self.df_ratio.index.to_numpy().tolist()  # self.df_ratioではproductsの空白を削除した組成名を得られるため，上書き．
-        self.dict_products = {product: self._get_formula_weight(product) for product in products}
-        self.products = products
-
-        self.excess = excess
-
-        # 結果を足すSeries
-        srs_material_weight = []
-        srs_material_weight_excess = []
-
-        # moleをとっておくリスト
-        self.moles = []
-
-        # dataframeを各行ごとに取り出す．
-        for product, ratio in self.df_ratio.iterrows():
-            mole = mg / self.dict_products[product]
-            self.moles.append(mole)
-            if ratio.isnull().all():    # anyのほうが良い気もする．
-                pass
-            else:   # きちんと計算できていたら
-                sr_material_weight = pd.Series(ratio * mole * np.array([self.dict_materials[material] for material in self.materials]), index = self.materials, name = product)
-
-                # 過剰量の計算
-                sr_material_weight_excess = sr_material_weight.copy()
-                for material, excess_ratio in self.excess.items():
-                    sr_material_weight_excess[material] *= (1 + excess_ratio)
-
-                srs_material_weight.append(sr_material_weight.to_frame().transpose())
-                srs_material_weight_excess.append(sr_material_weight_excess.to_frame().transpose())
-        self.df_material_weight = pd.concat(srs_material_weight, axis = 0, sort = False)
-        self.df_material_weight_excess = pd.concat(srs_material_weight_excess, axis = 0, sort = False)
-    
-    def _get_formula_weight(self, formula:str) -> float:
-        """get formula weight
-
-        Parameters
-        ----------
-        formula : str
-            chemical formula, e.g.) 'Li2O'
-
-        Returns
-        -------
-        float
-            formula weight
-        """
-        return (element_recognition(formula, elements = self.df_atomic_weights.index.tolist()).values @ self.df_atomic_weights.values)[0][0]
-        
+# 複数起動しても壊れないように，書き込みはまとめて終了時に行う．
+settings_store = JSONStore(path_settings)
+cache_materials_store = JSONStore(path_cache_materials)
 
 
 class gui:
@@ -145,7 +50,7 @@ class gui:
         '''
         # load setting
         try:
-            self.settings = json.load(open(path_settings, mode = 'r', encoding = 'utf_8'))
+            self.settings = settings_store.to_dict()
         except Exception as e:
             pass
         else:
@@ -157,11 +62,16 @@ class gui:
             sg.theme(theme)
 
         self.lang = self.settings['lang']
+        # 計測 (環境変数 WEIGHING_CALCULATOR_PROFILE が優先)
+        instrument.configure(self.settings.get('profile'))
 
         # constants
         self.threshold_scroll = 4
-        self.fname_cache_materials = 'cache_materials.json'
+        # 生成物が複数のときの結果の表で一度に表示する行と列の数
+        self.page_rows = 25
+        self.page_columns = 8
         self.fname_lang = 'lang.json'
+        self._store = None  # 計算結果のデータベース (初めて計算するときに開く．)
 
         if os.path.isfile(self.fname_lang):
             with open(self.fname_lang, mode = 'r', encoding = 'utf_8') as f:
@@ -214,12 +124,8 @@ class gui:
         list
             cached materials or empty list (length = n_materials)
         """
-        if os.path.isfile(self.fname_cache_materials):
-            with open(self.fname_cache_materials, mode = 'r', encoding = 'utf_8') as f:
-                chache_materials:dict = json.load(f)
-            if str(n_materials) in chache_materials:    # converted to str because of json format.
-                return chache_materials[str(n_materials)]
-        return ['' for _ in range(n_materials)]
+        # converted to str because of json format.
+        return cache_materials_store.get(str(n_materials), ['' for _ in range(n_materials)])
         
     def _dump_cache_materials(self, materials:list):
         """dump_cache_materials
@@ -233,15 +139,8 @@ class gui:
         -------
         None
         """
-        n_materials = len(materials)
-        if os.path.isfile(self.fname_cache_materials):
-            with open(self.fname_cache_materials, mode = 'r', encoding = 'utf_8') as f:
-                chache_materials:dict = json.load(f)
-        else:
-            chache_materials = {}
-        chache_materials[str(n_materials)] = materials
-        with open(self.fname_cache_materials, mode = 'w', encoding = 'utf_8') as f:
-            json.dump(chache_materials, f, indent=4)
+        # 終了時にまとめて書き込む．
+        cache_materials_store.set(str(len(materials)), materials)
         
                 
 
@@ -352,16 +251,21 @@ class gui:
         ]
         
         calculation_menu.make_window(size = (1200, 775), resizable = True)
+
+        materials = list(dict_materials.values())
+        # 前回の計算結果と入力．mgや過剰量，比率一つだけが変わったときは比率を解き直さずに使い回す．
+        wc = None
+        last_input = None
         while True:
             calculation_menu.read()
             if calculation_menu.event is None:
                 break
             if 'Calc' in calculation_menu.event:
-                # インスタンス生成
-                wc = WeighingCalculator(materials=list(dict_materials.values()))
+                from calculator import WeighingCalculator, CalculationCancelled
+                import copy
 
                 # 過剰量を辞書まとめる．
-                dict_excess = {material: float(calculation_menu.values['{}_excess'.format(material)]) / 100 for material in dict_materials.values()}
+                dict_excess = {material: float(calculation_menu.values['{}_excess'.format(material)]) / 100 for material in materials}
                 
                 # 生成重量を変数として得る．
                 mg = float(calculation_menu.values['mg'])
@@ -369,7 +273,7 @@ class gui:
                     try:
                         dict_ratio = {}
                         for k, v in calculation_menu.values.items():
-                            if k in dict_materials.values():
+                            if k in materials:
                                 if v.count('/') > 1:
                                     raise ValueError
                                 elif '/' in v:
@@ -379,36 +283,112 @@ class gui:
                     except ValueError:  # try内で指定したValueError以外も含めて．
                         sg.popup_error('You have not entered any. Or the value you entered is not good.\nCorrect: 1/3, 1, 1.0, 3.141 etc.', **option_text_default, modal = False, keep_on_top=True)
                         continue
-                    wc.calc(ratio = list(dict_ratio.values()), mg = mg, excess = dict_excess, exact = True, progress_bar = False)
+                    current_input = ('ratio', dict_ratio)
+                    with instrument.timer('gui.result_cache'):
+                        key = result_key(materials, ratio = list(dict_ratio.values()), mg = mg, excess = dict_excess, exact = True)
+                        cached = result_cache.get(key)
+                    if cached is not None:  # 同じ入力の結果と表をそのまま使う．
+                        wc, tables = cached
+                    elif wc is not None and last_input[0] == 'ratio' and sum(last_input[1][k] != v for k, v in dict_ratio.items()) <= 1:
+                        wc = copy.deepcopy(wc)  # キャッシュされているものは書き換えない．
+                        for k, v in dict_ratio.items():
+                            if last_input[1][k] != v:
+                                wc.update_ratio(k, v)
+                        wc.update_mg(mg)
+                        wc.update_excess(dict_excess)
+                        self._append_to_store(wc)
+                        tables = self._output_tables(wc)
+                    else:
+                        wc_new = WeighingCalculator(materials=materials)
+                        try:
+                            tables = self._run_in_background(self.lang_dict[self.lang]['calculating'], self._calc_and_make_output, wc_new, ratio = list(dict_ratio.values()), mg = mg, excess = dict_excess, exact = True)
+                        except CalculationCancelled:
+                            continue
+                        wc = wc_new
                 elif 'product' in calculation_menu.event:
                     if calculation_menu.values['product'] == '':
                         sg.popup_error('Nothing has been entered.', **option_text_default, modal = False, keep_on_top=True)
                         continue
-                    try:    # exact=Trueでうまくいかなかったとき
-                        wc.calc(products=[calculation_menu.values['product']], mg = mg, excess = dict_excess, exact = True, progress_bar = False)
-                    except ValueError:
-                        try:
-                            wc.calc(products=[calculation_menu.values['product']], mg = mg, excess = dict_excess, exact = False, progress_bar = False)
+                    # カンマ区切りで複数の生成物をまとめて計算できる．
+                    products = [product for product in calculation_menu.values['product'].split(',') if product.strip()]
+                    current_input = ('product', calculation_menu.values['product'])
+                    with instrument.timer('gui.result_cache'):
+                        key = result_key(materials, products = products, mg = mg, excess = dict_excess, exact = True, retry_inexact = True)
+                        cached = result_cache.get(key)
+                    if cached is not None:
+                        wc, tables = cached
+                    elif wc is not None and last_input == current_input:
+                        wc = copy.deepcopy(wc)
+                        wc.update_mg(mg)
+                        wc.update_excess(dict_excess)
+                        self._append_to_store(wc)
+                        tables = self._output_tables(wc)
+                    else:
+                        wc_new = WeighingCalculator(materials=materials)
+                        try:    # exact=Trueでうまくいかなかったときはその生成物だけexact=Falseで計算し直す．
+                            tables = self._run_in_background(self.lang_dict[self.lang]['calculating'], self._calc_and_make_output, wc_new, products=products, mg = mg, excess = dict_excess, exact = True, retry_inexact = True)
+                        except CalculationCancelled:
+                            continue
                         except ValueError:  # exact=Falseでもうまくいかなかったとき
                             sg.PopupError('The composition you have entered is invalid.', **option_text_default, modal = False, keep_on_top=True)
                             continue
-                        else:
+                        wc = wc_new
+                        if wc.inexact_products:
                             sg.popup_ok('The results of the calculations may be different because they did not match exactly.', **option_text_default, modal = False, keep_on_top=True)
+                if cached is None:
+                    result_cache.set(key, (wc, tables))
+                last_input = current_input
 
-                self._table(wc = wc)
+                self._table(wc = wc, tables = tables)
         
         calculation_menu.window.close()
 
-    def _table(self, wc):
+    @instrument.timed('gui.calculate')
+    def _calc_and_make_output(self, wc, progress_bar = False, **kwargs):
+        """`wc.calc(**kwargs)` (through the result store) and `_make_output(wc)` or `ResultTable(wc)` for many products (run in a worker thread)."""
+        store = self._get_store()
+        if store is None:
+            wc.calc(progress_bar = progress_bar, **kwargs)
+        else:   # 同じ計算は保存してある結果を使う．
+            store.calc(wc, progress_bar = progress_bar, **kwargs)
+        return self._output_tables(wc)
+
+    def _output_tables(self, wc):
+        """`_make_output(wc)` or `ResultTable(wc)` for many products"""
+        if len(wc.products) > 1:
+            from export import ResultTable
+            return ResultTable(wc)
+        return self._make_output(wc)
+
+    def _get_store(self):
+        """ResultStore or None when it can not be opened (e.g. read-only location)."""
+        if self._store is None:
+            import sqlite3
+            from store import ResultStore
+            try:
+                self._store = ResultStore()
+            except (sqlite3.Error, OSError):
+                self._store = False
+        return self._store or None
+
+    def _append_to_store(self, wc):
+        store = self._get_store()
+        if store is not None:
+            store.append(wc)
+
+    def _table(self, wc, tables = None):
         '''
         wc: WeighingCalculatorオブジェクト
+        tables: _make_outputの結果 (生成物が複数のときはResultTable)．Noneのときはここで作る．
         '''
+        if len(wc.products) > 1:
+            self._result_table(wc, tables)
+            return
+
         # 出力用の表を作成
-        df_output, df_output_show = self._make_output(wc)
-        df_output_show.drop(index = ['measured value (mg)'], inplace = True)
-        df_output.index.name = ''
-        df_output_show.index.name = ''
-        df_output_show.reset_index(inplace=True)
+        # キャッシュされている表は書き換えずに表示用のものを作る．
+        df_output, df_output_show = self._make_output(wc) if tables is None else tables
+        df_output_show = df_output_show.drop(index = ['measured value (mg)']).rename_axis('').reset_index()
 
         # オブジェクトの生成
         table_menu = Menu()
@@ -427,118 +407,160 @@ class gui:
             if table_menu.event in (None, 'Cancel'):
                 pass
             elif table_menu.event == 'SaveAs':
-                if table_menu.values['SaveAs'] == '':
+                if table_menu.values['SaveAs'] == '' or not self._save(wc, table_menu.values['SaveAs']):
                     continue
-                if os.path.splitext(os.path.basename(table_menu.values['SaveAs']))[-1] != '.xlsx':
-                    fpath_output = os.path.splitext(table_menu.values['SaveAs'])[0] + '.xlsx'
-                else:
-                    fpath_output = table_menu.values['SaveAs']
-                df_output.reset_index().to_excel(fpath_output, index = False)
-                sg.PopupOK('Saved successfully.', modal = True, **option_text_default)
             break
             
                 
         table_menu.window.close()
 
-    def _make_output(self, wc: WeighingCalculator) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    def _result_table(self, wc, table = None):
         '''
+        paged table of many products (one row per product).
+        Only the visible rows and columns are formatted; clicking a heading sorts by it.
+
         wc: WeighingCalculatorオブジェクト
+        table: export.ResultTable．Noneのときはここで作る．
         '''
-        cols = wc.materials + wc.products
-        ind_molar_weight = 'M.W.'
-        ind_molar_ratio = 'molar ratio'
-        ind_mole = 'mole (mmol)'
-        ind_excess_ratio = 'excess ratio (mol%)'
-        ind_mole_with_excess = 'mole w/ excess'
-        ind_weight_without_excess = 'no excess weight (mg)'
-        ind_weight = 'weight (mg)'
-        ind = [ind_molar_weight, ind_molar_ratio, ind_mole, ind_excess_ratio, ind_mole_with_excess, ind_weight_without_excess, ind_weight, 'measured value (mg)']
-        
-        df_output = pd.DataFrame([[np.nan] * len(cols)] * len(ind), columns = cols, index = ind)
-
-        # 式量を代入
-        for material in wc.materials:
-            df_output.loc[ind_molar_weight, material] = wc.dict_materials[material]
-        df_output.loc[ind_molar_weight, wc.products[0]] = wc.dict_products[wc.products[0]]
-
-        # モル比を代入
-        df_output.loc[ind_molar_ratio, wc.df_ratio.columns] = wc.df_ratio.values
-        df_output.loc[ind_molar_ratio, wc.products] = 1
-
-        # 表示用のDataFrameを作成
-        df_output_show = df_output.copy()
-
-        # モル数を代入
-        # 以下使用する`+2`はそれぞれindex,columnsが占める+1と，pythonの0-indexをexcelの1-indexに変換する+1の合計．
-        df_output_show.loc[ind_mole] = df_output.loc[ind_molar_ratio] * wc.moles[0]
-        df_output.loc[ind_mole, wc.products] = '={0}{1}/{0}{2}'.format(
-            get_column_letter(df_output_show.columns.get_loc(wc.products[0])+2),
-            df_output.index.get_loc(ind_weight_without_excess)+2,
-            df_output.index.get_loc(ind_molar_weight)+2,
-        )
-        df_output.loc[ind_mole, wc.materials] = [
-            '={0}{2}/${1}${2}*${1}${3}'.format(
-                get_column_letter(df_output.columns.get_loc(material)+2),
-                get_column_letter(df_output.columns.get_loc(wc.products[0])+2),
-                df_output.index.get_loc(ind_molar_ratio)+2,
-                df_output.index.get_loc(ind_mole)+2,
-            ) for material in wc.materials
-        ]
+        from export import ResultTable
+        if table is None:
+            table = ResultTable(wc)
+        else:   # キャッシュから開き直したときは絞り込みと並べ替えを戻す．
+            table.filter()
+            table.sort()
 
-        # 過剰量
-        for material, ex in wc.excess.items():
-            df_output.loc[ind_excess_ratio, material] = ex * 100
-            df_output_show.loc[ind_excess_ratio, material] = ex * 100
-
-        # 過剰量込のモル数
-        df_output_show.loc[ind_mole_with_excess] = df_output_show.loc[ind_mole] * (1 + df_output_show.loc[ind_excess_ratio] / 100)
-        df_output.loc[ind_mole_with_excess, wc.materials] = [
-            '={0}{1}*(1+{0}{2}/100)'.format(
-                get_column_letter(df_output.columns.get_loc(material)+2),
-                df_output.index.get_loc(ind_mole)+2,
-                df_output.index.get_loc(ind_excess_ratio)+2
-            ) for material in wc.materials
-        ]
-        # ↓これ必要？
-        for material in wc.materials:
-            if np.isnan(df_output_show.loc[ind_mole_with_excess, material]):
-                df_output_show.loc[ind_mole_with_excess, material] = df_output_show.loc[ind_mole, material]
-
-        # 過剰量なしの重量
-        df_output_show.loc[ind_weight_without_excess, wc.df_material_weight.columns] = wc.df_material_weight.loc[wc.products[0]]
-        df_output.loc[ind_weight_without_excess, wc.materials] = [
-            '={0}{1}*{0}{2}'.format(
-                get_column_letter(df_output.columns.get_loc(material)+2),
-                df_output.index.get_loc(ind_molar_weight)+2,
-                df_output.index.get_loc(ind_mole)+2,
-            ) for material in wc.materials
-        ]
+        # 一度に表示する行と列の数
+        n_rows, n_cols = self.page_rows, min(self.page_columns, table.n_columns)
+        state = {'start': 0, 'col_start': 0}
 
-        df_output_show.loc[ind_weight_without_excess, wc.products[0]] = wc.mg
-        df_output.loc[ind_weight_without_excess, wc.products[0]] = wc.mg
-
-        # 過剰量ありの重量
-        df_output_show.loc[ind_weight, wc.df_material_weight_excess.columns] = wc.df_material_weight_excess.loc[wc.products[0]]
-        df_output.loc[ind_weight, wc.materials] = [
-            '={0}{1}*{0}{2}'.format(
-                get_column_letter(df_output.columns.get_loc(material)+2),
-                df_output.index.get_loc(ind_molar_weight)+2,
-                df_output.index.get_loc(ind_mole_with_excess)+2,
-            ) for material in wc.materials
+        table_menu = Menu()
+        table_menu.layout = [
+            [sg.Text(self.lang_dict[self.lang]['filter']), sg.InputText(key = 'filter', size = (20, 1), enable_events = True), sg.Text('', key = 'count', size = (30, 1))],
+            [sg.Table(table.page(0, n_rows, 0, n_cols), headings = table.headings(0, n_cols), key = 'table', num_rows = n_rows, col_widths = [16] + [12] * n_cols, auto_size_columns = False, hide_vertical_scroll = True, enable_click_events = True)],
+            [sg.Button('<<', key = 'first'), sg.Button('<', key = 'prev'), sg.Text('', key = 'page', size = (16, 1), justification = 'center'), sg.Button('>', key = 'next'), sg.Button('>>', key = 'last'),
+             sg.Text('    '), sg.Button('◀', key = 'col_prev'), sg.Button('▶', key = 'col_next')],
+            [sg.Cancel(self.lang_dict[self.lang]['cancel'], key = 'Cancel'), sg.InputText(key='SaveAs', do_not_clear=False, enable_events=True, visible=False), sg.FileSaveAs(self.lang_dict[self.lang]['save_as'], file_types = (('Excel file', '*.xlsx'),))],
         ]
+        table_menu.make_window(size = (1200, 600))
+
+        def _refresh():
+            state['start'] = min(state['start'], max(len(table) - 1, 0) // n_rows * n_rows)
+            table_menu.window['table'].update(values = table.page(state['start'], n_rows, state['col_start'], n_cols))
+            # 見出しは列の数が変わらないので書き換えるだけ．
+            for i, heading in enumerate(table.headings(state['col_start'], n_cols)):
+                table_menu.window['table'].Widget.heading('#{}'.format(i + 1), text = heading)
+            table_menu.window['page'].update('{0} / {1}'.format(state['start'] // n_rows + 1, max(ceil(len(table) / n_rows), 1)))
+            table_menu.window['count'].update('{0} / {1}'.format(len(table), len(table.products)))
+
+        _refresh()
+        while True:
+            table_menu.read()
+            event = table_menu.event
+            if event in (None, 'Cancel'):
+                break
+            elif event == 'filter':
+                table.filter(table_menu.values['filter'])
+                state['start'] = 0
+            elif isinstance(event, tuple) and event[:2] == ('table', '+CLICKED+'):
+                row, col = event[2]
+                if row != -1 or col is None:    # 見出し以外
+                    continue
+                column = table.headings(state['col_start'], n_cols)[col]
+                table.sort(column, ascending = not (table.sort_column == column and table.ascending))
+            elif event in ('first', 'prev', 'next', 'last'):
+                last = max(len(table) - 1, 0) // n_rows * n_rows
+                state['start'] = {'first': 0, 'prev': max(state['start'] - n_rows, 0), 'next': min(state['start'] + n_rows, last), 'last': last}[event]
+            elif event in ('col_prev', 'col_next'):
+                step = -n_cols if event == 'col_prev' else n_cols
+                state['col_start'] = min(max(state['col_start'] + step, 0), table.n_columns - n_cols)
+            elif event == 'SaveAs':
+                if table_menu.values['SaveAs'] != '' and self._save(wc, table_menu.values['SaveAs']):
+                    break
+                continue
+            _refresh()
 
-        df_output_show.loc[ind_weight, wc.products[0]] = df_output_show.loc[ind_weight, wc.df_material_weight_excess.columns].sum()
-        df_output.loc[ind_weight, wc.products[0]] = '=SUM({0}{2}:{1}{2})'.format(
-            get_column_letter(df_output.columns.get_loc(wc.materials[0])+2),
-            get_column_letter(df_output.columns.get_loc(wc.materials[-1])+2),
-            df_output.index.get_loc(ind_weight)+2,
-        )
+        table_menu.window.close()
+
+    def _save(self, wc, fpath_output:str) -> bool:
+        """write all products of `wc` to an Excel file in the background. False when it was cancelled."""
+        if os.path.splitext(os.path.basename(fpath_output))[-1] != '.xlsx':
+            fpath_output = os.path.splitext(fpath_output)[0] + '.xlsx'
+        from calculator import CalculationCancelled
+        from export import write_workbook
+        try:
+            self._run_in_background(self.lang_dict[self.lang]['saving'], write_workbook, fpath_output, wc)
+        except CalculationCancelled:
+            return False
+        sg.PopupOK('Saved successfully.', modal = True, **option_text_default)
+        return True
+
+    def _run_in_background(self, message:str, func, *args, **kwargs):
+        """run `func(*args, progress_bar = callback, **kwargs)` in a worker thread.
+
+        A progress window is shown while it runs so that the GUI does not freeze.
+        The worker reports back with `window.write_event_value`.
 
-        # 表示用のdf_outputを作成
-        df_output_show = df_output_show.applymap(lambda x:'{:.2f}'.format(x))
-        df_output_show.replace('nan', '', inplace=True)
+        Returns
+        -------
+        the return value of `func`
+
+        Raises
+        ------
+        CalculationCancelled
+            when the user pressed Cancel.
+        Exception
+            which `func` raised.
+        """
+        from calculator import CalculationCancelled
+
+        cancel = threading.Event()
+        window = sg.Window(APP_NAME, layout = [
+            [sg.Text(message, key = 'message', size = (30, 1))],
+            [sg.ProgressBar(100, orientation = 'h', size = (30, 20), key = 'progress')],
+            [sg.Button(self.lang_dict[self.lang]['cancel'], key = 'Cancel')],
+        ], element_justification = 'center', modal = True, disable_close = True, finalize = True, **option_text_default)
+
+        def _progress(done, total):
+            if cancel.is_set():
+                raise CalculationCancelled()
+            window.write_event_value('-PROGRESS-', (done, total))
+
+        def _worker():
+            try:
+                result = func(*args, progress_bar = _progress, **kwargs)
+            except BaseException as e:  # 例外はメインスレッドで投げ直す．
+                window.write_event_value('-ERROR-', e)
+            else:
+                window.write_event_value('-DONE-', result)
+
+        threading.Thread(target = _worker, daemon = True).start()
+        try:
+            while True:
+                event, values = window.read()
+                if event == '-PROGRESS-':
+                    done, total = values[event]
+                    window['progress'].update(current_count = int(100 * done / max(total, 1)))
+                elif event == 'Cancel':
+                    cancel.set()    # 次に進捗が報告されたときに止まる．
+                    window['message'].update(self.lang_dict[self.lang]['cancelling'])
+                    window['Cancel'].update(disabled = True)
+                elif event == '-ERROR-':
+                    raise values[event]
+                elif event == '-DONE-':
+                    return values[event]
+        finally:
+            window.close()
+
+    def _make_output(self, wc: 'WeighingCalculator') -> Tuple['pd.DataFrame', 'pd.DataFrame']:
+        '''
+        wc: WeighingCalculatorオブジェクト
+        '''
+        from export import get_output_layout
 
-        return df_output, df_output_show
+        # 列や数式の位置は原料ごとにキャッシュされたものを使う．
+        with instrument.timer('make_output'):
+            layout = get_output_layout(tuple(wc.materials))
+            return layout.formula_table(wc), layout.display_table(wc)
 
 
 
@@ -580,7 +602,7 @@ class Menu:
             
     
 def _change_setting():
-    settings = json.load(open(path_settings, mode = 'r', encoding = 'utf_8'))
+    settings = settings_store.to_dict()
 
     corr_lang = {
         '日本語': 'ja',
@@ -614,7 +636,8 @@ def _change_setting():
                 }
             event = sg.PopupYesNo('You will need to reboot to apply the configuration changes.\nCan I close it to apply the settings?', modal = False, keep_on_top = True, **option_text_default)
             if event == 'Yes':
-                json.dump(settings, open(path_settings, mode = 'w', encoding='utf_8'), indent = 4)
+                settings_store.update(settings)
+                settings_store.flush()
                 do_close = True
                 break
         else:
@@ -624,12 +647,15 @@ def _change_setting():
 
 
 def _clear_cache():
+    cache_materials_store.flush()   # 書き込み待ちのものも消すため．
     cache_files = glob(os.path.join(path_root, 'cache*.json'))
-    if cache_files:
+    if cache_files or result_cache.info()['currsize']:
         if sg.PopupOKCancel('Do you want to clear cache?', modal = False, keep_on_top = True, **option_text_default) == 'OK':
+            result_cache.clear()
             for cache_file in cache_files:
                 os.remove(cache_file)
             else:
+                cache_materials_store.discard()
                 sg.PopupOK('Cache cleared.', modal = False, keep_on_top = True, **option_text_default)
     else:
         sg.PopupOK('No cache.', modal = False, keep_on_top = True, **option_text_default)
@@ -0,0 +1,248 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Exact rational arithmetic for the weighing calculation.
+
+Every quantity is held as integers sharing a denominator (fixed point), so the weights
+are computed exactly and rounded to float only once at the end.
+Integer arrays are int64 while they are small enough to be divided exactly as float64
+(< 2 ** 53), otherwise they fall back to Python ints (object arrays), which are exact but slower.
+'''
+
+from fractions import Fraction
+from math import gcd
+import numpy as np
+
+
+# 小数の桁数がこれより多い値は分数で近似する．
+MAX_DECIMALS = 9
+# float64で割り算しても丸めが1回で済む整数の上限
+MAX_EXACT_BITS = 53
+# 小数で書ける値かどうかの判定の許容誤差 (get_ratioの解などの誤差を吸収する．)
+TOLERANCE = 1e-12
+MAX_DENOMINATOR = 10 ** 6
+
+
+def to_fraction(x) -> Fraction:
+    """exact value of `x` as it is written. e.g.) '1/3' -> 1/3, 0.1 -> 1/10, 0.333... -> 1/3"""
+    if isinstance(x, Fraction):
+        return x
+    elif isinstance(x, (int, np.integer)):
+        return Fraction(int(x))
+    elif isinstance(x, str):
+        return Fraction(x.strip().replace(' ', ''))
+    x = float(x)
+    if np.isnan(x):
+        raise ValueError('NaN has no exact value.')
+    f = Fraction(repr(x))   # 書かれた通りの小数
+    if f.denominator > 10 ** MAX_DECIMALS:   # 1/3などを浮動小数点数にしたもの
+        f = Fraction(x).limit_denominator(MAX_DENOMINATOR)
+    return f
+
+
+def _is_nan(x) -> bool:
+    """NaN or its str ('nan', which np.array makes of NaN mixed with str)"""
+    if isinstance(x, str):
+        return x.strip().lower() == 'nan'
+    return isinstance(x, float) and np.isnan(x)
+
+
+def _lcm(*values) -> int:
+    result = 1
+    for value in values:
+        result = result * int(value) // gcd(result, int(value))
+    return result
+
+
+def _bits(ar:np.ndarray) -> int:
+    """number of bits of the largest absolute value"""
+    if ar.size == 0:
+        return 0
+    return max(int(abs(x)).bit_length() for x in (ar.max(), ar.min()))
+
+
+def _decimal_scale(ar:np.ndarray):
+    """smallest 10 ** k (k <= MAX_DECIMALS) with which all values of the float array become integers, or None"""
+    for k in range(MAX_DECIMALS + 1):
+        scaled = ar * 10 ** k
+        if np.all(np.abs(scaled - np.round(scaled)) <= TOLERANCE * np.maximum(np.abs(scaled), 1)):
+            return 10 ** k
+    return None
+
+
+def as_integers(values) -> tuple:
+    '''
+    exact values of a 2-D array as integers with one denominator per row.
+
+    Parameters
+    ----------
+    values : array-like
+        numbers, str ('1/3') or Fraction. NaN is allowed.
+
+    Returns
+    -------
+    tuple
+        (numerators (n, m) int64 or object array, denominators (n, ) int64 or object array, mask of NaN (n, m))
+        numerators of NaN are 0.
+    '''
+    ar = np.asarray(values)
+    if ar.ndim == 1:
+        ar = ar.reshape(1, -1)
+    if ar.dtype.kind in 'biuf':     # 速い方法: 全体を10のべき乗倍して整数にする．
+        ar = ar.astype(float)
+        mask_nan = np.isnan(ar)
+        ar_filled = np.where(mask_nan, 0., ar)
+        scale = _decimal_scale(ar_filled)
+        if scale is not None and np.abs(ar_filled).max(initial = 0) * scale < 2 ** MAX_EXACT_BITS:
+            numerators = np.round(ar_filled * scale).astype(np.int64)
+            return _reduce(numerators, np.full(len(ar), scale, dtype = np.int64), mask_nan)
+    else:
+        mask_nan = np.array([[_is_nan(x) for x in row] for row in ar], dtype = bool).reshape(ar.shape)
+
+    # 遅い方法: Fractionにして行ごとに通分する．
+    numerators = np.zeros(ar.shape, dtype = object)
+    denominators = np.ones(len(ar), dtype = object)
+    for i, row in enumerate(ar):
+        fractions = [Fraction(0) if nan else to_fraction(x) for x, nan in zip(row, mask_nan[i])]
+        denominator = _lcm(*(f.denominator for f in fractions))
+        numerators[i] = [f.numerator * (denominator // f.denominator) for f in fractions]
+        denominators[i] = denominator
+    return _reduce(numerators, denominators, mask_nan)
+
+
+def _reduce(numerators:np.ndarray, denominators:np.ndarray, mask_nan:np.ndarray) -> tuple:
+    """divide each row by the gcd of its numerators and denominator, and use int64 when it is small enough."""
+    if numerators.dtype != object and denominators.dtype != object:
+        g = np.gcd.reduce(np.column_stack([numerators, denominators]), axis = 1)
+        return numerators // g[:, np.newaxis], denominators // g, mask_nan
+    numerators = numerators.astype(object)
+    denominators = denominators.astype(object)
+    for i in range(len(numerators)):
+        g = gcd(int(denominators[i]), *(int(x) for x in numerators[i]))
+        if g > 1:
+            numerators[i] //= g
+            denominators[i] //= g
+    return _compact(numerators), _compact(denominators), mask_nan
+
+
+def _compact(ar:np.ndarray) -> np.ndarray:
+    return ar.astype(np.int64) if _bits(ar) < MAX_EXACT_BITS else ar.astype(object)
+
+
+def _product(*arrays) -> np.ndarray:
+    """product of integer arrays (broadcast) without overflow"""
+    bits = sum(_bits(ar) for ar in arrays)
+    dtype = np.int64 if bits < MAX_EXACT_BITS else object
+    result = np.asarray(arrays[0]).astype(dtype)
+    for ar in arrays[1:]:
+        result = result * np.asarray(ar).astype(dtype)
+    return result
+
+
+def _sum_rows(ar:np.ndarray) -> np.ndarray:
+    """sum along axis 1 without overflow"""
+    dtype = np.int64 if _bits(ar) + ar.shape[1].bit_length() < MAX_EXACT_BITS else object
+    return ar.astype(dtype).sum(axis = 1)
+
+
+def _divide(numerators:np.ndarray, denominators:np.ndarray) -> np.ndarray:
+    """correctly rounded numerators / denominators as float (NaN where the denominator is 0)"""
+    if numerators.dtype != object and denominators.dtype != object:
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            result = numerators.astype(float) / denominators.astype(float)    # < 2 ** 53なので変換は正確
+        result[denominators == 0] = np.nan
+        return result
+    return np.vectorize(lambda n, d: int(n) / int(d) if d else np.nan, otypes = [float])(numerators, denominators)
+
+
+def formula_weights(ar_counts:np.ndarray, atomic_weights:np.ndarray) -> tuple:
+    '''
+    exact formula weights from element counts and atomic weights (both as written in decimal).
+
+    Parameters
+    ----------
+    ar_counts : np.ndarray
+        (n, n_elements) number of each element
+    atomic_weights : np.ndarray
+        (n_elements, )
+
+    Returns
+    -------
+    tuple
+        (numerators (n, ), denominator) of the formula weights
+    '''
+    ar_counts = np.asarray(ar_counts, dtype = float).reshape(-1, len(atomic_weights))
+    used = np.where((ar_counts != 0).any(axis = 0))[0]     # 含まれている元素だけ
+    counts, counts_denominators, _ = as_integers(ar_counts[:, used].T)    # 元素ごとに通分
+    weights, weights_denominators, _ = as_integers(np.asarray(atomic_weights, dtype = float)[used].reshape(-1, 1))
+    denominator = _lcm(*(int(c) * int(w) for c, w in zip(counts_denominators, weights_denominators)))
+
+    numerators = np.zeros(len(ar_counts), dtype = object)
+    for e in range(len(used)):
+        k = denominator // (int(counts_denominators[e]) * int(weights_denominators[e]))
+        numerators = numerators + _product(counts[e], weights[e], np.array([k], dtype = object)).astype(object)
+    g = gcd(denominator, *(int(x) for x in numerators))
+    return _compact(numerators // g), denominator // g
+
+
+def weigh(ratio_numerators:np.ndarray, ratio_denominators:np.ndarray, mask_nan:np.ndarray,
+          materials_numerators:np.ndarray, materials_denominator:int,
+          mg, excess_factor, products_numerators:np.ndarray = None, products_denominator:int = None) -> tuple:
+    '''
+    weights (mg) computed exactly and rounded once.
+
+    weight_ij = mg * ratio_ij * fw_j / fw_i (product),  weight with excess = weight * excess_factor_j
+
+    Parameters
+    ----------
+    ratio_numerators, ratio_denominators, mask_nan :
+        output of `as_integers` for the ratio (n, n_materials)
+    materials_numerators, materials_denominator :
+        output of `formula_weights` for the materials
+    mg : number, str or Fraction
+    excess_factor : array-like
+        1 + excess of each material
+    products_numerators, products_denominator : optional
+        output of `formula_weights` for the products.
+        If None, the formula weight of a product is the sum of those of the materials in the ratio.
+
+    Returns
+    -------
+    tuple
+        (moles (n, ), weights (n, n_materials), weights with excess (n, n_materials)) as float arrays.
+        NaN where the ratio is NaN (rows whose ratio has NaN when `products_numerators` is None).
+    '''
+    mg = to_fraction(mg)
+    factors, factors_denominator, _ = as_integers(np.asarray(excess_factor, dtype = float).reshape(1, -1))
+    factors, factors_denominator = factors[0], int(factors_denominator[0])
+    p, q = np.array([mg.numerator], dtype = object), np.array([mg.denominator], dtype = object)
+
+    n = ratio_numerators
+    d = ratio_denominators.reshape(-1, 1)
+    if products_numerators is None:
+        # 分母の比率の通分は約分で消える．fw_i = sum_k n_ik F_k / (d_i L)
+        fw_scaled = _sum_rows(_product(n, materials_numerators.reshape(1, -1))).reshape(-1, 1)
+        denominators = _product(q, fw_scaled)
+        moles_numerators = _product(p, d, np.array([materials_denominator], dtype = object))
+    else:
+        # 原料と生成物の式量を同じ分母にそろえる．
+        L = _lcm(materials_denominator, products_denominator)
+        materials_numerators = _product(materials_numerators, np.array([L // materials_denominator], dtype = object))
+        products_numerators = _product(products_numerators, np.array([L // products_denominator], dtype = object))
+        denominators = _product(q, d, products_numerators.reshape(-1, 1))
+        moles_numerators = _product(p, d, np.array([L], dtype = object))
+    numerators = _product(p, n, materials_numerators.reshape(1, -1))
+
+    moles = _divide(_compact(moles_numerators.reshape(-1)), _compact(denominators.reshape(-1)))
+    weights = _divide(_compact(numerators), _compact(np.broadcast_to(denominators, numerators.shape)))
+    weights_excess = _divide(
+        _compact(_product(numerators, factors.reshape(1, -1))),
+        _compact(_product(np.broadcast_to(denominators, numerators.shape), np.array([factors_denominator], dtype = object)))
+    )
+    if products_numerators is None:
+        mask_nan = np.broadcast_to(mask_nan.any(axis = 1, keepdims = True), mask_nan.shape)
+        moles[mask_nan[:, 0]] = np.nan
+    weights[mask_nan] = np.nan
+    weights_excess[mask_nan] = np.nan
+    return moles, weights, weights_excess
@@ -0,0 +1,124 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+In-memory LRU cache of whole results (the calculator and its output tables) for the GUI.
+
+The key is built from the inputs in a canonical form: whitespace is removed from formulas and
+floats are rounded to `SIGNIFICANT_DIGITS`, so "1/3" and "0.333333333333" or "Li2 O" and "Li2O"
+give the same key. Only the standard library is used, so it can be imported at start-up.
+'''
+
+from collections import OrderedDict
+from fractions import Fraction
+from threading import Lock
+
+import instrument
+
+
+# 浮動小数点数を比べるときの有効数字
+SIGNIFICANT_DIGITS = 12
+
+
+def _round(x):
+    if isinstance(x, str) and '/' in x:     # 有理数モードの'1/3'など
+        x = Fraction(''.join(x.split()))
+    x = float(x)
+    if x != x:  # NaNはNaN自身とも等しくないので，NaN同士が同じキーになるようにNoneにする．
+        return None
+    return float('{0:.{1}g}'.format(x, SIGNIFICANT_DIGITS)) + 0.    # -0.0と0.0も同じにする．
+
+
+def _formula(formula:str) -> str:
+    return ''.join(str(formula).split())
+
+
+def _floats(values) -> tuple:
+    """nested tuple of rounded floats (lists, tuples or numpy arrays)"""
+    if hasattr(values, 'tolist'):
+        values = values.tolist()
+    if isinstance(values, (list, tuple)):
+        return tuple(_floats(value) for value in values)
+    return _round(values)
+
+
+def result_key(materials:list, products:list = [], ratio = [], mg = 2000, excess:dict = {}, **kwargs) -> tuple:
+    '''
+    canonical (hashable) key of a calculation.
+
+    Parameters
+    ----------
+    materials : list
+        starting materials (the order is kept because it is the order of the columns)
+    products, ratio, mg, excess :
+        same as `WeighingCalculator.calc`
+    kwargs :
+        the other options of `calc` which change the result (e.g. exact, retry_inexact, rational)
+
+    Returns
+    -------
+    tuple
+    '''
+    if not products and len(ratio) and not hasattr(ratio[0], '__len__'):   # calcと同じく1次元の比率は1行とみなす．
+        ratio = [ratio]
+    return (
+        tuple(_formula(material) for material in materials),
+        tuple(_formula(product) for product in products),
+        _floats(ratio),
+        _round(mg),
+        tuple(sorted((_formula(material), _round(value)) for material, value in excess.items())),
+        tuple(sorted(kwargs.items())),
+    )
+
+
+class ResultCache:
+    def __init__(self, maxsize:int = 32):
+        """process-wide LRU cache from `result_key` to a result (e.g. (calculator, output tables)).
+
+        The cached objects are returned as they are, so the caller must not modify them.
+
+        Parameters
+        ----------
+        maxsize : int, optional
+            maximum number of cached results, by default 32
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key:tuple):
+        """return the cached result or None"""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                instrument.count('result_cache_hits')
+                return self._data[key]
+            self.misses += 1
+            instrument.count('result_cache_misses')
+            return None
+
+    def set(self, key:tuple, result):
+        with self._lock:
+            self._data[key] = result
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last = False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self) -> dict:
+        """hit/miss statistics like `functools.lru_cache` and the hit rate"""
+        with self._lock:
+            n = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'maxsize': self.maxsize, 'currsize': len(self._data), 'hit_rate': self.hits / n if n else 0.}
+
+
+# GUIで共有する結果のキャッシュ
+result_cache = ResultCache()
@@ -0,0 +1,245 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Local HTTP/JSON calculation service (asyncio, standard library only).
+
+Several clients can share one calculator. The atomic weights, the formula cache and one
+`WeighingCalculator` per set of materials stay in memory across requests, connections are
+kept alive (HTTP/1.1) and one request can contain many records.
+
+Endpoints:
+    POST /calc    {"materials": [...], "records": [...], "mg": 2000, "excess": {"Li2O": 5}, "exact": true}
+                  records are the same as the input of `cli.py` (ratio columns or "product",
+                  optional "mg" and "<material>_excess" (mol%)).
+                  -> {"columns": [...], "rows": [{...}, ...]}
+    GET  /health  -> {"status": "ok"}
+    GET  /stats   -> number of requests and the formula cache info
+
+Usage:
+    python server.py --port 8080
+    curl -d '{"materials": ["Li2O", "TiO2"], "records": [{"Li2O": 1, "TiO2": 1}]}' localhost:8080/calc
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+import argparse
+import asyncio
+import json
+import sys
+
+import calculator
+from calculator import WeighingCalculator
+from cli import KEY_PRODUCT, SUFFIX_EXCESS, calc_records, output_columns
+
+
+MAX_BODY = 64 * 2 ** 20     # 64 MiB
+MAX_CALCULATORS = 32
+
+
+def _is_number(x) -> bool:
+    return isinstance(x, (int, float)) and not isinstance(x, bool)
+
+
+def _is_value(x) -> bool:
+    """a ratio, an amount or an excess of a record: number, str ('1/3') or null"""
+    return x is None or _is_number(x) or isinstance(x, str)
+
+
+class HTTPError(Exception):
+    def __init__(self, status:HTTPStatus, message:str = ''):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+class CalculationService:
+    def __init__(self):
+        """calculation part of the server (independent of HTTP)."""
+        # calc_records redirects stdout and WeighingCalculator is stateful, thus calculations are serialized in one thread.
+        self._executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'calc')
+        self._calculators = {}
+        self.n_requests = 0
+        self.n_records = 0
+
+    def _get_calculator(self, materials:tuple) -> WeighingCalculator:
+        wc = self._calculators.pop(materials, None)
+        if wc is None:
+            wc = WeighingCalculator(materials = list(materials))
+            if len(self._calculators) >= MAX_CALCULATORS:
+                del self._calculators[next(iter(self._calculators))]    # 最も古いもの
+        self._calculators[materials] = wc
+        return wc
+
+    def calc(self, request:dict) -> dict:
+        """calculate a batch of records. (blocking)"""
+        if not isinstance(request, dict):
+            raise ValueError('The request must be a JSON object.')
+        materials = request.get('materials')
+        records = request.get('records')
+        if not isinstance(materials, list) or not materials or not all(isinstance(m, str) for m in materials):
+            raise ValueError('"materials" must be a non-empty list of str.')
+        if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+            raise ValueError('"records" must be a list of objects.')
+        for i, record in enumerate(records):
+            if not (record.get(KEY_PRODUCT) is None or isinstance(record[KEY_PRODUCT], str)):
+                raise ValueError('"{0}" of records[{1}] must be a str.'.format(KEY_PRODUCT, i))
+            keys = [key for key in record if key != KEY_PRODUCT and (key in materials or key.endswith(SUFFIX_EXCESS) or key == 'mg')]
+            if not all(_is_value(record[key]) for key in keys):
+                raise ValueError('The ratio, "mg" and excess of records[{}] must be numbers or str.'.format(i))
+        excess = request.get('excess', {})
+        if not isinstance(excess, dict) or not all(_is_number(value) for value in excess.values()):
+            raise ValueError('"excess" must be an object of numbers (mol%) e.g. {"Li2O": 5}.')
+        excess = {material: float(value) / 100 for material, value in excess.items()}
+        mg = request.get('mg', 2000)
+        if not _is_number(mg):
+            raise ValueError('"mg" must be a number.')
+
+        wc = self._get_calculator(tuple(materials))
+        rows = calc_records(wc, records, mg = float(mg), excess = excess, exact = bool(request.get('exact', True))) if records else []
+        self.n_records += len(records)
+        return {'columns': output_columns(materials), 'rows': rows}
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.n_requests,
+            'records': self.n_records,
+            'calculators': len(self._calculators),
+            'formula_cache': calculator.formula_cache.info(),
+        }
+
+    async def handle(self, method:str, path:str, body:bytes) -> dict:
+        self.n_requests += 1
+        path = path.split('?', 1)[0]
+        if path == '/calc':
+            if method != 'POST':
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+            try:
+                request = json.loads(body)
+            except ValueError:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, 'Invalid JSON.')
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(self._executor, self.calc, request)
+            except (ValueError, TypeError, KeyError) as e:  # 読めない組成式 (formula.FormulaError) も含む．
+                raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+        elif path in ('/health', '/stats'):
+            if method != 'GET':
+                raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED)
+            return {'status': 'ok'} if path == '/health' else self.stats()
+        raise HTTPError(HTTPStatus.NOT_FOUND)
+
+    def close(self):
+        self._executor.shutdown(wait = True)
+
+
+async def _read_request(reader:asyncio.StreamReader):
+    """return (method, path, version, headers, body), or None when the connection is closed."""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, path, version = line.decode('latin_1').split()
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, 'Invalid request line.')
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin_1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, 'Invalid Content-Length.')
+    if length > MAX_BODY:
+        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), path, version.upper(), headers, body
+
+
+def _keep_alive(version:str, headers:dict) -> bool:
+    connection = headers.get('connection', '').lower()
+    if version == 'HTTP/1.0':
+        return connection == 'keep-alive'
+    return connection != 'close'
+
+
+def _response(status:HTTPStatus, payload:dict, keep_alive:bool) -> bytes:
+    body = json.dumps(payload, ensure_ascii = False).encode('utf_8')
+    head = 'HTTP/1.1 {0} {1}\r\nContent-Type: application/json; charset=utf-8\r\nContent-Length: {2}\r\nConnection: {3}\r\n\r\n'.format(
+        status.value, status.phrase, len(body), 'keep-alive' if keep_alive else 'close'
+    )
+    return head.encode('latin_1') + body
+
+
+async def _handle_connection(service:CalculationService, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+    try:
+        while True:
+            try:
+                request = await _read_request(reader)
+            except HTTPError as e:  # 壊れたリクエストの後は読み続けられないので切る．
+                writer.write(_response(e.status, {'error': str(e)}, keep_alive = False))
+                await writer.drain()
+                break
+            if request is None:
+                break
+            method, path, version, headers, body = request
+            keep_alive = _keep_alive(version, headers)
+            try:
+                status, payload = HTTPStatus.OK, await service.handle(method, path, body)
+            except HTTPError as e:
+                status, payload = e.status, {'error': str(e)}
+            except Exception as e:
+                status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': repr(e)}
+            writer.write(_response(status, payload, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host:str = '127.0.0.1', port:int = 8080, materials:list = None):
+    """run the server until cancelled.
+
+    Parameters
+    ----------
+    host : str, optional
+        by default '127.0.0.1' (local only)
+    port : int, optional
+        by default 8080
+    materials : list, optional
+        materials whose calculator is prepared before the first request, by default None
+    """
+    service = CalculationService()
+    if materials:
+        service._get_calculator(tuple(materials))   # 原子量と式量のキャッシュを温めておく．
+    server = await asyncio.start_server(lambda reader, writer: _handle_connection(service, reader, writer), host, port)
+    sys.stderr.write('Serving on {}\n'.format(', '.join('{0}:{1}'.format(*sock.getsockname()[:2]) for sock in server.sockets)))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Local HTTP/JSON server of weighing calculation.')
+    parser.add_argument('--host', default = '127.0.0.1', help = '(default: 127.0.0.1)')
+    parser.add_argument('--port', type = int, default = 8080, help = '(default: 8080)')
+    parser.add_argument('-m', '--materials', nargs = '+', help = 'materials prepared at startup.')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.materials))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
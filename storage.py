@@ -0,0 +1,163 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Small JSON storage for caches and settings which is safe with several running instances.
+
+* Writes are atomic (temporary file in the same directory + `os.replace`), so a reader
+  never sees a half-written file.
+* Writers hold an exclusive lock on `<path>.lock` and merge their changes into the current
+  contents of the file, so changes of other instances are not lost.
+* Changes are kept in memory (write-back) and written by `flush`, which is called at exit.
+'''
+
+from threading import Lock
+import atexit
+import json
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:     # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    def __init__(self, path:str):
+        """exclusive inter-process lock on `path` (created if it does not exist)."""
+        self.path = path
+        self._f = None
+
+    def __enter__(self):
+        self._f = open(self.path, mode = 'a+b')
+        if fcntl is not None:
+            fcntl.flock(self._f.fileno(), fcntl.LOCK_EX)
+        else:
+            self._f.seek(0)
+            msvcrt.locking(self._f.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *args):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._f.fileno(), fcntl.LOCK_UN)
+            else:
+                self._f.seek(0)
+                msvcrt.locking(self._f.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._f.close()
+            self._f = None
+
+
+def read_json(path:str, default = None):
+    """read a json file; `default` if it does not exist or is broken."""
+    try:
+        with open(path, mode = 'r', encoding = 'utf_8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json_atomic(path:str, obj, **kwargs):
+    """write `obj` to `path` through a temporary file and `os.replace`."""
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, path_tmp = tempfile.mkstemp(prefix = '.' + os.path.basename(path) + '.', suffix = '.tmp', dir = dirname)
+    try:
+        with os.fdopen(fd, mode = 'w', encoding = 'utf_8') as f:
+            json.dump(obj, f, ensure_ascii = False, **kwargs)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path_tmp, path)
+    except BaseException:
+        if os.path.exists(path_tmp):
+            os.remove(path_tmp)
+        raise
+
+
+class JSONStore:
+    def __init__(self, path:str, indent:int = 4):
+        """dict-like json file with write-back buffer.
+
+        Parameters
+        ----------
+        path : str
+            path of the json file (its top level is an object)
+        indent : int, optional
+            indent of the json file, by default 4
+        """
+        self.path = path
+        self.indent = indent
+        self._data = None       # 読み込んだ内容 + 書き込み待ちの変更
+        self._dirty = {}        # 書き込み待ちの変更
+        self._lock = Lock()
+        _stores.add(self)
+
+    def _load(self) -> dict:
+        if self._data is None:
+            data = read_json(self.path, {})
+            self._data = {**(data if isinstance(data, dict) else {}), **self._dirty}
+        return self._data
+
+    def get(self, key:str, default = None):
+        with self._lock:
+            return self._load().get(key, default)
+
+    def __getitem__(self, key:str):
+        with self._lock:
+            return self._load()[key]
+
+    def __contains__(self, key:str) -> bool:
+        with self._lock:
+            return key in self._load()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return dict(self._load())
+
+    def set(self, key:str, value):
+        """change a value in memory; it is written by `flush`."""
+        with self._lock:
+            self._load()[key] = value
+            self._dirty[key] = value
+
+    __setitem__ = set
+
+    def update(self, values:dict):
+        with self._lock:
+            self._load().update(values)
+            self._dirty.update(values)
+
+    def flush(self):
+        """write the changes, merged into the current contents of the file, atomically."""
+        with self._lock:
+            if not self._dirty:
+                return
+            with FileLock(self.path + '.lock'):
+                data = read_json(self.path, {})   # 他のinstanceの変更を取り込む．
+                if not isinstance(data, dict):
+                    data = {}
+                data.update(self._dirty)
+                write_json_atomic(self.path, data, indent = self.indent)
+            self._data = data
+            self._dirty = {}
+
+    def discard(self):
+        """forget the changes which are not written and the contents read (e.g. after the file is removed)."""
+        with self._lock:
+            self._data = None
+            self._dirty = {}
+
+
+# 終了時に書き込むstore
+_stores = set()
+
+
+@atexit.register
+def flush_all():
+    for store in list(_stores):
+        try:
+            store.flush()
+        except OSError:     # 書き込めない場所 (.appの中など)
+            pass
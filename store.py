@@ -0,0 +1,301 @@
+'''
+Copyright (c) 2021, yu9824
+This software is released under the GNU LESSER GENERAL PUBLIC LICENSE Version 3 License, see LICENSE.
+
+Persistent store of past weighings (SQLite).
+
+Every calculation (materials, input, mg, excess, solved ratio, weights, timestamp) is logged.
+Identical calculations are served from the store (the stored weights and, in rational mode, the exact ratio)
+and logged as a reference to the stored run in `reuses`. Calculations whose input only differs in mg or excess
+reuse the stored ratio, so `get_ratio` is not run again; they are appended as new runs with `reused` = 1.
+The keys include the atomic-weight table, so results calculated with an old table are not served.
+Runs are indexed by product formula and by the (order-independent) set of materials.
+'''
+
+from datetime import datetime
+from hashlib import sha1
+from threading import Lock
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from calculator import WeighingCalculator, path_root
+from rational import as_integers, _compact
+import instrument
+
+
+path_store = os.path.join(path_root, 'results.sqlite3')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    materials TEXT NOT NULL,
+    materials_key TEXT NOT NULL,
+    input_key TEXT NOT NULL,
+    key TEXT NOT NULL,
+    mg REAL NOT NULL,
+    excess TEXT NOT NULL,
+    inexact_products TEXT NOT NULL,
+    products TEXT NOT NULL,
+    ratio BLOB NOT NULL,
+    ratio_exact TEXT,
+    reused INTEGER NOT NULL DEFAULT 0,
+    moles BLOB,
+    weights BLOB,
+    weights_no_excess BLOB
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    product TEXT NOT NULL,
+    mole REAL,
+    weights BLOB,
+    PRIMARY KEY (run_id, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS reuses (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_runs_materials ON runs(materials_key);
+CREATE INDEX IF NOT EXISTS idx_runs_input ON runs(input_key);
+CREATE INDEX IF NOT EXISTS idx_runs_key ON runs(key);
+CREATE INDEX IF NOT EXISTS idx_results_product ON results(product);
+'''
+# 古いデータベースにあとから追加した列
+COLUMNS_ADDED = {
+    'runs': ['ratio_exact TEXT', 'reused INTEGER NOT NULL DEFAULT 0', 'moles BLOB', 'weights BLOB', 'weights_no_excess BLOB'],
+}
+
+
+def _materials_key(materials) -> str:
+    """key of the set of materials (independent of the order)"""
+    return '|'.join(sorted(materials))
+
+
+def _hash(obj, data:bytes = b'') -> str:
+    return sha1(json.dumps(obj, sort_keys = True, separators = (',', ':')).encode('utf_8') + data).hexdigest()
+
+
+def _to_blob(ar:np.ndarray) -> bytes:
+    return np.ascontiguousarray(ar, dtype = '<f8').tobytes()
+
+
+def _input_key(wc:WeighingCalculator, products:list, ratio, exact:bool, retry_inexact:bool, rational:bool = False, ratio_exact:tuple = None) -> str:
+    """key of the part of the input which determines the ratio (mg and excess are not included).
+    `ratio_exact` (output of `rational.as_integers`) is used instead of `ratio` in rational mode if given."""
+    materials = list(wc.materials)
+    params = {'materials': materials, 'atomic_weights': wc.atomic_weights.digest, 'rational': bool(rational)}
+    if len(products):
+        return _hash({**params, 'products': [product.replace(' ', '') for product in products], 'exact': bool(exact), 'retry_inexact': bool(retry_inexact)})
+    if rational:    # '1/3'なども入力された通りの値で区別する．
+        if ratio_exact is None:
+            ratio_exact = as_integers(np.asarray(ratio.loc[:, materials] if isinstance(ratio, pd.DataFrame) else ratio).reshape(-1, len(materials)))
+        return _hash(params, _dumps_exact(ratio_exact).encode('utf_8'))
+    if isinstance(ratio, pd.DataFrame):
+        ratio = ratio.loc[:, materials]
+    # 比率は数が多いのでバイト列のまま
+    return _hash(params, _to_blob(np.asarray(ratio, dtype = float).reshape(-1, len(materials))))
+
+
+def _wc_input_key(wc:WeighingCalculator) -> str:
+    """`_input_key` of a calculated `wc` (the same as `ResultStore.calc` makes for its input)."""
+    rational = getattr(wc, 'rational', False)
+    if not wc._from_ratio:
+        return _input_key(wc, wc.products, [], getattr(wc, '_exact', True), getattr(wc, '_retry_inexact', False), rational)
+    return _input_key(wc, [], wc.df_ratio.to_numpy(dtype = float), True, False, rational, ratio_exact = wc._ratio_exact if rational else None)
+
+
+def _dumps_exact(ratio_exact:tuple) -> str:
+    """JSON of the exact ratio (output of `rational.as_integers`); the integers are kept exactly."""
+    numerators, denominators, mask_nan = ratio_exact
+    return json.dumps({
+        'numerators': [[int(x) for x in row] for row in numerators],
+        'denominators': [int(x) for x in denominators],
+        'mask': np.asarray(mask_nan, dtype = bool).tolist(),
+    })
+
+
+def _loads_exact(text:str, n_materials:int) -> tuple:
+    obj = json.loads(text)
+    numerators = np.array(obj['numerators'], dtype = object).reshape(-1, n_materials)
+    denominators = np.array(obj['denominators'], dtype = object)
+    return _compact(numerators), _compact(denominators), np.array(obj['mask'], dtype = bool).reshape(-1, n_materials)
+
+
+def _key(input_key:str, mg, excess:dict) -> str:
+    return _hash({'input': input_key, 'mg': float(mg), 'excess': {k: float(v) for k, v in excess.items()}})
+
+
+class ResultStore:
+    def __init__(self, path:str = path_store):
+        """append-only store of calculations.
+
+        Parameters
+        ----------
+        path : str, optional
+            path of the SQLite database, by default path_store
+        """
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()     # GUIではworker threadからも使う．
+        self._conn = sqlite3.connect(path, check_same_thread = False)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')    # WALではこれでも壊れない (電源断で最後の数件が消えるだけ)．
+        self._conn.execute('PRAGMA foreign_keys = ON')
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+
+    @instrument.timed('store.calc')
+    def calc(self, wc:WeighingCalculator, products = [], ratio = [], mg = 2000, excess = {}, exact = True, retry_inexact = False, **kwargs) -> bool:
+        '''
+        `wc.calc` through the store. The arguments are the same as `WeighingCalculator.calc`.
+
+        Every calculation is logged; one served from the store as a reference to the stored run.
+
+        Returns
+        -------
+        bool
+            True if the ratio was taken from the store.
+        '''
+        rational = kwargs.get('rational', False)
+        input_key = _input_key(wc, products, ratio, exact, retry_inexact, rational)
+        key = _key(input_key, mg, excess)
+        weights = None
+        with self._lock:
+            row = self._conn.execute('SELECT id, inexact_products FROM runs WHERE key = ? ORDER BY id DESC LIMIT 1', (key, )).fetchone()
+            same = row is not None
+            if row is None:     # mgとexcessだけが違うものならばその比率を使う．
+                row = self._conn.execute('SELECT id, inexact_products FROM runs WHERE input_key = ? ORDER BY id DESC LIMIT 1', (input_key, )).fetchone()
+            else:               # 同じ計算ならば重量も保存してあるものを使う．
+                weights = self._load_weights(row[0], len(wc.materials))
+            df_ratio, ratio_exact = (None, None) if row is None else self._load_ratio(row[0], wc.materials)
+
+        if df_ratio is None:
+            self.misses += 1
+            wc.calc(products = products, ratio = ratio, mg = mg, excess = excess, exact = exact, retry_inexact = retry_inexact, **kwargs)
+        else:
+            self.hits += 1
+            instrument.count('store_hits')
+            wc.mg = mg
+            wc.inexact_products = json.loads(row[1])
+            wc._exact, wc._retry_inexact = exact, retry_inexact
+            wc._set_ratio(df_ratio, excess, rational = rational, from_ratio = not len(products), ratio_exact = ratio_exact, weights = weights)
+        if same and weights is not None:    # 同じ結果を二重に保存しない．
+            with self._lock, self._conn:
+                self._conn.execute('INSERT INTO reuses (created_at, run_id) VALUES (?, ?)', (time.time(), row[0]))
+        else:
+            self.append(wc, input_key = input_key, key = key, reused = df_ratio is not None)
+        return df_ratio is not None
+
+    def append(self, wc:WeighingCalculator, input_key:str = None, key:str = None, reused:bool = False) -> int:
+        """append a calculated `wc` and return the id of the run. `reused`: whether the ratio was taken from the store."""
+        rational = getattr(wc, 'rational', False)
+        if input_key is None:
+            input_key = _wc_input_key(wc)
+        if key is None:
+            key = _key(input_key, wc.mg, wc.excess)
+        ar_weights = np.full((len(wc.products), len(wc.materials)), np.nan)
+        ar_weights[wc._mask_valid] = wc.df_material_weight_excess.to_numpy()
+        ar_weights_no_excess = np.full((len(wc.products), len(wc.materials)), np.nan)
+        ar_weights_no_excess[wc._mask_valid] = wc.df_material_weight.to_numpy()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'INSERT INTO runs (created_at, materials, materials_key, input_key, key, mg, excess, inexact_products, products, ratio, ratio_exact, reused, moles, weights, weights_no_excess)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    time.time(), json.dumps(list(wc.materials)), _materials_key(wc.materials), input_key, key, float(wc.mg), json.dumps(wc.excess),
+                    json.dumps(getattr(wc, 'inexact_products', [])), json.dumps(wc.products), _to_blob(wc._ar_ratio),
+                    _dumps_exact(wc._ratio_exact) if rational else None, int(reused),
+                    _to_blob(np.asarray(wc.moles, dtype = float)), _to_blob(ar_weights), _to_blob(ar_weights_no_excess)
+                )
+            )
+            run_id = cursor.lastrowid
+            # 検索用に生成物ごとの行も作る．
+            self._conn.executemany(
+                'INSERT INTO results (run_id, position, product, mole, weights) VALUES (?, ?, ?, ?, ?)',
+                zip(
+                    [run_id] * len(wc.products), range(len(wc.products)), wc.products, wc.moles,
+                    [None if np.isnan(weights).all() else _to_blob(weights) for weights in ar_weights]
+                )
+            )
+        return run_id
+
+    def search(self, product:str = None, materials = None, limit:int = 100) -> pd.DataFrame:
+        '''
+        search past weighings, newest first.
+
+        Parameters
+        ----------
+        product : str, optional
+            product formula (exact match), by default None
+        materials : list, optional
+            set of materials (the order does not matter), by default None
+        limit : int, optional
+            maximum number of rows, by default 100
+
+        Returns
+        -------
+        pd.DataFrame
+            columns: run_id, created_at, materials, mg, excess, product, mole, weights (np.ndarray with excess, None if not calculated)
+        '''
+        conditions = []
+        params = []
+        if product is not None:
+            conditions.append('s.product = ?')
+            params.append(product.replace(' ', ''))
+        if materials is not None:
+            conditions.append('r.materials_key = ?')
+            params.append(_materials_key(materials))
+        query = 'SELECT r.id, r.created_at, r.materials, r.mg, r.excess, s.product, s.mole, s.weights FROM results AS s JOIN runs AS r ON r.id = s.run_id'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY r.id DESC, s.position LIMIT ?'
+        with self._lock:
+            rows = self._conn.execute(query, params + [limit]).fetchall()
+
+        columns = ['run_id', 'created_at', 'materials', 'mg', 'excess', 'product', 'mole', 'weights']
+        records = [
+            (run_id, datetime.fromtimestamp(created_at), json.loads(materials), mg, json.loads(excess), product, mole, None if weights is None else np.frombuffer(weights, dtype = '<f8'))
+            for run_id, created_at, materials, mg, excess, product, mole, weights in rows
+        ]
+        return pd.DataFrame(records, columns = columns)
+
+    def info(self) -> dict:
+        with self._lock:
+            n_runs, n_reused = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(reused), 0) FROM runs').fetchone()
+            n_reuses, = self._conn.execute('SELECT COUNT(*) FROM reuses').fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'runs': n_runs, 'reused': n_reused, 'reuses': n_reuses}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _migrate(self):
+        for table, columns in COLUMNS_ADDED.items():
+            existing = {row[1] for row in self._conn.execute('PRAGMA table_info({})'.format(table))}
+            for column in columns:
+                if column.split()[0] not in existing:
+                    self._conn.execute('ALTER TABLE {0} ADD COLUMN {1}'.format(table, column))
+        self._conn.commit()
+
+    def _load_ratio(self, run_id:int, materials:list) -> tuple:
+        """(df_ratio, exact ratio or None)"""
+        products, ratio, ratio_exact = self._conn.execute('SELECT products, ratio, ratio_exact FROM runs WHERE id = ?', (run_id, )).fetchone()
+        ar_ratio = np.frombuffer(ratio, dtype = '<f8').reshape(-1, len(materials)).copy()
+        df_ratio = pd.DataFrame(ar_ratio, columns = materials, index = json.loads(products))
+        return df_ratio, None if ratio_exact is None else _loads_exact(ratio_exact, len(materials))
+
+    def _load_weights(self, run_id:int, n_materials:int) -> tuple:
+        """(moles, weights, weights with excess) of all products, None if they were not stored."""
+        row = self._conn.execute('SELECT moles, weights_no_excess, weights FROM runs WHERE id = ?', (run_id, )).fetchone()
+        if any(blob is None for blob in row):   # 古いデータベース
+            return None
+        ar_moles, ar_weights_no_excess, ar_weights = (np.frombuffer(blob, dtype = '<f8') for blob in row)
+        return ar_moles, ar_weights_no_excess.reshape(-1, n_materials), ar_weights.reshape(-1, n_materials)
@@ -0,0 +1,30 @@
+import json
+
+import pytest
+
+pytest.importorskip('element_recognition')
+pytest.importorskip('openpyxl')
+
+from benchmarks import run
+from benchmarks.suite import BENCHMARKS
+
+
+def test_names_are_unique():
+    names = [name for name, _, _ in BENCHMARKS]
+    assert len(names) == len(set(names))
+
+
+def test_save_and_compare(tmp_path, capsys):
+    path = str(tmp_path / 'baseline.json')
+    assert run.main(['-k', 'init', '--save', '--baseline', path]) == 0
+    with open(path, encoding = 'utf_8') as f:
+        baseline = json.load(f)
+    assert set(baseline['results']) == {'init', 'init_cold'}
+    assert run.main(['-k', 'init', '--baseline', path, '--threshold', '100']) == 0
+
+    # 極端に速い基準値と比べると遅くなったとみなされる．
+    baseline['results'] = {name: 1e-12 for name in baseline['results']}
+    with open(path, mode = 'w', encoding = 'utf_8') as f:
+        json.dump(baseline, f)
+    assert run.main(['-k', 'init', '--baseline', path]) == 1
+    assert 'regressions (> 1.5x baseline): init, init_cold' in capsys.readouterr().out
@@ -0,0 +1,290 @@
+from fractions import Fraction
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('element_recognition')
+
+from calculator import CalculationCancelled, FormulaCache, WeighingCalculator, formula_cache, get_atomic_weights
+
+
+MATERIALS = ['Li2O', 'SiO2', 'MoO3']
+
+
+def _calc(**kwargs) -> WeighingCalculator:
+    wc = WeighingCalculator(materials = MATERIALS)
+    wc.calc(**{'progress_bar': False, **kwargs})
+    return wc
+
+
+def _assert_same(wc, expected, names = True):
+    if names:
+        assert wc.products == expected.products
+    np.testing.assert_allclose(wc.moles, expected.moles, rtol = 1e-12)
+    np.testing.assert_allclose(wc.df_material_weight.to_numpy(), expected.df_material_weight.to_numpy(), rtol = 1e-12)
+    np.testing.assert_allclose(wc.df_material_weight_excess.to_numpy(), expected.df_material_weight_excess.to_numpy(), rtol = 1e-12)
+
+
+@pytest.mark.parametrize('rational', [False, True])
+def test_update_mg(rational):
+    wc = _calc(ratio = [[1, 1, 1], [2, 1, 0]], excess = {'Li2O': 0.05}, rational = rational)
+    wc.update_mg(500)
+    _assert_same(wc, _calc(ratio = [[1, 1, 1], [2, 1, 0]], mg = 500, excess = {'Li2O': 0.05}, rational = rational))
+
+
+def test_update_excess_keeps_other_materials():
+    wc = _calc(ratio = [[1, 1, 1]], excess = {'Li2O': 0.05})
+    wc.update_excess({'MoO3': 0.1})
+    _assert_same(wc, _calc(ratio = [[1, 1, 1]], excess = {'Li2O': 0.05, 'MoO3': 0.1}))
+
+
+@pytest.mark.parametrize('ratio', [[[1, 1, 1], [2, 1, 0]], [[1., 1., 1.], [2., 1., 0.]]])
+def test_update_ratio_with_integer_or_float_input(ratio):
+    wc = _calc(ratio = ratio)
+    wc.update_ratio('MoO3', 0.5, i = 1)
+    _assert_same(wc, _calc(ratio = [[1, 1, 1], [2, 1, 0.5]]))
+
+
+def test_update_ratio_of_products():
+    wc = _calc(products = ['Li2SiO3', 'Li2MoO4'])
+    wc.update_ratio('SiO2', 1, i = 1)
+    # 解いた比率には丸め誤差があるので組成名は比べない．
+    _assert_same(wc, _calc(ratio = [[1, 1, 0], [1, 1, 1]]), names = False)
+
+
+def test_exact_ratio_matches_get_ratio():
+    from element_recognition import get_ratio
+    products = ['Li2SiO3', 'Li2MoO4', 'Li4SiO4', 'Li0.5Si0.25Mo0.25O1.75']
+    wc = _calc(products = products)
+    expected = get_ratio(materials = MATERIALS, products = products, exact = True).to_numpy(dtype = float)
+    np.testing.assert_allclose(wc.df_ratio.to_numpy(), expected, atol = 1e-12)
+
+
+def test_unmatched_product_is_nan():
+    wc = _calc(products = ['Li2SiO3', 'Na2O', 'Li2O2'])
+    assert np.isnan(wc.df_ratio.to_numpy()[1:]).all()
+    assert wc._mask_valid.tolist() == [True, False, False]
+
+
+def test_dependent_materials_are_named():
+    wc = WeighingCalculator(materials = ['Li2O', 'Li4O2', 'SiO2'])
+    with pytest.raises(ValueError, match = 'linearly dependent: Li2O, Li4O2'):
+        wc.calc(products = ['Li2SiO3'], progress_bar = False)
+
+
+def test_retry_inexact():
+    wc = _calc(products = ['Li2SiO3', 'Li2SiO3.1'], retry_inexact = True)
+    assert wc.inexact_products == ['Li2SiO3.1']
+    assert wc._mask_valid.all()
+
+
+def test_weights_of_each_composition():
+    wc = _calc(ratio = [[1, 1, 1], [2, 1, 0], [0, 0, 1]], mg = 1000, excess = {'Li2O': 0.05})
+    ar_formula_weight_materials = np.array([wc.dict_materials[material] for material in MATERIALS])
+    # 1組成ずつ計算したもの
+    for ratio, mole, weight, weight_excess in zip(wc.df_ratio.to_numpy(), wc.moles, wc.df_material_weight.to_numpy(), wc.df_material_weight_excess.to_numpy()):
+        assert mole == pytest.approx(1000 / (ratio @ ar_formula_weight_materials))
+        np.testing.assert_allclose(weight, ratio * mole * ar_formula_weight_materials, rtol = 1e-12)
+        np.testing.assert_allclose(weight_excess, weight * [1.05, 1, 1], rtol = 1e-12)
+        assert weight.sum() == pytest.approx(1000)
+
+
+def test_invalid_compositions_are_dropped():
+    wc = _calc(products = ['Li2SiO3', 'Na2O', 'Li2MoO4'])
+    assert wc.df_material_weight.index.tolist() == ['Li2SiO3', 'Li2MoO4']
+    assert len(wc.moles) == 3   # moleは元と同じくすべての組成について
+
+
+def test_no_valid_composition_raises():
+    with pytest.raises(ValueError, match = 'no composition'):
+        _calc(products = ['Na2O'])
+
+
+def test_formula_cache_is_lru():
+    cache = FormulaCache(maxsize = 2)
+    cache.set('Li2O', ((0, ), (2., )), 29.88)
+    cache.set('SiO2', ((1, ), (1., )), 60.08)
+    assert cache.get('Li2O') is not None    # Li2Oが最近使われたもの
+    cache.set('MoO3', ((2, ), (1., )), 143.95)
+    assert cache.get('SiO2') is None
+    assert cache.get('Li2O')[1] == 29.88
+    assert cache.info() == {'hits': 2, 'misses': 1, 'maxsize': 2, 'currsize': 2}
+
+
+def test_formula_cache_is_cleared_when_the_table_changes():
+    cache = FormulaCache()
+    cache.bind(('H', 'O'), np.array([1.008, 15.999]))
+    cache.set('H2O', ((0, 1), (2., 1.)), 18.015)
+    cache.bind(('H', 'O'), np.array([1.008, 15.999]))   # 同じ内容の表
+    assert cache.get('H2O') is not None
+    cache.bind(('H', 'O'), np.array([1.008, 16.]))
+    assert cache.get('H2O') is None
+
+
+def test_formula_cache_is_shared_among_calculators():
+    WeighingCalculator(materials = MATERIALS)
+    hits = formula_cache.info()['hits']
+    WeighingCalculator(materials = MATERIALS)
+    assert formula_cache.info()['hits'] == hits + len(MATERIALS)
+
+
+def _write_table(path, weight_h:float, mtime_ns:int):
+    path.write_text('# comment\n,atomic_weights\nH,{}\nO,15.999\n'.format(weight_h), encoding = 'utf_8')
+    os.utime(path, ns = (mtime_ns, mtime_ns))
+
+
+def test_atomic_weights_are_loaded_once(tmp_path):
+    path = tmp_path / 'atomic_weights.csv'
+    _write_table(path, 1.008, 10 ** 18)
+    table = get_atomic_weights(str(path))
+    assert table.elements == ('H', 'O')
+    assert table.weights.tolist() == [1.008, 15.999]
+    assert not table.weights.flags.writeable
+    assert (tmp_path / 'atomic_weights.npz').is_file()
+    assert get_atomic_weights(str(path)) is table
+
+
+def test_atomic_weights_are_reloaded_when_the_csv_changes(tmp_path):
+    path = tmp_path / 'atomic_weights.csv'
+    _write_table(path, 1.008, 10 ** 18)
+    table = get_atomic_weights(str(path))
+    _write_table(path, 1.5, 2 * 10 ** 18)
+    table_new = get_atomic_weights(str(path))
+    assert table_new.weights.tolist() == [1.5, 15.999]
+    assert table_new.digest != table.digest
+
+
+def test_atomic_weights_from_a_broken_sidecar(tmp_path):
+    path = tmp_path / 'atomic_weights.csv'
+    _write_table(path, 1.008, 10 ** 18)
+    (tmp_path / 'atomic_weights.npz').write_bytes(b'broken')
+    assert get_atomic_weights(str(path)).weights.tolist() == [1.008, 15.999]
+
+
+@pytest.mark.parametrize('exact', [True, False])
+def test_n_jobs_keeps_the_order(exact):
+    products = ['Li2SiO3', 'Li2MoO4', 'Li4SiO4', 'Na2O', 'Li2Si2O5'] * 3
+    wc = _calc(products = products, exact = exact, n_jobs = 2)
+    expected = _calc(products = products, exact = exact)
+    _assert_same(wc, expected)
+    np.testing.assert_array_equal(wc.df_ratio.to_numpy(), expected.df_ratio.to_numpy())
+
+
+def test_bad_product_does_not_spoil_its_chunk():
+    from calculator import _get_ratio_chunk
+    ar_ratio = _get_ratio_chunk(MATERIALS, ['Li2SiO3', 'Na2O', 'Li2MoO4'], False)
+    assert np.isnan(ar_ratio[1]).all()
+    assert not np.isnan(ar_ratio[[0, 2]]).any()
+
+
+def test_progress_is_reported():
+    reported = []
+    _calc(products = ['Li2SiO3', 'Li2MoO4'], progress_bar = lambda done, total: reported.append((done, total)))
+    assert reported and reported[-1][0] == reported[-1][1]
+
+
+def _cancel(done, total):
+    if done >= 2:
+        raise CalculationCancelled
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'ratio': np.ones((100, 3))},
+    {'products': ['Li2SiO3', 'Li2MoO4', 'Li4SiO4', 'Li2Si2O5'] * 25, 'exact': False, 'n_jobs': 2},
+])
+def test_calculation_can_be_cancelled(kwargs):
+    reported = []
+
+    def callback(done, total):
+        reported.append(done)
+        _cancel(done, total)
+
+    with pytest.raises(CalculationCancelled):
+        _calc(progress_bar = callback, **kwargs)
+    assert reported == [1, 2]
+
+
+def test_sweep_matches_calc():
+    wc = WeighingCalculator(materials = MATERIALS)
+    grid = {'Li2O': [1, 2], 'SiO2': [0, 1, 2], 'MoO3': 1}
+    chunks = list(wc.sweep(grid, mg = 1000, excess = {'Li2O': 0.05}, chunksize = 4))
+    assert [len(df) for df in chunks] == [4, 2]
+    df = pd.concat(chunks)
+    expected = _calc(ratio = [[1, 0, 1], [1, 1, 1], [1, 2, 1], [2, 0, 1], [2, 1, 1], [2, 2, 1]], mg = 1000, excess = {'Li2O': 0.05})
+    assert df.index.tolist() == expected.products
+    np.testing.assert_allclose(df['mole (mmol)'], expected.moles, rtol = 1e-12)
+    np.testing.assert_allclose(df[['{}_weight'.format(m) for m in MATERIALS]], expected.df_material_weight_excess, rtol = 1e-12)
+    np.testing.assert_allclose(df[['{}_weight_no_excess'.format(m) for m in MATERIALS]], expected.df_material_weight, rtol = 1e-12)
+    np.testing.assert_allclose(df['total_weight'], expected.df_material_weight_excess.sum(axis = 1), rtol = 1e-12)
+
+
+def test_sweep_with_parameters():
+    wc = WeighingCalculator(materials = ['Li2O', 'MoO3'])
+    df = next(wc.sweep({'x': [0, 0.5, 1]}, ratio = lambda x: {'Li2O': 1 - x, 'MoO3': x}, names = False))
+    assert df.index.tolist() == [0, 1, 2]
+    assert df['x'].tolist() == [0, 0.5, 1]
+    assert df['MoO3_weight'].tolist()[::2] == [0, 2000]
+
+
+def test_sweep_of_zero_ratio_is_nan():
+    wc = WeighingCalculator(materials = MATERIALS)
+    df = next(wc.sweep({'Li2O': [0, 1]}, names = False))
+    assert np.isnan(df.iloc[0, 1:]).all()
+    assert df['total_weight'][1] == pytest.approx(2000)
+
+
+def test_sweep_of_unknown_material():
+    with pytest.raises(ValueError, match = 'Unknown materials in grid: Na2O'):
+        next(WeighingCalculator(materials = MATERIALS).sweep({'Na2O': [1]}))
+
+
+def test_max_mg():
+    wc = _calc(ratio = [[1, 1, 0], [1, 0, 1]], mg = 1000, excess = {'Li2O': 0.05})
+    df = wc.max_mg({'Li2O': 100, 'MoO3': 1e6})
+    np.testing.assert_allclose(df['Li2O'], [100, 100])    # Li2Oを使い切る．
+    np.testing.assert_allclose(df['mg'], 100 / wc.df_material_weight_excess['Li2O'].to_numpy() * 1000)
+    assert df.loc[wc.products[0], 'MoO3'] == 0
+    assert np.isinf(wc.max_mg({'MoO3': 100})['mg'].iloc[0])  # 制限のある原料を使わない．
+
+
+def test_max_mg_of_invalid_products_and_unknown_materials():
+    wc = _calc(products = ['Li2SiO3', 'Na2O'])
+    assert np.isnan(wc.max_mg({'Li2O': 100}).iloc[1]).all()
+    with pytest.raises(ValueError, match = 'Unknown materials in stock: Na2O'):
+        wc.max_mg({'Na2O': 100})
+
+
+def test_allocate():
+    pytest.importorskip('scipy')
+    wc = _calc(ratio = [[1, 1, 0], [1, 0, 1]], mg = 1000)
+    stock = {'Li2O': 100, 'SiO2': 50}
+    df = wc.allocate(stock, priority = {wc.products[1]: 2, wc.products[0]: 1}, min_mg = {wc.products[0]: 10})
+    assert df['Li2O'].sum() == pytest.approx(100)
+    assert df['SiO2'].sum() <= 50 + 1e-9
+    assert df['mg'].iloc[0] == pytest.approx(10)    # 優先度の高いほうに残りを回す．
+    with pytest.raises(ValueError, match = 'could not be allocated'):
+        wc.allocate(stock, min_mg = 1e6)
+
+
+def _exact_formula_weight(wc, counts:dict) -> Fraction:
+    table = wc.atomic_weights
+    return sum(n * Fraction(repr(float(table.weights[table.index[element]]))) for element, n in counts.items())
+
+
+def test_rational_weights_are_exact():
+    wc = _calc(ratio = [['1/3', '2/3', 0], ['0.1', '0.2', '0.7']], mg = 1000, excess = {'Li2O': 0.05}, rational = True)
+    fw = [_exact_formula_weight(wc, {'Li': 2, 'O': 1}), _exact_formula_weight(wc, {'Si': 1, 'O': 2}), _exact_formula_weight(wc, {'Mo': 1, 'O': 3})]
+    for i, ratio in enumerate([[Fraction(1, 3), Fraction(2, 3), 0], [Fraction(1, 10), Fraction(2, 10), Fraction(7, 10)]]):
+        fw_product = sum(r * f for r, f in zip(ratio, fw))
+        assert wc.moles[i] == float(1000 / fw_product)
+        assert wc.df_material_weight.iloc[i].tolist() == [float(1000 * r * f / fw_product) for r, f in zip(ratio, fw)]
+        assert wc.df_material_weight_excess.iloc[i, 0] == float(1000 * ratio[0] * fw[0] / fw_product * Fraction(105, 100))
+
+
+def test_rational_products_use_their_own_formula_weight():
+    wc = _calc(products = ['Li2SiO3'], mg = 1000, rational = True)
+    assert wc.moles[0] == float(1000 / _exact_formula_weight(wc, {'Li': 2, 'Si': 1, 'O': 3}))
+    np.testing.assert_allclose(wc.df_material_weight.to_numpy(), _calc(products = ['Li2SiO3'], mg = 1000).df_material_weight.to_numpy(), rtol = 1e-12)
+
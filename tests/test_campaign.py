@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('element_recognition')
+pytest.importorskip('openpyxl')
+
+from openpyxl import load_workbook
+
+import campaign
+from calculator import WeighingCalculator
+
+
+MATERIALS = ['Li2O', 'SiO2', 'MoO3']
+JOBS = [
+    ('Li2SiO3', 1000, {'Li2O': 0.05}),
+    {'product': 'Li2MoO4'},
+    ('Li2SiO3', 500),
+    ('Na2O', 100),
+]
+
+
+@pytest.fixture
+def plan():
+    plan = campaign.Campaign(MATERIALS)
+    plan.plan(JOBS, mg = 2000, excess = {'MoO3': 0.1})
+    return plan
+
+
+def test_jobs_are_the_same_as_each_calculation(plan):
+    assert plan.wc.products == ['Li2MoO4', 'Li2SiO3', 'Na2O']     # 同じ生成物は一度だけ解く．
+    df = plan.df_jobs
+    assert df['product'].tolist() == ['Li2SiO3', 'Li2MoO4', 'Li2SiO3', 'Na2O']
+    assert df['mg'].tolist() == [1000, 2000, 500, 100]
+    for i, (product, mg, excess) in enumerate([('Li2SiO3', 1000, {'Li2O': 0.05, 'MoO3': 0.1}), ('Li2MoO4', 2000, {'MoO3': 0.1}), ('Li2SiO3', 500, {'MoO3': 0.1})]):
+        wc = WeighingCalculator(materials = MATERIALS)
+        wc.calc(products = [product], mg = mg, excess = excess, progress_bar = False)
+        np.testing.assert_allclose(df.loc[i, ['{}_weight'.format(m) for m in MATERIALS]].to_numpy(dtype = float), wc.df_material_weight_excess.to_numpy()[0], rtol = 1e-12)
+        np.testing.assert_allclose(df.loc[i, ['{}_weight_no_excess'.format(m) for m in MATERIALS]].to_numpy(dtype = float), wc.df_material_weight.to_numpy()[0], rtol = 1e-12)
+        assert df.loc[i, 'mole (mmol)'] == pytest.approx(wc.moles[0])
+    assert plan.failed_jobs == [3]
+    assert np.isnan(df.iloc[3, 2:].to_numpy(dtype = float)).all()
+
+
+def test_demand(plan):
+    df = plan.demand(stock = {'Li2O': 500})
+    np.testing.assert_allclose(df['weight (mg)'], np.nansum(plan.df_jobs[['{}_weight'.format(m) for m in MATERIALS]].to_numpy(dtype = float), axis = 0))
+    assert df['jobs'].tolist() == [3, 2, 1]
+    assert df.loc['Li2O', 'shortage (mg)'] == pytest.approx(df.loc['Li2O', 'weight (mg)'] - 500)
+    assert np.isnan(df.loc['SiO2', 'stock (mg)'])
+
+
+def test_inexact_products_are_reported_only_when_retried():
+    plan = campaign.Campaign(MATERIALS)
+    plan.plan([('Li2SiO3', ), ('Li2SiO3.1', )])
+    assert plan.failed_jobs == [1] and plan.inexact_products == []
+    plan.plan([('Li2SiO3', ), ('Li2SiO3.1', )], retry_inexact = True)
+    assert plan.failed_jobs == [] and plan.inexact_products == ['Li2SiO3.1']
+    with pytest.raises(ValueError, match = 'no composition'):
+        plan.plan([('Na2O', )])
+
+
+def test_workbook(plan, tmp_path):
+    path = str(tmp_path / 'plan.xlsx')
+    plan.write_workbook(path, stock = {'Li2O': 500})
+    wb = load_workbook(path)
+    rows_demand = [list(row) for row in wb[campaign.SHEET_DEMAND].iter_rows(values_only = True)]
+    assert rows_demand[0] == ['material', 'weight (mg)', 'weight_no_excess (mg)', 'jobs', 'stock (mg)', 'shortage (mg)']
+    # Li2Oの列はjobsシートのD列 (過剰量あり) とG列 (なし)
+    assert rows_demand[1] == ['Li2O', "=SUM('jobs'!D2:D5)", "=SUM('jobs'!G2:G5)", "=COUNTIF('jobs'!D2:D5,\">0\")", 500, '=IF(ISNUMBER(E2),MAX(B2-E2,0),"")']
+    rows_jobs = [list(row) for row in wb[campaign.SHEET_JOBS].iter_rows(values_only = True)]
+    assert rows_jobs[0][3] == 'Li2O_weight' and rows_jobs[0][6] == 'Li2O_weight_no_excess'
+    assert len(rows_jobs) == 5
+    assert rows_jobs[4][:2] == ['Na2O', 100] and rows_jobs[4][2:] == [None] * 8
+
+
+def test_main(tmp_path, capsys):
+    path_jobs = tmp_path / 'jobs.csv'
+    path_jobs.write_text('product,mg,Li2O_excess\nLi2SiO3,1000,5\nLi2MoO4,,\n', encoding = 'utf_8')
+    path_plan = tmp_path / 'plan.xlsx'
+    assert campaign.main(['-m', *MATERIALS, '-i', str(path_jobs), '-o', str(path_plan), '--stock', 'Li2O=100']) == 0
+    assert path_plan.is_file()
+    captured = capsys.readouterr()
+    assert 'shortage' in captured.out
+    assert '2 jobs planned, 0 could not be calculated.' in captured.err
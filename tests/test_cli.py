@@ -0,0 +1,74 @@
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip('element_recognition')
+
+import cli
+from calculator import WeighingCalculator
+
+
+MATERIALS = ['Li2O', 'SiO2']
+
+
+@pytest.fixture
+def wc():
+    return WeighingCalculator(materials = MATERIALS)
+
+
+def test_ratio_and_product_records_agree(wc):
+    rows = cli.calc_records(wc, [{'Li2O': 1, 'SiO2': 1}, {'product': 'Li2SiO3'}], mg = 1000)
+    assert [row['product'] for row in rows] == ['Li2SiO3', 'Li2SiO3']
+    assert rows[0]['total_weight'] == pytest.approx(1000)
+    assert rows[0]['Li2O_weight'] == pytest.approx(rows[1]['Li2O_weight'])
+
+
+def test_mg_and_excess_of_each_record(wc):
+    rows = cli.calc_records(wc, [{'Li2O': 1, 'SiO2': 1}, {'Li2O': 1, 'SiO2': 1, 'mg': '500', 'Li2O_excess': 10}], mg = 1000, excess = {'Li2O': 0.05})
+    assert rows[0]['Li2O_weight'] == pytest.approx(rows[0]['Li2O_weight_no_excess'] * 1.05)
+    assert rows[1]['Li2O_weight_no_excess'] == pytest.approx(rows[0]['Li2O_weight_no_excess'] / 2)
+    assert rows[1]['Li2O_weight'] == pytest.approx(rows[1]['Li2O_weight_no_excess'] * 1.1)
+
+
+@pytest.mark.parametrize('record', [
+    {'product': '(Li2O'},           # かっこが閉じていない
+    {'product': 'Li$O'},            # element_recognitionも読めない
+    {'product': 'Na2O'},            # 原料から作れない
+    {'Li2O': 'x', 'SiO2': 1},
+    {'Li2O': '1/0', 'SiO2': 1},
+    {'SiO2': 1},                    # 比率がない
+    {'Li2O': 0, 'SiO2': 0},         # すべて0
+    {'Li2O': 1, 'SiO2': 1, 'mg': 'abc'},
+])
+def test_bad_record_gives_empty_row_without_spoiling_others(wc, record):
+    rows = cli.calc_records(wc, [{'Li2O': 1, 'SiO2': 1}, record, {'product': 'Li4SiO4'}])
+    assert rows[1]['total_weight'] is None
+    assert rows[1]['mole (mmol)'] is None
+    assert rows[0]['total_weight'] == pytest.approx(2000)
+    assert rows[2]['total_weight'] == pytest.approx(2000)
+
+
+def test_rational(wc):
+    row, = cli.calc_records(wc, [{'Li2O': '1/3', 'SiO2': '2/3'}], mg = 1000, rational = True)
+    assert row['total_weight'] == pytest.approx(1000, rel = 1e-15)
+
+
+def test_main_streams_all_records(tmp_path, capsys):
+    path_in = tmp_path / 'in.jsonl'
+    path_out = tmp_path / 'out.jsonl'
+    records = [{'product': '(Li2O'}, {'product': 'Li2SiO3'}, {'Li2O': 0, 'SiO2': 0}, {'Li2O': 2, 'SiO2': 1}]
+    path_in.write_text(''.join(json.dumps(record) + '\n' for record in records), encoding = 'utf_8')
+    assert cli.main(['-m', *MATERIALS, '-i', str(path_in), '-o', str(path_out), '--chunksize', '3']) == 0
+    rows = [json.loads(line) for line in path_out.read_text(encoding = 'utf_8').splitlines()]
+    assert [row['total_weight'] is None for row in rows] == [True, False, True, False]
+    assert '4 records processed, 2 could not be calculated.' in capsys.readouterr().err
+
+
+def test_parse_value():
+    assert cli._parse_value('1/4') == 0.25
+    assert cli._parse_value(' 2 ') == 2.
+    with pytest.raises(ValueError):
+        cli._parse_value('1/2/3')
+    assert np.isnan(cli._parse_or_nan('x', 1.))
+    assert cli._parse_or_nan('', 1.) == 1.
@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from columnar import FNAME_META, ColumnarResult, ColumnarWriter
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'result')
+    with ColumnarWriter(path, ['x', 'y'], metadata = {'mg': 2000}) as writer:
+        writer.append(np.array([[0., 1.], [2., 3.]]), ['Li2O', 'Li1.5Si0.25O1.25'])
+        writer.append(np.empty((0, 2)), [])
+        writer.append_frame(pd.DataFrame({'y': [5.], 'x': [4.]}, index = ['SiO₂']))
+    result = ColumnarResult(path)
+    assert len(result) == 3
+    assert result.metadata == {'mg': 2000}
+    assert isinstance(result['x'], np.memmap)
+    assert result['x'].tolist() == [0., 2., 4.]
+    assert result.products() == ['Li2O', 'Li1.5Si0.25O1.25', 'SiO₂']
+    assert result.products(slice(1, 2)) == ['Li1.5Si0.25O1.25']
+    df = result.frame(slice(1, None), columns = ['y'])
+    assert df.index.tolist() == ['Li1.5Si0.25O1.25', 'SiO₂'] and df['y'].tolist() == [3., 5.]
+    assert [len(df) for df in result.iter_frames(chunksize = 2)] == [2, 1]
+
+
+def test_without_products(tmp_path):
+    path = str(tmp_path / 'result')
+    with ColumnarWriter(path, ['x'], products = False) as writer:
+        writer.append(np.arange(4.))
+    result = ColumnarResult(path)
+    assert result.products(slice(1, 3)) == [1, 2]
+    assert result.frame()['x'].tolist() == [0., 1., 2., 3.]
+
+
+def test_empty_result(tmp_path):
+    path = str(tmp_path / 'result')
+    ColumnarWriter(path, ['x']).close()
+    result = ColumnarResult(path)
+    assert len(result) == 0 and result['x'].tolist() == [] and result.products() == []
+
+
+def test_products_are_required(tmp_path):
+    writer = ColumnarWriter(str(tmp_path / 'result'), ['x'])
+    with pytest.raises(ValueError):
+        writer.append(np.zeros((2, 1)), ['a'])
+    writer.close()
+
+
+def test_unfinished_write_is_not_a_result(tmp_path):
+    path = str(tmp_path / 'result')
+    ColumnarWriter(path, ['x']).close()
+    with pytest.raises(KeyError):
+        with ColumnarWriter(path, ['x']) as writer:     # 上書きを始めると前の結果は無効になる．
+            writer.append(np.zeros((1, 1)), ['a'])
+            raise KeyError
+    assert not os.path.exists(os.path.join(path, FNAME_META))
+    with pytest.raises(FileNotFoundError):
+        ColumnarResult(path)
+
+
+def test_sweep_to(tmp_path):
+    pytest.importorskip('element_recognition')
+    from calculator import WeighingCalculator
+    wc = WeighingCalculator(materials = ['Li2O', 'MoO3'])
+    grid = {'Li2O': [1, 2], 'MoO3': [0, 1, 2]}
+    result = wc.sweep_to(str(tmp_path / 'sweep'), grid, excess = {'Li2O': 0.05}, chunksize = 4)
+    expected = pd.concat(wc.sweep(grid, excess = {'Li2O': 0.05}))
+    assert result.products() == expected.index.tolist()
+    pd.testing.assert_frame_equal(result.frame(), expected)
+    assert result.metadata == {'materials': ['Li2O', 'MoO3'], 'mg': 2000., 'excess': {'Li2O': 0.05}, 'grid': {'Li2O': [1., 2.], 'MoO3': [0., 1., 2.]}}
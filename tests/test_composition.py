@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from composition import CompositionMatrix
+
+
+DENSE = np.array([
+    [2., 0., 1., 0.],
+    [0., 0., 0., 0.],
+    [0., 1., 2., 0.5],
+])
+
+
+def test_dense_round_trip():
+    counts = CompositionMatrix.from_dense(DENSE)
+    assert len(counts) == 3
+    assert counts.indptr.tolist() == [0, 2, 2, 5]
+    np.testing.assert_array_equal(counts.to_dense(), DENSE)
+    np.testing.assert_array_equal(counts.to_dense(np.array([2, 0])), DENSE[:, [2, 0]])
+    assert counts.used_columns().tolist() == [0, 1, 2, 3]
+
+
+def test_from_rows_and_row():
+    counts = CompositionMatrix.from_rows([(np.array([0, 2]), np.array([2., 1.])), (np.array([]), np.array([]))], 4)
+    np.testing.assert_array_equal(counts.to_dense(), DENSE[:2])
+    indices, data = counts.row(0)
+    assert indices.tolist() == [0, 2] and data.tolist() == [2., 1.]
+    assert len(CompositionMatrix.from_rows([], 4)) == 0
+
+
+def test_slice_and_concatenate():
+    counts = CompositionMatrix.from_dense(DENSE)
+    np.testing.assert_array_equal(counts[1:].to_dense(), DENSE[1:])
+    np.testing.assert_array_equal(counts[5:].to_dense(), np.zeros((0, 4)))
+    assert np.shares_memory(counts[2:].data, counts.data)
+    concatenated = CompositionMatrix.concatenate([counts[:1], counts[1:]], 4)
+    np.testing.assert_array_equal(concatenated.to_dense(), DENSE)
+    with pytest.raises(ValueError):
+        counts[::2]
+
+
+def test_dot():
+    counts = CompositionMatrix.from_dense(DENSE)
+    weights = np.array([1.008, 12.011, 15.999, 14.007])
+    np.testing.assert_allclose(counts.dot(weights), DENSE @ weights, rtol = 1e-15)
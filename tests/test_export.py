@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('element_recognition')
+pytest.importorskip('openpyxl')
+
+from openpyxl import load_workbook
+
+from calculator import CalculationCancelled, WeighingCalculator
+from export import INDEX, ResultTable, get_output_layout, iter_block_rows, write_workbook
+
+
+MATERIALS = ['Li2O', 'SiO2', 'MoO3']
+
+
+def _calc(**kwargs) -> WeighingCalculator:
+    wc = WeighingCalculator(materials = MATERIALS)
+    wc.calc(**{'progress_bar': False, **kwargs})
+    return wc
+
+
+def test_write_workbook(tmp_path):
+    wc = _calc(products = ['Li2SiO3', 'Na2O', 'Li2MoO4'], mg = 1000, excess = {'Li2O': 0.05})
+    path = str(tmp_path / 'weighing.xlsx')
+    write_workbook(path, wc)
+    ws = load_workbook(path).worksheets[0]
+    rows = [list(row) for row in ws.iter_rows(values_only = True)]
+    n_rows = len(INDEX) + 2
+    assert len(rows) == 2 * n_rows - 1  # 計算できなかったNa2Oは書き出さない (最後の空行は残らない)．
+    assert rows[0] == [None] + MATERIALS + ['Li2SiO3']
+    assert rows[n_rows][-1] == 'Li2MoO4'
+    # 2つ目のブロックの数式は自分の行を参照する．
+    assert rows[n_rows + 3] == ['mole (mmol)', '=B{0}/$E${0}*$E${1}'.format(n_rows + 3, n_rows + 4),
+                                '=C{0}/$E${0}*$E${1}'.format(n_rows + 3, n_rows + 4), '=D{0}/$E${0}*$E${1}'.format(n_rows + 3, n_rows + 4),
+                                '=E{0}/E{1}'.format(n_rows + 7, n_rows + 2)]
+    assert rows[4][1:] == [5, None, None, None]
+    assert rows[6][-1] == 1000
+
+
+def test_progress_of_the_rows():
+    wc = _calc(ratio = [[1, 1, 0], [1, 0, 1]])
+    reported = []
+    rows = list(iter_block_rows(wc, progress_bar = lambda done, total: reported.append((done, total))))
+    assert len(rows) == 2 * (len(INDEX) + 2)
+    assert reported == [(1, 2), (2, 2)]
+
+
+def test_write_workbook_can_be_cancelled(tmp_path):
+    wc = _calc(ratio = [[1, 1, 0], [1, 0, 1]])
+
+    def cancel(done, total):
+        raise CalculationCancelled
+
+    with pytest.raises(CalculationCancelled):
+        write_workbook(str(tmp_path / 'weighing.xlsx'), wc, progress_bar = cancel)
+    assert not (tmp_path / 'weighing.xlsx').exists()
+
+
+def test_values_of_the_layout():
+    wc = _calc(ratio = [[1, 1, 0], [2, 1, 1]], mg = 1000, excess = {'Li2O': 0.05})
+    layout = get_output_layout(tuple(MATERIALS))
+    assert get_output_layout(tuple(MATERIALS)) is layout
+    ar_values = layout.values(wc, 1)
+    np.testing.assert_allclose(ar_values[2, :-1], np.array([2, 1, 1]) * wc.moles[1])
+    np.testing.assert_allclose(ar_values[5, :-1], wc.df_material_weight.to_numpy()[1], rtol = 1e-12)
+    np.testing.assert_allclose(ar_values[6, :-1], wc.df_material_weight_excess.to_numpy()[1], rtol = 1e-12)
+    assert ar_values[6, -1] == pytest.approx(wc.df_material_weight_excess.to_numpy()[1].sum())
+    assert np.isnan(ar_values[3, 1:-1]).all()
+
+
+def test_tables_of_the_layout():
+    wc = _calc(ratio = [[1, 1, 0]], excess = {'Li2O': 0.05})
+    layout = get_output_layout(tuple(MATERIALS))
+    df_formula = layout.formula_table(wc)
+    assert df_formula.index.tolist() == list(INDEX)
+    assert df_formula.columns.tolist() == MATERIALS + wc.products
+    assert df_formula.loc['weight (mg)', wc.products[0]] == '=SUM(B8:D8)'
+    df_display = layout.display_table(wc)
+    assert df_display.loc['molar ratio'].tolist() == ['1.00', '1.00', '0.00', '1.00']
+    assert df_display.loc['excess ratio (mol%)'].tolist() == ['5.00', '', '', '']
+    assert df_display.loc['no excess weight (mg)', wc.products[0]] == '2000.00'
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'ratio': [[1, 1, 0], [0.33, 0.33, 0.34]]},
+    {'ratio': [['1/3', '1/3', '1/3']], 'rational': True},
+    {'products': ['Li2SiO3', 'Li2MoO4']},
+])
+def test_molar_mass_of_the_product_is_consistent(kwargs):
+    wc = _calc(mg = 1000, **kwargs)
+    layout = get_output_layout(tuple(MATERIALS))
+    for i in range(len(wc.products)):
+        ar_values = layout.values(wc, i)
+        # M.W. x mole = 完成量 = 原料の重量の和
+        assert ar_values[0, -1] * ar_values[2, -1] == pytest.approx(1000)
+        assert ar_values[5, :-1].sum() == pytest.approx(1000)
+
+
+def test_result_table():
+    wc = _calc(products = ['Li2SiO3', 'Na2O', 'Li2MoO4', 'Li4SiO4'], mg = 1000)
+    table = ResultTable(wc)
+    assert len(table) == 3     # 計算できなかったNa2Oは除く．
+    assert table.headings() == ['product', 'mole (mmol)', 'Li2O (mg)', 'SiO2 (mg)', 'MoO3 (mg)', 'total (mg)']
+    assert table.headings(col_start = 1, n_cols = 2) == ['product', 'Li2O (mg)', 'SiO2 (mg)']
+    rows = table.page()
+    assert [row[0] for row in rows] == ['Li2SiO3', 'Li2MoO4', 'Li4SiO4']
+    assert rows[0][1:] == ['{:.2f}'.format(x) for x in [wc.moles[0], *wc.df_material_weight_excess.iloc[0], 1000]]
+    assert table.page(start = 1, n_rows = 1, col_start = 3, n_cols = 1) == [['Li2MoO4', '{:.2f}'.format(wc.df_material_weight_excess.iloc[1, 2])]]
+
+
+def test_result_table_sort_and_filter():
+    wc = _calc(products = ['Li2SiO3', 'Li2MoO4', 'Li4SiO4', 'Li2Si2O5'])
+    table = ResultTable(wc)
+    table.sort('mole (mmol)')
+    moles = np.asarray(wc.moles)
+    assert table.order.tolist() == np.argsort(moles).tolist()
+    table.sort(ResultTable.COLUMN_PRODUCT, ascending = False)
+    assert [row[0] for row in table.page()] == ['Li4SiO4', 'Li2SiO3', 'Li2Si2O5', 'Li2MoO4']
+    table.filter('Si')
+    assert [row[0] for row in table.page()] == ['Li4SiO4', 'Li2SiO3', 'Li2Si2O5']   # 並びは保つ．
+    table.filter('Si', ranges = {'MoO3 (mg)': (None, 0), 'SiO2 (mg)': (1500, None)})
+    assert [row[0] for row in table.page()] == ['Li2Si2O5']
+    table.filter()
+    table.sort()
+    assert len(table) == 4 and table.order.tolist() == [0, 1, 2, 3]
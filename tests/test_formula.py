@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+element_recognition = pytest.importorskip('element_recognition').element_recognition
+
+from benchmarks.bench_formula import HYDRATES, PARITY
+from calculator import get_atomic_weights
+from formula import FormulaError, FormulaParser, MalformedFormulaError, parse_formula
+
+
+@pytest.fixture(scope = 'module')
+def parser():
+    return FormulaParser(get_atomic_weights().elements)
+
+
+def _counts(parser, formula:str) -> dict:
+    counts = parser.parse_many([formula])
+    return dict(zip([parser.elements[i] for i in counts.indices], counts.data))
+
+
+@pytest.mark.parametrize('formula', PARITY)
+def test_parity_with_element_recognition(parser, formula):
+    expected = element_recognition([formula], elements = parser.elements).values[0]
+    np.testing.assert_allclose(parser.parse_many([formula]).to_dense()[0], expected, rtol = 1e-12, atol = 0)
+
+
+@pytest.mark.parametrize('formula, expected', HYDRATES.items())
+def test_hydrates(parser, formula, expected):
+    assert _counts(parser, formula) == expected
+
+
+def test_parse_formula_order_and_fractions():
+    assert parse_formula('Ca(OH)2') == [('Ca', 1.0), ('O', 2.0), ('H', 2.0)]
+    assert parse_formula('Li1/3O') == [('Li', 1 / 3), ('O', 1.0)]
+
+
+@pytest.mark.parametrize('formula', ['(Li2O', 'Li2O)', 'Li2(O', '[Li2O)', 'Li2O·(H2O'])
+def test_unbalanced_brackets_are_not_handed_to_the_fallback(parser, formula):
+    with pytest.raises(MalformedFormulaError):
+        parser.parse_many(['Li2O', formula])
+
+
+def test_fallback_failure_is_formula_error(parser):
+    # element_recognitionが投げる例外 (ValueErrorなど) はFormulaErrorになる．
+    with pytest.raises(FormulaError):
+        parser.parse_many(['Li2O', 'Li$O'])
+
+
+def test_fallback_is_per_formula(parser):
+    # element_recognitionに任せるものがあっても他の組成の結果は変わらない．
+    dense = parser.parse_many(['Li2O', '2H2O', 'SiO2']).to_dense()
+    np.testing.assert_array_equal(dense[[0, 2]], parser.parse_many(['Li2O', 'SiO2']).to_dense())
@@ -0,0 +1,92 @@
+import pytest
+
+pytest.importorskip('element_recognition')
+pytest.importorskip('openpyxl')
+
+from openpyxl import load_workbook
+
+import importer
+from calculator import WeighingCalculator
+from export import write_workbook
+
+
+MATERIALS = ['Li2O', 'SiO2']
+
+
+def _write(path, ratio, mg = 1000, excess = {}):
+    wc = WeighingCalculator(materials = MATERIALS)
+    wc.calc(ratio = ratio, mg = mg, excess = excess, progress_bar = False)
+    write_workbook(str(path), wc)
+    return wc
+
+
+def _set_cached_values(path, wc, i = 0):
+    """write the values of the formulas, as Excel does when the file is saved there."""
+    from export import get_output_layout
+    layout = get_output_layout(tuple(wc.materials))
+    values = layout.values(wc, i)
+    wb = load_workbook(str(path))
+    ws = wb.worksheets[0]
+    first = 1 + i * layout.n_rows
+    for r, row in enumerate(values):
+        for c, x in enumerate(row):
+            cell = ws.cell(row = first + 1 + r, column = 2 + c)
+            if isinstance(cell.value, str) and cell.value.startswith('='):
+                cell.value = None if x != x else float(x)
+    wb.save(str(path))
+
+
+def test_read_workbook(tmp_path):
+    path = tmp_path / 'a.xlsx'
+    _write(path, [[1, 1], [2, 1]], excess = {'Li2O': 0.05})
+    recipes = importer.read_workbook(str(path))
+    assert [recipe['product'] for recipe in recipes] == ['Li2SiO3', 'Li4SiO4']
+    assert recipes[0]['materials'] == MATERIALS
+    assert recipes[1]['ratio'] == [2, 1]
+    assert recipes[0]['mg'] == 1000
+    assert recipes[0]['excess'] == pytest.approx({'Li2O': 0.05})
+
+
+def test_consistent_workbook_has_no_discrepancy(tmp_path):
+    path = tmp_path / 'a.xlsx'
+    wc = _write(path, [[1, 1]], excess = {'Li2O': 0.05})
+    _set_cached_values(path, wc)
+    assert list(importer.WorkbookImporter(n_threads = 1).run([str(path)])) == []
+
+
+def test_changed_weight_is_reported(tmp_path):
+    path = tmp_path / 'a.xlsx'
+    wc = _write(path, [[1, 1]])
+    _set_cached_values(path, wc)
+    wb = load_workbook(str(path))
+    wb.worksheets[0]['B8'] = wb.worksheets[0]['B8'].value * 1.01     # Li2Oの重量
+    wb.save(str(path))
+    discrepancies = list(importer.WorkbookImporter(n_threads = 1).run([str(path)]))
+    assert [(d['item'], d['column']) for d in discrepancies] == [(importer.IND_WEIGHT, 'Li2O')]
+    assert discrepancies[0]['relative_error'] == pytest.approx(0.01 / 1.01)
+
+
+def test_broken_files_do_not_stop_the_run(tmp_path):
+    good = tmp_path / 'good.xlsx'
+    _write(good, [[1, 1]])
+    bad_material = tmp_path / 'bad_material.xlsx'
+    _write(bad_material, [[1, 1]])
+    wb = load_workbook(str(bad_material))
+    wb.worksheets[0]['B1'] = '(Li2O'    # 読めない原料
+    wb.save(str(bad_material))
+    missing = tmp_path / 'missing.xlsx'
+
+    imp = importer.WorkbookImporter(n_threads = 2)
+    discrepancies = list(imp.run([str(bad_material), str(missing), str(good)]))
+    errors = {d['file']: d['message'] for d in discrepancies if d['item'] == importer.ITEM_ERROR}
+    assert set(errors) == {str(bad_material), str(missing)}
+    assert 'Unbalanced' in errors[str(bad_material)]
+    assert imp.n_files == 3
+    assert imp.n_recipes == 2
+
+
+def test_find_workbooks(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    for name in ('b.xlsx', 'sub/a.xlsx', '~$b.xlsx', 'c.csv'):
+        (tmp_path / name).write_bytes(b'')
+    assert importer.find_workbooks([str(tmp_path)]) == sorted([str(tmp_path / 'b.xlsx'), str(tmp_path / 'sub' / 'a.xlsx')])
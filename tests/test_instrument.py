@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+import instrument
+
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    monkeypatch.delenv(instrument.ENV_PROFILE, raising = False)
+    path = tmp_path / 'profile.jsonl'
+    instrument.configure(str(path))
+    yield path
+    instrument.configure()
+
+
+def _runs(path) -> list:
+    with open(str(path), encoding = 'utf_8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_disabled(tmp_path, monkeypatch):
+    monkeypatch.delenv(instrument.ENV_PROFILE, raising = False)
+    instrument.configure(False)
+    assert not instrument.enabled()
+    assert instrument.timer('a') is instrument.timer('b')   # 共有のno-op
+    with instrument.timer('a'):
+        instrument.count('rows')
+
+
+def test_environment_variable_takes_precedence(tmp_path, monkeypatch):
+    monkeypatch.setenv(instrument.ENV_PROFILE, '0')
+    instrument.configure(str(tmp_path / 'profile.jsonl'))
+    assert not instrument.enabled()
+    monkeypatch.setenv(instrument.ENV_PROFILE, '1')
+    instrument.configure(False)
+    assert instrument._path == instrument.path_profile_default
+    monkeypatch.delenv(instrument.ENV_PROFILE)
+    instrument.configure()
+
+
+def test_outermost_timer_is_a_run(path):
+    @instrument.timed('stage')
+    def stage():
+        instrument.count('rows', 10)
+
+    with instrument.timer('run'):
+        stage()
+        stage()
+    stage()     # 単独で呼ぶとそれ自体が一回の実行
+    runs = _runs(path)
+    assert [run['run'] for run in runs] == ['run', 'stage']
+    assert runs[0]['timers']['stage']['calls'] == 2
+    assert runs[0]['counters'] == {'rows': 20}
+    assert runs[1]['timers'] == {} and runs[1]['counters'] == {'rows': 10}
+
+
+def test_error_is_recorded(path):
+    with pytest.raises(KeyError):
+        with instrument.timer('run'):
+            raise KeyError
+    assert _runs(path)[0]['error'] == 'KeyError'
+
+
+def test_report(path):
+    for _ in range(3):
+        with instrument.timer('run'), instrument.timer('stage'):
+            pass
+    with open(str(path), mode = 'a', encoding = 'utf_8') as f:
+        f.write('{"run": "ru')  # 書きかけの行は無視する．
+    stats = instrument.report(str(path))
+    assert stats['run']['']['runs'] == 3
+    assert stats['run']['stage']['calls'] == 3
+    assert stats['run']['stage']['mean'] == pytest.approx(stats['run']['stage']['total'] / 3)
+
+
+def test_calc_is_instrumented(path):
+    pytest.importorskip('element_recognition')
+    from calculator import WeighingCalculator
+    wc = WeighingCalculator(materials = ['Li2O', 'SiO2'])
+    wc.calc(products = ['Li2SiO3', 'Li4SiO4'], progress_bar = False)
+    run = _runs(path)[-1]
+    assert run['run'] == 'calc'
+    assert {'solve_ratio', 'set_ratio', 'calc_weights'} <= set(run['timers'])
+    assert run['counters']['products_exact'] == 2
@@ -0,0 +1,9 @@
+import pytest
+
+pytest.importorskip('PySimpleGUI')
+
+from benchmarks.bench_startup import loaded_lazy_modules
+
+
+def test_heavy_modules_are_imported_lazily():
+    assert loaded_lazy_modules() == []
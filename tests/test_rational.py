@@ -0,0 +1,65 @@
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+from rational import as_integers, formula_weights, to_fraction, weigh
+
+
+@pytest.mark.parametrize('x, expected', [
+    ('1/3', Fraction(1, 3)), (' 2 / 6 ', Fraction(1, 3)), (0.1, Fraction(1, 10)), (1 / 3, Fraction(1, 3)),
+    (np.int64(2), Fraction(2)), (Fraction(5, 7), Fraction(5, 7)), ('0.125', Fraction(1, 8)),
+])
+def test_to_fraction(x, expected):
+    assert to_fraction(x) == expected
+
+
+def test_to_fraction_of_nan():
+    with pytest.raises(ValueError):
+        to_fraction(float('nan'))
+
+
+def test_as_integers_of_decimals():
+    numerators, denominators, mask_nan = as_integers([[0.1, 0.2, np.nan], [1, 2, 3]])
+    assert numerators.tolist() == [[1, 2, 0], [1, 2, 3]]
+    assert denominators.tolist() == [10, 1]
+    assert mask_nan.tolist() == [[False, False, True], [False, False, False]]
+    assert numerators.dtype == np.int64
+
+
+def test_as_integers_of_fractions():
+    numerators, denominators, _ = as_integers([['1/3', '1/6', Fraction(1, 2)]])
+    assert numerators.tolist() == [[2, 1, 3]]
+    assert denominators.tolist() == [6]
+
+
+def test_as_integers_of_fractions_and_nan():
+    # NaNとstrを混ぜるとnp.arrayでは'nan'になる．
+    numerators, denominators, mask_nan = as_integers(np.array([['1/3', np.nan], ['1', '2']]))
+    assert numerators.tolist() == [[1, 0], [1, 2]]
+    assert denominators.tolist() == [3, 1]
+    assert mask_nan.tolist() == [[False, True], [False, False]]
+
+
+def test_as_integers_of_large_values_are_python_ints():
+    numerators, denominators, _ = as_integers([['1/3', str(2 ** 60)]])
+    assert numerators.dtype == object
+    assert numerators.tolist() == [[1, 3 * 2 ** 60]] and denominators.tolist() == [3]
+
+
+def test_formula_weights():
+    # H2O, H2O2 (H: 1.008, O: 15.999)
+    numerators, denominator = formula_weights(np.array([[2, 1], [2, 2]]), np.array([1.008, 15.999]))
+    assert [Fraction(int(n), denominator) for n in numerators] == [Fraction('18.015'), Fraction('34.014')]
+
+
+def test_weigh_is_rounded_once():
+    ratio = as_integers([['1/3', '2/3'], [1, np.nan]])
+    fw = (np.array([29881, 60084]), 1000)   # 29.881, 60.084
+    moles, weights, weights_excess = weigh(*ratio, *fw, '2000', [Fraction(21, 20), 1])
+    fw_product = Fraction(1, 3) * Fraction('29.881') + Fraction(2, 3) * Fraction('60.084')
+    expected = [2000 * Fraction(1, 3) * Fraction('29.881') / fw_product, 2000 * Fraction(2, 3) * Fraction('60.084') / fw_product]
+    assert moles[0] == float(2000 / fw_product)
+    assert weights[0].tolist() == [float(x) for x in expected]
+    assert weights_excess[0, 0] == float(expected[0] * Fraction(21, 20))
+    assert np.isnan(moles[1]) and np.isnan(weights[1]).all()
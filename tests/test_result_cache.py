@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from result_cache import ResultCache, result_key
+
+
+MATERIALS = ['Li2O', 'SiO2']
+
+
+@pytest.mark.parametrize('a, b', [
+    ({'products': ['Li2 SiO3']}, {'products': ['Li2SiO3']}),
+    ({'ratio': [[1 / 3, 2 / 3]]}, {'ratio': [[0.333333333333, 0.666666666667]]}),
+    ({'ratio': [['1/3', '2 / 3']]}, {'ratio': [[0.333333333333, 0.666666666667]]}),
+    ({'ratio': [1, 2]}, {'ratio': np.array([[1, 2]])}),
+    ({'ratio': [[1, np.nan]]}, {'ratio': [[1., float('nan')]]}),
+    ({'ratio': [[1, 0.]], 'mg': 2000}, {'ratio': [[1, -0.]], 'mg': 2000.}),
+    ({'ratio': [[1, 1]], 'excess': {'Li2O': 0.05, 'SiO2': 0}}, {'ratio': [[1, 1]], 'excess': {'SiO2': 0., 'Li2O ': 0.05}}),
+])
+def test_same_key(a, b):
+    assert result_key(MATERIALS, **a) == result_key(MATERIALS, **b)
+    assert hash(result_key(MATERIALS, **a)) == hash(result_key(MATERIALS, **b))
+
+
+@pytest.mark.parametrize('a, b', [
+    ({'ratio': [[1, 2]]}, {'ratio': [[2, 1]]}),
+    ({'ratio': [[1, 2]]}, {'ratio': [[1, 2]], 'mg': 1000}),
+    ({'ratio': [[1, 2]]}, {'ratio': [[1, 2]], 'excess': {'Li2O': 0.05}}),
+    ({'ratio': [[1, 2]]}, {'ratio': [[1, 2]], 'rational': True}),
+    ({'products': ['Li2SiO3']}, {'products': ['Li2SiO3'], 'exact': False}),
+])
+def test_different_key(a, b):
+    assert result_key(MATERIALS, **a) != result_key(MATERIALS, **b)
+
+
+def test_order_of_materials_matters():
+    assert result_key(MATERIALS, ratio = [[1, 2]]) != result_key(list(reversed(MATERIALS)), ratio = [[1, 2]])
+
+
+def test_result_cache_is_lru():
+    cache = ResultCache(maxsize = 2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.info() == {'hits': 1, 'misses': 1, 'maxsize': 2, 'currsize': 2, 'hit_rate': 0.5}
+    cache.clear()
+    assert cache.info()['currsize'] == 0 and cache.get('a') is None
@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip('element_recognition')
+
+import server
+
+
+MATERIALS = ['Li2O', 'TiO2']
+
+
+def _request(requests:list) -> list:
+    """send (method, path, body) over one keep-alive connection and return [(status, payload)]."""
+    async def _run():
+        service = server.CalculationService()
+        tcp = await asyncio.start_server(lambda r, w: server._handle_connection(service, r, w), '127.0.0.1', 0)
+        port = tcp.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        responses = []
+        try:
+            for method, path, body in requests:
+                data = b'' if body is None else json.dumps(body).encode('utf_8')
+                writer.write('{0} {1} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {2}\r\n\r\n'.format(method, path, len(data)).encode('latin_1') + data)
+                await writer.drain()
+                status = int((await reader.readline()).split()[1])
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b''):
+                        break
+                    name, _, value = line.decode('latin_1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                responses.append((status, json.loads(await reader.readexactly(int(headers['content-length'])))))
+        finally:
+            writer.close()
+            tcp.close()
+            await tcp.wait_closed()
+            service.close()
+        return responses
+    return asyncio.run(_run())
+
+
+def test_calc_and_stats_on_one_connection():
+    (status, payload), (status_stats, stats) = _request([
+        ('POST', '/calc', {'materials': MATERIALS, 'records': [{'Li2O': 1, 'TiO2': 1}, {'product': 'Li2TiO3'}], 'mg': 1000, 'excess': {'Li2O': 5}}),
+        ('GET', '/stats', None),
+    ])
+    assert status == 200
+    assert [row['product'] for row in payload['rows']] == ['Li2TiO3', 'Li2TiO3']
+    assert payload['rows'][0]['Li2O_weight'] == pytest.approx(payload['rows'][0]['Li2O_weight_no_excess'] * 1.05)
+    assert status_stats == 200 and stats['records'] == 2
+
+
+@pytest.mark.parametrize('body', [
+    {'materials': MATERIALS, 'records': [], 'excess': [5]},
+    {'materials': MATERIALS, 'records': [], 'excess': {'Li2O': 'x'}},
+    {'materials': MATERIALS, 'records': [], 'mg': '1000'},
+    {'materials': MATERIALS, 'records': [{'Li2O': [1], 'TiO2': 1}]},
+    {'materials': MATERIALS, 'records': [{'product': 5}]},
+    {'materials': 'Li2O', 'records': []},
+    {'materials': MATERIALS, 'records': {}},
+    {'materials': ['(Li2O', 'TiO2'], 'records': [{'Li2O': 1, 'TiO2': 1}]},
+    {'materials': ['Li$O', 'TiO2'], 'records': []},
+    [],
+])
+def test_invalid_requests_are_400(body):
+    (status, payload), = _request([('POST', '/calc', body)])
+    assert status == 400
+    assert payload['error']
+
+
+def test_malformed_product_gives_empty_row():
+    (status, payload), = _request([('POST', '/calc', {'materials': MATERIALS, 'records': [{'product': '(Li2O'}, {'product': 'Li2TiO3'}], 'exact': False})])
+    assert status == 200
+    assert [row['total_weight'] is None for row in payload['rows']] == [True, False]
+
+
+def test_method_and_path():
+    (status_get, _), (status_unknown, _) = _request([('GET', '/calc', None), ('GET', '/unknown', None)])
+    assert (status_get, status_unknown) == (405, 404)
@@ -0,0 +1,77 @@
+import json
+import multiprocessing
+import os
+
+import pytest
+
+from storage import JSONStore, read_json, write_json_atomic
+
+
+def test_changes_are_written_by_flush(tmp_path):
+    path = str(tmp_path / 'cache.json')
+    store = JSONStore(path)
+    store['Li2O'] = 29.88
+    assert store.get('Li2O') == 29.88
+    assert not os.path.exists(path)
+    store.flush()
+    assert read_json(path) == {'Li2O': 29.88}
+
+
+def test_changes_of_other_instances_are_kept(tmp_path):
+    path = str(tmp_path / 'cache.json')
+    a, b = JSONStore(path), JSONStore(path)
+    a.get('x')  # 読み込んでから
+    b.set('SiO2', 60.08)
+    b.flush()
+    a.update({'Li2O': 29.88})
+    a.flush()
+    assert read_json(path) == {'SiO2': 60.08, 'Li2O': 29.88}
+    assert a.to_dict() == {'SiO2': 60.08, 'Li2O': 29.88}
+
+
+def test_broken_file_is_read_as_default(tmp_path):
+    path = tmp_path / 'cache.json'
+    path.write_text('{"Li2O": 29.', encoding = 'utf_8')
+    assert read_json(str(path), {}) == {}
+    store = JSONStore(str(path))
+    assert 'Li2O' not in store
+    store['Li2O'] = 29.88
+    store.flush()
+    assert read_json(str(path)) == {'Li2O': 29.88}
+
+
+def test_failed_write_leaves_the_old_file(tmp_path):
+    path = str(tmp_path / 'cache.json')
+    write_json_atomic(path, {'Li2O': 29.88})
+    with pytest.raises(TypeError):
+        write_json_atomic(path, {'Li2O': object()})
+    assert read_json(path) == {'Li2O': 29.88}
+    assert os.listdir(str(tmp_path)) == ['cache.json']
+
+
+def test_discard(tmp_path):
+    path = str(tmp_path / 'cache.json')
+    store = JSONStore(path)
+    store['Li2O'] = 29.88
+    store.discard()
+    store.flush()
+    assert not os.path.exists(path)
+
+
+def _write_keys(path:str, worker:int, n_keys:int):
+    store = JSONStore(path)
+    for i in range(n_keys):
+        store['{0}-{1}'.format(worker, i)] = i
+        store.flush()
+
+
+def test_concurrent_writers(tmp_path):
+    path = str(tmp_path / 'cache.json')
+    processes = [multiprocessing.Process(target = _write_keys, args = (path, worker, 20)) for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    with open(path, encoding = 'utf_8') as f:
+        assert len(json.load(f)) == 80
@@ -0,0 +1,113 @@
+import copy
+import sqlite3
+
+import numpy as np
+import pytest
+
+pytest.importorskip('element_recognition')
+
+from calculator import AtomicWeights, WeighingCalculator
+from store import ResultStore
+
+
+MATERIALS = ['Li2O', 'La2O3', 'TiO2']
+PRODUCTS = ['Li0.5La0.5TiO3']
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultStore(str(tmp_path / 'results.sqlite3'))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def wc():
+    return WeighingCalculator(materials = MATERIALS)
+
+
+def test_identical_calculation_is_served_and_logged_as_reference(store, wc):
+    assert not store.calc(wc, products = PRODUCTS, progress_bar = False)
+    weights = wc.df_material_weight_excess.copy()
+    assert store.calc(wc, products = PRODUCTS, progress_bar = False)
+    assert store.calc(wc, products = PRODUCTS, progress_bar = False)
+    assert store.info() == {'hits': 2, 'misses': 1, 'runs': 1, 'reused': 0, 'reuses': 2}
+    np.testing.assert_array_equal(wc.df_material_weight_excess.to_numpy(), weights.to_numpy())
+    assert wc.products == PRODUCTS
+
+
+def test_stored_weights_are_returned_as_they_are(store, wc):
+    store.calc(wc, ratio = [[1, 1, 1]], progress_bar = False)
+    # 保存されている値を書き換えると，それが返る (計算し直していない)．
+    store._conn.execute('UPDATE runs SET weights = ?', (np.full(3, 7., dtype = '<f8').tobytes(), ))
+    store.calc(wc, ratio = [[1, 1, 1]], progress_bar = False)
+    np.testing.assert_array_equal(wc.df_material_weight_excess.to_numpy(), [[7., 7., 7.]])
+
+
+def test_different_mg_reuses_the_ratio(store, wc):
+    store.calc(wc, products = PRODUCTS, progress_bar = False)
+    assert store.calc(wc, products = PRODUCTS, mg = 1000, excess = {'Li2O': 0.1}, progress_bar = False)
+    expected = WeighingCalculator(materials = MATERIALS)
+    expected.calc(products = PRODUCTS, mg = 1000, excess = {'Li2O': 0.1}, progress_bar = False)
+    np.testing.assert_allclose(wc.df_material_weight_excess.to_numpy(), expected.df_material_weight_excess.to_numpy())
+    assert store.info()['runs'] == 2
+    assert store.info()['reused'] == 1
+
+
+def test_rational_mode_restores_the_exact_ratio(store, wc):
+    store.calc(wc, ratio = [['1/3', '1/3', '1/3']], mg = 1000, rational = True, progress_bar = False)
+    expected = wc.df_material_weight.to_numpy().copy()
+    wc_new = WeighingCalculator(materials = MATERIALS)
+    assert store.calc(wc_new, ratio = [['1/3', '1/3', '1/3']], mg = 1000, rational = True, progress_bar = False)
+    assert wc_new.rational
+    numerators, denominators, _ = wc_new._ratio_exact
+    assert numerators.tolist() == [[1, 1, 1]] and denominators.tolist() == [3]
+    np.testing.assert_array_equal(wc_new.df_material_weight.to_numpy(), expected)
+    # 比率からの有理数モードと浮動小数点数モードは別の結果
+    assert not store.calc(wc_new, ratio = [[1 / 3, 1 / 3, 1 / 3]], mg = 1000, progress_bar = False)
+
+
+def test_changed_atomic_weights_are_not_served(store, wc):
+    store.calc(wc, products = PRODUCTS, progress_bar = False)
+    table = wc.atomic_weights
+    weights = table.weights.copy()
+    weights[table.index['Li']] += 0.01
+    wc.atomic_weights = AtomicWeights(table.elements, weights, table.mtime_ns)
+    assert not store.calc(wc, products = PRODUCTS, progress_bar = False)
+
+
+def test_appended_incremental_result_is_found_by_product(store, wc):
+    store.calc(wc, products = PRODUCTS, exact = True, retry_inexact = True, progress_bar = False)
+    wc_updated = copy.deepcopy(wc)
+    wc_updated.update_mg(500)
+    store.append(wc_updated)    # GUIでmgだけ変えたとき
+    assert store.calc(wc, products = PRODUCTS, mg = 500, exact = True, retry_inexact = True, progress_bar = False)
+    assert store.info()['reuses'] == 1
+
+
+def test_search(store, wc):
+    store.calc(wc, ratio = [[1, 1, 1], [1, 2, 0]], progress_bar = False)
+    df = store.search(product = wc.products[0])
+    assert len(df) == 1
+    np.testing.assert_allclose(df['weights'][0], wc.df_material_weight_excess.to_numpy()[0])
+    assert len(store.search(materials = list(reversed(MATERIALS)))) == 2
+    assert len(store.search(product = 'Li2O')) == 0
+
+
+def test_old_database_is_migrated(tmp_path, wc):
+    path = str(tmp_path / 'old.sqlite3')
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE runs (
+            id INTEGER PRIMARY KEY, created_at REAL NOT NULL, materials TEXT NOT NULL, materials_key TEXT NOT NULL,
+            input_key TEXT NOT NULL, key TEXT NOT NULL, mg REAL NOT NULL, excess TEXT NOT NULL,
+            inexact_products TEXT NOT NULL, products TEXT NOT NULL, ratio BLOB NOT NULL
+        );
+    ''')
+    conn.close()
+    store = ResultStore(path)
+    try:
+        assert not store.calc(wc, products = PRODUCTS, progress_bar = False)
+        assert store.calc(wc, products = PRODUCTS, progress_bar = False)
+    finally:
+        store.close()